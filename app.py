@@ -1,15 +1,41 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response
 from flask_cors import CORS
 import re
-from collections import Counter
+from collections import Counter, OrderedDict, deque
 import json
 import requests
+from requests.adapters import HTTPAdapter
 from PyPDF2 import PdfReader
 import io
 from werkzeug.utils import secure_filename
 import os
+import time
+import copy
+import hashlib
+import sqlite3
+import queue
+import uuid
+import csv
+import zipfile
+import threading
+import functools
+import contextlib
+import contextvars
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
 from docx import Document
 
+try:
+    import pdfplumber  # optional: ใช้อ่าน PDF ที่ PyPDF2 อ่านข้อความไม่ได้
+except ImportError:
+    pdfplumber = None
+
+try:
+    import numpy as np  # optional: ใช้กับ embedding index (PREFILTER_METHOD = 'embedding')
+except ImportError:
+    np = None
+
 app = Flask(__name__)
 CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -19,7 +45,149 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "llama3.2:1b"  # ใช้โมเดลขนาดเล็กที่ติดตั้งอยู่แล้ว
 
-# ฐานข้อมูลตำแหน่งงาน (เหลือ 1 ตำแหน่ง)
+# Sampling options ที่ส่งให้ Ollama (ใช้เป็นส่วนหนึ่งของ cache key ด้วย)
+OLLAMA_OPTIONS = {
+    "temperature": 0.2,  # ลดเพื่อให้ดึงข้อมูลแม่นกว่าเดิม
+    "top_p": 0.9,
+    "top_k": 40,  # จำกัดคำตอบให้เลือกจาก top 40 tokens
+    "num_predict": 2048,  # maxTokens: 2048
+    "repeat_penalty": 1.15,  # ลดการซ้ำคำ
+    "num_ctx": 4096  # เพิ่ม context window
+}
+
+# เวอร์ชันของ prompt วิเคราะห์ (เปลี่ยนทุกครั้งที่แก้ prompt เพื่อไม่ให้ใช้ cache เก่า)
+ANALYSIS_PROMPT_VERSION = "3"
+# เวอร์ชันของข้อมูลที่ document_store เก็บไว้ (แถวที่เป็นเวอร์ชันอื่นถือว่าไม่มีใน store)
+# DOCUMENT_EXTRACT_VERSION: เปลี่ยนเมื่อแก้การอ่านข้อความจาก PDF/DOCX
+# PROFILE_VERSION: เปลี่ยนเมื่อแก้ clean_resume_text หรือการดึงข้อมูลส่วนตัว (regex/Llama)
+DOCUMENT_EXTRACT_VERSION = "3"
+PROFILE_VERSION = "3"
+
+# การตั้งค่า cache ผลการวิเคราะห์
+ANALYSIS_CACHE_MAX_ENTRIES = 512  # จำนวน entry สูงสุดใน memory (LRU)
+ANALYSIS_CACHE_TTL = 24 * 60 * 60  # วินาที - อายุของผลลัพธ์ใน cache
+ANALYSIS_CACHE_DB_PATH = None  # เช่น 'uploads/analysis_cache.sqlite3' เพื่อเปิด cache บน disk
+ANALYSIS_CACHE_MAX_DISK_ENTRIES = 10000  # จำนวน entry สูงสุดใน SQLite
+
+# เก็บข้อความที่อ่านจากไฟล์ที่อัปโหลด (key คือ SHA-256 ของไฟล์) ไฟล์ซ้ำจะไม่ต้องอ่านใหม่ (None = ปิด)
+DOCUMENT_STORE_PATH = os.path.join(app.config['UPLOAD_FOLDER'], 'documents.sqlite3')
+DOCUMENT_STORE_MAX_ENTRIES = 5000  # จำนวนไฟล์/Resume สูงสุดที่เก็บไว้ (ลบที่ไม่ได้ใช้นานที่สุดก่อน)
+
+# ถ้า regex ดึงชื่อ อีเมล เบอร์โทรได้ครบ ให้ข้ามการเรียก Llama เพื่อดึงข้อมูลส่วนตัว
+SKIP_LLM_PERSONAL_INFO_IF_REGEX_COMPLETE = True
+
+# การตั้งค่าคิวงานวิเคราะห์แบบ async (/api/jobs/<job_id>)
+JOB_QUEUE_MAX_SIZE = 20  # จำนวนงานที่รอในคิวได้สูงสุด (เกินแล้วตอบ 429)
+JOB_WORKERS = 2  # จำนวน worker threads ที่ประมวลผลคิว
+JOB_RESULT_TTL = 60 * 60  # วินาที - เก็บผลลัพธ์ของงานที่เสร็จแล้วไว้นานเท่าไร
+JOB_RETRY_AFTER = 30  # วินาที - ค่า Retry-After ที่ตอบกลับเมื่อคิวเต็ม
+
+# การตั้งค่า progress ของการวิเคราะห์ (/api/progress?id=<job_id>)
+PROGRESS_TTL = 60 * 60  # วินาที - ลบ progress ที่ไม่มีการอัปเดตนานเกินนี้
+INITIAL_POSITION_TIME_ESTIMATE = 45  # วินาที - ใช้ประมาณเวลาต่อตำแหน่งจนกว่าจะมีข้อมูลจริง
+
+STREAM_KEEPALIVE_INTERVAL = 15  # วินาที - ส่ง keep-alive comment ใน /api/analyze-stream ระหว่างรอผล
+
+# อ่าน response จาก Ollama แบบ stream แล้วหยุดทันทีที่ JSON object ปิดครบ
+OLLAMA_STREAM_EARLY_STOP = True
+# หลัง JSON ปิดครบ อ่านต่ออีกไม่เกินกี่ chunk เพื่อรอ chunk สุดท้าย (done) ที่มีเวลา prompt_eval จาก Ollama
+# (เมื่อใช้ structured output โมเดลจบทันทีหลัง JSON จึงได้ chunk done แทบไม่เสียเวลา)
+OLLAMA_STREAM_DONE_GRACE_CHUNKS = 8
+
+# ให้ Ollama เก็บโมเดล (และ prompt cache ของ Resume ล่าสุด) ไว้ใน memory ระหว่างการเรียก (None = ใช้ค่าของ Ollama)
+# prompt วิเคราะห์ขึ้นต้นด้วยคำสั่งและ Resume ที่เหมือนกันทุกตำแหน่ง และมี JD อยู่ท้ายสุด
+# ตำแหน่งถัดไปของ Resume เดียวกันจึงไม่ต้อง evaluate ส่วนต้นของ prompt ใหม่
+OLLAMA_KEEP_ALIVE = "30m"
+LLM_METRICS_HISTORY = 200  # จำนวนการเรียก Llama ล่าสุดที่เก็บเวลาไว้ (/api/llm-metrics)
+
+# ให้ Ollama บังคับ output ของการวิเคราะห์เป็น JSON (structured outputs) และดึงข้อมูลส่วนตัว
+# ใน generation เดียวกับผลวิเคราะห์ (ไม่เรียก Llama แยกเพื่อดึงข้อมูลส่วนตัว)
+# 'schema' = ส่ง ANALYSIS_JSON_SCHEMA, 'json' = format: "json", None = ใช้ prompt อย่างเดียวแบบเดิม
+ANALYSIS_OUTPUT_FORMAT = 'schema'
+
+BATCH_MAX_FILES = 500  # จำนวนไฟล์ Resume สูงสุดต่อ 1 batch (/api/batch-screen)
+BATCH_MAX_TOTAL_BYTES = 256 * 1024 * 1024  # ขนาดรวมสูงสุดของไฟล์ใน 1 batch (หลังแตก zip)
+
+# ความยาว Resume สูงสุดที่ใส่ใน prompt (หลัง clean แล้ว)
+RESUME_PROMPT_MAX_CHARS = 2000
+
+# การอ่านข้อความจาก PDF/DOCX
+EXTRACT_MAX_PAGES = 30  # อ่าน PDF ไม่เกินกี่หน้า
+EXTRACT_MAX_CHARS = 50000  # เก็บข้อความที่อ่านได้ไม่เกินกี่ตัวอักษร (โหมด deep และ /api/upload-pdf)
+# ไฟล์ที่อัปโหลดเพื่อวิเคราะห์จะหยุดอ่านหน้า/ย่อหน้าที่เหลือเมื่อได้ข้อความครบเท่านี้
+# (เผื่อส่วนที่ถูกตัดออกตอน clean และใช้หาทักษะ/ข้อมูลส่วนตัว) ส่ง deep=true เพื่ออ่านทั้งไฟล์
+EXTRACT_ANALYSIS_MAX_CHARS = RESUME_PROMPT_MAX_CHARS * 4
+PDF_PAGE_TIMEOUT = 10  # วินาที - เวลาสูงสุดต่อหน้า (หน้าที่ค้างเกินนี้จะถูกหยุด และไม่อ่านหน้าที่เหลือ)
+# PDF ที่มีหน้ามากกว่าหรือเท่านี้อ่านใน worker process ซึ่งหยุดหน้าที่ค้างเกิน PDF_PAGE_TIMEOUT ได้จริง
+# (None = ไม่ใช้) ไฟล์ที่เล็กกว่าอ่านใน process นี้ ซึ่งตรวจเวลาได้หลังอ่านแต่ละหน้าเสร็จเท่านั้น
+# worker ต้อง import แอปใหม่ตอนเริ่ม และได้ไฟล์ทั้งไฟล์ไป parse เอง จึงคุ้มเฉพาะไฟล์ที่มีหลายสิบหน้า
+PDF_PROCESS_POOL_MIN_PAGES = None
+PDF_PROCESS_WORKERS = 2  # จำนวน worker ที่อ่านหน้าของ PDF 1 ไฟล์พร้อมกัน
+PDF_PROCESS_CHUNK_PAGES = 4  # จำนวนหน้าที่ส่งให้ worker ต่อครั้ง (หยุดกลางคันแล้วทิ้งงานไม่เกินเท่านี้ต่อ worker)
+PDF_IDLE_WORKERS = 4  # จำนวน worker process ที่เก็บไว้ใช้ซ้ำ (ไม่ต้องเริ่ม process ใหม่ทุกไฟล์)
+PDF_WORKER_START_TIMEOUT = 30  # วินาที - เวลาเริ่ม worker process ใหม่ (ไม่นับรวมใน PDF_PAGE_TIMEOUT)
+
+# การคัดกรองตำแหน่งแบบเร็วก่อนส่งให้ LLM (two-stage pipeline)
+PREFILTER_ENABLED = True
+PREFILTER_TOP_K = 10  # ส่งให้ LLM ไม่เกินกี่ตำแหน่งต่อ Resume (None = ไม่จำกัด)
+PREFILTER_MIN_SCORE = 1  # คะแนน lexical ขั้นต่ำ (0-100) ที่จะส่งให้ LLM (None = ไม่กรอง)
+
+# พจนานุกรมทักษะเพิ่มเติม (JSON: {"ชื่อทักษะ": ["alias", ...]}) รวมกับค่าเริ่มต้นในโค้ด
+SKILL_DICTIONARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'skills.json')
+
+# ที่เก็บตำแหน่งงาน: None = ใช้ JOB_POSITIONS_DATABASE ใน memory,
+# ไฟล์ .json หรือ .db/.sqlite = เก็บถาวร (ถ้ายังไม่มีไฟล์จะสร้างจาก JOB_POSITIONS_DATABASE)
+POSITIONS_STORE_PATH = None
+POSITIONS_RELOAD_INTERVAL = 2  # วินาที - ตรวจไฟล์ที่ถูกแก้จากภายนอก (hot reload) ไม่บ่อยกว่านี้
+
+# วิธีจัดอันดับตำแหน่งก่อนส่งให้ LLM: 'lexical' (เทียบคำ/ทักษะ) หรือ 'embedding' (ต้องมี numpy)
+PREFILTER_METHOD = 'lexical'
+
+# Semantic scoring ด้วย embedding จาก Ollama (/api/embed)
+OLLAMA_EMBED_MODEL = "nomic-embed-text"
+EMBEDDING_BATCH_SIZE = 32  # จำนวน JD ที่ส่งไป embed ต่อ 1 request
+EMBEDDING_MAX_CHARS = 4000  # ตัดข้อความก่อน embed
+EMBEDDING_INDEX_PATH = None  # เช่น 'cache/position_embeddings.npy' เพื่อเก็บ embeddings ของตำแหน่งไว้ข้าม restart
+EMBEDDING_ADHOC_MAX_ENTRIES = 256  # จำนวน embedding ของ JD ที่ไม่ได้อยู่ใน position_store ที่เก็บไว้ใน memory (LRU)
+
+JD_PROMPT_MAX_CHARS = 1000  # ความยาว Job Description สูงสุดที่ใส่ใน prompt
+JOB_FEATURES_CACHE_SIZE = 256  # จำนวน JD ที่ไม่ได้อยู่ใน position_store ที่เก็บ features ไว้
+SKILL_MATRIX_CACHE_SIZE = 4  # จำนวนชุดตำแหน่งที่เก็บ SkillMatrix ไว้ (bulk_skill_scores)
+
+# การตั้งค่า connection pool สำหรับ Ollama
+OLLAMA_POOL_SIZE = 4  # จำนวน connection สูงสุดที่เปิดค้างไว้ต่อ Ollama host (จำกัด concurrent requests)
+OLLAMA_CONNECT_TIMEOUT = 5  # วินาที - timeout ตอนเปิด connection
+OLLAMA_READ_TIMEOUT = 300  # วินาที - timeout ตอนรอ response (generation ใช้เวลานาน)
+
+# Ollama หลายเครื่อง: list ของ URL /api/generate (ว่าง = ใช้ OLLAMA_API_URL เครื่องเดียว)
+# เช่น ["http://10.0.0.11:11434/api/generate", "http://10.0.0.12:11434/api/generate"]
+OLLAMA_BACKENDS = []
+OLLAMA_ROUTING = 'least_outstanding'  # 'least_outstanding' หรือ 'round_robin'
+OLLAMA_BACKEND_MAX_CONCURRENCY = OLLAMA_POOL_SIZE  # จำนวน request พร้อมกันสูงสุดต่อเครื่อง
+OLLAMA_HEALTH_CHECK_INTERVAL = 30  # วินาที - ตรวจ /api/tags ของทุกเครื่อง (สถานะและโมเดลที่มี)
+OLLAMA_CIRCUIT_FAILURES = 3  # timeout/connection error ติดกันกี่ครั้งถึงหยุดส่งงานให้เครื่องนั้น
+OLLAMA_CIRCUIT_COOLDOWN = 60  # วินาที - พักเครื่องที่ circuit เปิดนานเท่าไรก่อนลองใหม่
+
+# นโยบาย retry ของ call_llama (exponential backoff + jitter)
+LLM_MAX_RETRIES = 2  # จำนวนครั้งที่ลองใหม่สูงสุดต่อการเรียก 1 ครั้ง
+LLM_RETRY_BASE_DELAY = 1  # วินาที - เวลารอก่อนลองใหม่ครั้งแรก (เพิ่มเป็น 2 เท่าทุกครั้ง)
+LLM_RETRY_MAX_DELAY = 20  # วินาที - เวลารอสูงสุดระหว่างการลองใหม่
+# วินาที - เวลารวมสูงสุดของการเรียก Llama ใน 1 HTTP request ที่รอผล (client ส่ง "deadline" มาให้สั้นกว่านี้ได้)
+# เมื่อหมดเวลา ตำแหน่งที่เหลือจะใช้ fallback analysis แทน (None = ไม่จำกัด)
+# งาน async ใช้ deadline เฉพาะเมื่อ client ส่งมา
+LLM_REQUEST_DEADLINE = 600
+
+# จำนวนตำแหน่งงานที่วิเคราะห์พร้อมกันสูงสุด (ไม่ควรเกินจำนวน request พร้อมกันที่ Ollama ทุกเครื่องรับได้)
+ANALYSIS_MAX_WORKERS = OLLAMA_BACKEND_MAX_CONCURRENCY * max(1, len(OLLAMA_BACKENDS))
+
+# วิเคราะห์หลายตำแหน่งใน prompt เดียว (ส่ง Resume ครั้งเดียวต่อกลุ่ม แล้วให้โมเดลตอบผลของทุกตำแหน่งเป็น array)
+# จำนวนตำแหน่งต่อ prompt ขึ้นกับ num_ctx ใน OLLAMA_OPTIONS
+MULTI_POSITION_PROMPT = False
+MULTI_POSITION_MAX_PER_CALL = 5  # จำนวนตำแหน่งสูงสุดต่อ prompt
+MULTI_POSITION_OUTPUT_TOKENS = 450  # token ที่เผื่อไว้ให้คำตอบของแต่ละตำแหน่ง
+PROMPT_BYTES_PER_TOKEN = 3  # ใช้ประมาณจำนวน token จากขนาด UTF-8 (ภาษาไทย ~1 token ต่อตัวอักษร)
+
+# ตำแหน่งงานเริ่มต้น (ใช้สร้าง position_store ถ้ายังไม่มีข้อมูล)
 JOB_POSITIONS_DATABASE = [
     {
         "title": "Full-Stack Developer",
@@ -36,8 +204,428 @@ Requirements:
     }
 ]
 
-def call_llama(prompt, model=None, max_retries=2):
-    """เรียกใช้ Llama 3.2 ผ่าน Ollama API (มี retry mechanism)"""
+class OllamaClient:
+    """Client สำหรับเรียก Ollama API แบบใช้ connection pool ร่วมกัน (keep-alive)
+
+    - ใช้ requests.Session เดียวทั้งแอป เพื่อไม่ต้องเปิด TCP connection ใหม่ทุกครั้ง
+    - pool_size จำกัดจำนวน connection ที่เปิดพร้อมกันต่อ Ollama host
+      (pool_block=True ทำให้ thread ที่เกินต้องรอ แทนที่จะเปิด connection เพิ่ม)
+    - แยก connect timeout กับ read timeout
+    """
+
+    def __init__(self, api_url=OLLAMA_API_URL, pool_size=OLLAMA_POOL_SIZE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT):
+        self.api_url = api_url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=0  # retry จัดการเองใน call_llama
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _timeout(self, read_timeout=None):
+        # read_timeout (เช่นเวลาที่เหลือก่อน deadline) ใช้แทน read timeout ปกติถ้าสั้นกว่า
+        if read_timeout is None:
+            return self.timeout
+        return (self.timeout[0], max(0.1, min(self.timeout[1], read_timeout)))
+
+    def generate(self, payload, read_timeout=None):
+        """ส่ง payload ไปที่ /api/generate แล้วคืนค่า JSON response"""
+        response = self.session.post(self.api_url, json=payload, timeout=self._timeout(read_timeout))
+        response.raise_for_status()
+        return response.json()
+
+    def generate_stream(self, payload, read_timeout=None):
+        """ส่ง payload แบบ stream แล้ว yield แต่ละบรรทัด (JSON) ที่ Ollama ส่งมา
+        ถ้าผู้เรียกหยุดอ่านกลางคัน connection จะถูกปิด และ Ollama จะหยุด generate"""
+        response = self.session.post(self.api_url, json=dict(payload, stream=True),
+                                     timeout=self._timeout(read_timeout), stream=True)
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+        finally:
+            response.close()
+
+    def embed(self, texts, model=OLLAMA_EMBED_MODEL):
+        """ส่งข้อความหลายข้อความไปที่ /api/embed แล้วคืนค่า list ของ embedding vectors"""
+        embed_url = self.api_url.rsplit('/api/', 1)[0] + '/api/embed'
+        response = self.session.post(embed_url, json={'model': model, 'input': list(texts)}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['embeddings']
+
+    def close(self):
+        self.session.close()
+
+class LlamaCallAborted(Exception):
+    """การเรียก Llama ถูกยกเลิก (client ปิด connection) หรือหมดเวลาตาม deadline ของ request"""
+
+class LlamaCallBudget:
+    """Deadline และการยกเลิกของงานวิเคราะห์ 1 งาน ใช้ร่วมกันทุกการเรียก Llama ในงานนั้น
+
+    - deadline เริ่มนับเมื่อ start() (ครั้งแรกที่งานเริ่มรัน) None = ไม่จำกัดเวลา
+    - cancel() เมื่อ client ปิด connection ระหว่างรอผล การเรียกที่เหลือจะหยุดทันที
+    - ส่งต่อให้ call_llama ผ่าน current_llm_budget (contextvar) ด้วย llm_call_budget / run_with_llm_budget
+    """
+
+    def __init__(self, deadline_seconds=None):
+        self.deadline_seconds = deadline_seconds
+        self.deadline = None
+        self._cancelled = threading.Event()
+
+    def start(self):
+        if self.deadline is None and self.deadline_seconds:
+            self.deadline = time.time() + self.deadline_seconds
+        return self
+
+    def remaining(self):
+        """วินาทีที่เหลือก่อนถึง deadline (None = ไม่จำกัด)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """raise LlamaCallAborted ถ้างานถูกยกเลิกหรือหมดเวลาแล้ว"""
+        if self.cancelled:
+            raise LlamaCallAborted("client ยกเลิกการวิเคราะห์")
+        if self.remaining() == 0:
+            raise LlamaCallAborted(f"เกิน deadline {self.deadline_seconds} วินาที")
+
+    def sleep(self, seconds):
+        """รอ seconds วินาที (หยุดรอทันทีถ้าถูกยกเลิก) คืนค่า False ถ้าถูกยกเลิกระหว่างรอ"""
+        return not self._cancelled.wait(seconds)
+
+# budget ของงานที่กำลังรันใน thread/context นี้ (None = ไม่มี deadline)
+current_llm_budget = contextvars.ContextVar('current_llm_budget', default=None)
+
+@contextlib.contextmanager
+def llm_call_budget(budget):
+    """ให้ call_llama ทุกครั้งภายใน with ใช้ budget นี้"""
+    token = current_llm_budget.set(budget.start() if budget else None)
+    try:
+        yield budget
+    finally:
+        current_llm_budget.reset(token)
+
+def run_with_llm_budget(budget, func, *args, **kwargs):
+    """รัน func ภายใต้ budget (ใช้กับงานในคิว async ซึ่ง deadline เริ่มนับตอนงานเริ่มรัน)"""
+    with llm_call_budget(budget):
+        return func(*args, **kwargs)
+
+def submit_with_context(executor, func, *args):
+    """executor.submit ที่ส่ง contextvars (เช่น current_llm_budget) ไปยัง worker thread ด้วย"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+class NoBackendAvailable(requests.exceptions.ConnectionError):
+    """ไม่มี Ollama backend ที่ใช้งานได้ (ทุกเครื่อง circuit เปิดอยู่)"""
+
+class OllamaBackend:
+    """สถานะของ Ollama 1 เครื่องใน OllamaRouter (ใช้ภายใต้ lock ของ router)"""
+
+    def __init__(self, api_url, max_concurrency):
+        self.api_url = api_url
+        self.base_url = api_url.rsplit('/api/', 1)[0]
+        self.client = OllamaClient(api_url, pool_size=max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.open_until = 0  # circuit เปิด (ไม่ส่งงานให้) จนถึงเวลานี้
+        self.models = None  # ชื่อโมเดลที่มีในเครื่อง (None = ยังไม่รู้)
+        self.missing_models = set()  # โมเดลที่เครื่องตอบ 404 (ล้างเมื่อ health check ครั้งถัดไป)
+        self.requests = 0
+        self.failures = 0
+        self.last_error = ''
+
+    def is_open(self, now):
+        return self.open_until > now
+
+    def has_model(self, model):
+        if not model:
+            return True
+        model = normalize_model_name(model)
+        return model not in self.missing_models and (self.models is None or model in self.models)
+
+    def stats(self, now):
+        return {
+            'url': self.api_url,
+            'outstanding': self.outstanding,
+            'max_concurrency': self.max_concurrency,
+            'circuit_open': self.is_open(now),
+            'consecutive_failures': self.consecutive_failures,
+            'requests': self.requests,
+            'failures': self.failures,
+            'models': sorted(self.models) if self.models is not None else None,
+            'last_error': self.last_error
+        }
+
+def normalize_model_name(model):
+    """ชื่อโมเดลแบบที่ /api/tags ใช้ (ไม่มี tag = :latest)"""
+    return model if ':' in model else model + ':latest'
+
+class OllamaRouter:
+    """กระจาย request ไปยัง Ollama หลายเครื่อง (interface เดียวกับ OllamaClient)
+
+    - เลือกเครื่องแบบ least_outstanding (งานค้างน้อยที่สุด) หรือ round_robin
+    - จำกัด request พร้อมกันต่อเครื่อง ถ้าทุกเครื่องเต็มจะรอจนมีเครื่องว่าง
+    - circuit breaker: timeout/connection error/5xx ติดกัน failure_threshold ครั้ง จะไม่ส่งงานให้เครื่องนั้น
+      cooldown วินาที (ถ้าทุกเครื่อง circuit เปิดจะ raise NoBackendAvailable ทันทีแทนการรอ timeout)
+    - health check /api/tags ทุก health_check_interval วินาที (background thread เริ่มเมื่อมี request แรก)
+      เพื่อเปิด/ปิด circuit และรู้ว่าแต่ละเครื่องมีโมเดลอะไร (ส่งงานให้เฉพาะเครื่องที่มีโมเดลที่ขอ)
+    """
+
+    def __init__(self, api_urls=None, routing=OLLAMA_ROUTING, max_concurrency=OLLAMA_BACKEND_MAX_CONCURRENCY,
+                 health_check_interval=OLLAMA_HEALTH_CHECK_INTERVAL, failure_threshold=OLLAMA_CIRCUIT_FAILURES,
+                 cooldown=OLLAMA_CIRCUIT_COOLDOWN):
+        self.backends = [OllamaBackend(url, max_concurrency) for url in (api_urls or [OLLAMA_API_URL])]
+        self.routing = routing
+        self.health_check_interval = health_check_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._next = 0
+        self._condition = threading.Condition()
+        self._health_thread = None
+
+    @property
+    def api_url(self):
+        return ', '.join(backend.api_url for backend in self.backends)
+
+    def _choose(self, model):
+        """เลือกเครื่องที่ circuit ปิดและมีโมเดล คืน None ถ้าทุกเครื่องเต็ม (raise ถ้าไม่มีเครื่องที่ใช้ได้เลย)"""
+        now = time.time()
+        available = [backend for backend in self.backends if not backend.is_open(now)]
+        if not available:
+            raise NoBackendAvailable(f"Ollama ทุกเครื่อง circuit เปิดอยู่ ({self.api_url})")
+        # เครื่องที่รู้ว่ามีโมเดล (หรือยังไม่รู้) ถ้าไม่มีเครื่องไหนมีเลยให้ลองทุกเครื่องที่ใช้ได้
+        candidates = [backend for backend in available if backend.has_model(model)] or available
+        free = [backend for backend in candidates if backend.outstanding < backend.max_concurrency]
+        if not free:
+            return None
+        # เริ่มไล่จากเครื่องถัดจากที่เลือกครั้งก่อน (round robin และใช้ตัดสินเมื่องานค้างเท่ากัน)
+        count = len(self.backends)
+        free.sort(key=lambda backend: (self.backends.index(backend) - self._next) % count)
+        if self.routing == 'least_outstanding':
+            chosen = min(free, key=lambda backend: backend.outstanding)
+        else:
+            chosen = free[0]
+        self._next = (self.backends.index(chosen) + 1) % count
+        return chosen
+
+    def acquire(self, model=None):
+        """จองเครื่องสำหรับ 1 request (รอถ้าทุกเครื่องเต็ม) ต้องเรียก release เมื่อเสร็จ
+        ระหว่างรอจะ raise LlamaCallAborted ถ้างานถูกยกเลิกหรือเกิน deadline (current_llm_budget)"""
+        self._start_health_checks()
+        budget = current_llm_budget.get()
+        with self._condition:
+            while True:
+                backend = self._choose(model)
+                if backend is not None:
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+                if budget:
+                    budget.check()
+                self._condition.wait(timeout=1)
+
+    def release(self, backend, error=None, model=None):
+        """คืนเครื่องหลังจบ request และบันทึกผล (error ที่เป็น timeout/connection/5xx นับเข้า circuit breaker)"""
+        with self._condition:
+            backend.outstanding -= 1
+            if error is None:
+                backend.consecutive_failures = 0
+            elif self._is_model_missing(error):
+                # เครื่องนี้ไม่มีโมเดลที่ขอ ครั้งหน้าจะไม่ส่งโมเดลนี้มาอีก (จนกว่า health check จะเจอ)
+                if model:
+                    backend.missing_models.add(normalize_model_name(model))
+            elif self._is_backend_failure(error):
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                backend.last_error = str(error)[:200]
+                if backend.consecutive_failures >= self.failure_threshold:
+                    backend.open_until = time.time() + self.cooldown
+                    print(f"⚠️  Ollama {backend.api_url}: ล้มเหลวติดกัน {backend.consecutive_failures} ครั้ง "
+                          f"หยุดส่งงาน {self.cooldown} วินาที")
+            self._condition.notify_all()
+
+    @staticmethod
+    def _is_model_missing(error):
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code == 404
+
+    @staticmethod
+    def _is_backend_failure(error):
+        if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+            return True
+        response = getattr(error, 'response', None)
+        return response is not None and response.status_code >= 500
+
+    def generate(self, payload, read_timeout=None):
+        backend = self.acquire(payload.get('model'))
+        try:
+            result = backend.client.generate(payload, read_timeout=read_timeout)
+        except Exception as e:
+            self.release(backend, e, payload.get('model'))
+            raise
+        self.release(backend)
+        return result
+
+    def generate_stream(self, payload, read_timeout=None):
+        """เหมือน OllamaClient.generate_stream โดยจองเครื่องไว้จนกว่าผู้เรียกจะอ่านจบหรือปิด generator"""
+        backend = self.acquire(payload.get('model'))
+        error = None
+        try:
+            yield from backend.client.generate_stream(payload, read_timeout=read_timeout)
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.release(backend, error, payload.get('model'))
+
+    def embed(self, texts, model=OLLAMA_EMBED_MODEL):
+        backend = self.acquire(model)
+        try:
+            result = backend.client.embed(texts, model=model)
+        except Exception as e:
+            self.release(backend, e, model)
+            raise
+        self.release(backend)
+        return result
+
+    def check_health(self, backend):
+        """ตรวจ /api/tags ของเครื่อง: ได้ผล = ปิด circuit และอัปเดตรายชื่อโมเดล, ไม่ได้ = เปิด circuit"""
+        try:
+            response = backend.client.session.get(backend.base_url + '/api/tags',
+                                                  timeout=(backend.client.timeout[0], backend.client.timeout[0]))
+            response.raise_for_status()
+            models = {normalize_model_name(m['name']) for m in response.json().get('models', []) if m.get('name')}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._condition:
+                backend.last_error = str(e)[:200]
+                backend.consecutive_failures = max(backend.consecutive_failures, self.failure_threshold)
+                backend.open_until = time.time() + self.health_check_interval
+            return False
+        with self._condition:
+            backend.models = models
+            backend.missing_models = set()
+            backend.consecutive_failures = 0
+            backend.open_until = 0
+            self._condition.notify_all()
+        return True
+
+    def _start_health_checks(self):
+        # เริ่ม health check thread ครั้งแรกที่มี request (ไม่ทำถ้ามีเครื่องเดียวหรือปิดไว้)
+        if self._health_thread is not None or not self.health_check_interval or len(self.backends) < 2:
+            return
+        with self._condition:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name='ollama-health-check', daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                self.check_health(backend)
+            time.sleep(self.health_check_interval)
+
+    def stats(self):
+        now = time.time()
+        with self._condition:
+            return {
+                'routing': self.routing,
+                'backends': [backend.stats(now) for backend in self.backends]
+            }
+
+    def close(self):
+        for backend in self.backends:
+            backend.client.close()
+
+# Client ที่ใช้ร่วมกันทั้งแอป (กระจายงานไปยัง OLLAMA_BACKENDS หรือ OLLAMA_API_URL ถ้าไม่ได้ตั้งไว้)
+ollama_client = OllamaRouter(OLLAMA_BACKENDS)
+
+class JsonObjectScanner:
+    """นับ brackets ทีละ chunk เพื่อหาจุดที่ JSON object ตัวแรก (top-level) ปิดครบ
+
+    ใช้ได้ทั้งกับข้อความเต็ม และกับ token ที่ทยอยมาจาก Ollama แบบ stream
+    """
+
+    def __init__(self):
+        self.start_idx = None
+        self.end_idx = None
+        self._pos = 0
+        self._bracket_count = 0
+        self._in_string = False
+        self._escape_next = False
+
+    @property
+    def complete(self):
+        return self.end_idx is not None
+
+    def feed(self, chunk):
+        """สแกนข้อความส่วนถัดไป (ต่อจาก chunk ก่อนหน้า)
+        คืนค่า True เมื่อเจอ JSON object ที่ปิดครบแล้ว (ตำแหน่งอยู่ใน start_idx/end_idx)"""
+        if self.complete:
+            return True
+        
+        offset = self._pos
+        self._pos += len(chunk)
+        
+        for i, char in enumerate(chunk, offset):
+            if self.start_idx is None:
+                if char == '{':
+                    self.start_idx = i
+                else:
+                    continue
+            
+            if self._escape_next:
+                self._escape_next = False
+                continue
+            
+            if char == '\\':
+                self._escape_next = True
+                continue
+            
+            if char == '"':
+                self._in_string = not self._in_string
+                continue
+            
+            if not self._in_string:
+                if char == '{':
+                    self._bracket_count += 1
+                elif char == '}':
+                    self._bracket_count -= 1
+                    if self._bracket_count == 0:
+                        self.end_idx = i + 1
+                        return True
+        
+        return False
+
+def extract_json_object(response):
+    """คืนข้อความของ JSON object ตัวแรกใน response (ถ้าไม่ปิดครบจะคืน string ว่าง)"""
+    scanner = JsonObjectScanner()
+    scanner.feed(response)
+    if scanner.start_idx is None:
+        raise json.JSONDecodeError("No JSON object found", response, 0)
+    if not scanner.complete:
+        return ""
+    return response[scanner.start_idx:scanner.end_idx]
+
+def resolve_ollama_model(model=None):
+    """แปลงชื่อโมเดลจาก frontend ให้เป็นชื่อที่ Ollama ใช้"""
     # ใช้ model ที่ส่งมา หรือใช้ default
     selected_model = model if model else OLLAMA_MODEL
     
@@ -70,165 +658,618 @@ def call_llama(prompt, model=None, max_retries=2):
         else:
             ollama_model = OLLAMA_MODEL  # fallback to default
     
+    return ollama_model
+
+def ollama_timings(response):
+    """ดึงเวลาจาก response ของ Ollama (หน่วย nanoseconds) เป็น milliseconds"""
+    timings = {}
+    for key in ('total_duration', 'load_duration', 'prompt_eval_duration', 'eval_duration'):
+        if response.get(key) is not None:
+            timings[key.replace('_duration', '_ms')] = round(response[key] / 1e6, 1)
+    for key in ('prompt_eval_count', 'eval_count'):
+        if response.get(key) is not None:
+            timings[key] = response[key]
+    return timings
+
+class LlamaCallMetrics:
+    """เก็บเวลาของการเรียก Llama ล่าสุด (ดูได้ที่ /api/llm-metrics)
+
+    แต่ละรายการมี seconds (เวลารวมฝั่ง client), first_token_seconds (โหมด stream)
+    และเวลาจาก Ollama เช่น prompt_eval_ms / prompt_eval_count (จาก chunk สุดท้าย ซึ่งโหมด stream
+    ได้รับเมื่อโมเดลจบภายใน OLLAMA_STREAM_DONE_GRACE_CHUNKS หลัง JSON ปิด ไม่งั้นดู first_token_seconds แทน)
+    ใช้ดูว่า prompt_eval ลดลงหลังตำแหน่งแรกของ Resume เดียวกันหรือไม่ (prompt cache ของ Ollama)
+    """
+
+    def __init__(self, history=LLM_METRICS_HISTORY):
+        self._calls = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def record(self, model, label, seconds, timings):
+        entry = dict(timings, model=model, label=label or '', seconds=round(seconds, 2), at=time.time())
+        with self._lock:
+            self._calls.append(entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            calls = list(self._calls)
+        summary = {'calls': len(calls)}
+        for key in ('seconds', 'first_token_seconds', 'prompt_eval_ms', 'prompt_eval_count', 'eval_ms'):
+            values = [call[key] for call in calls if call.get(key) is not None]
+            summary['avg_' + key] = round(sum(values) / len(values), 2) if values else None
+        summary['recent'] = calls[-20:]
+        return summary
+
+llm_call_metrics = LlamaCallMetrics()
+
+def format_call_metrics(entry):
+    """ข้อความสรุปเวลาของการเรียก Llama 1 ครั้ง (ใช้ใน log)"""
+    parts = [f"{entry['seconds']:.1f} วินาที"]
+    if entry.get('first_token_seconds') is not None:
+        parts.append(f"token แรก {entry['first_token_seconds']:.1f} วินาที")
+    if entry.get('prompt_eval_ms') is not None:
+        parts.append(f"prompt_eval {entry.get('prompt_eval_count', '?')} tokens {entry['prompt_eval_ms']:.0f} ms")
+    if entry.get('eval_ms') is not None:
+        parts.append(f"eval {entry.get('eval_count', '?')} tokens {entry['eval_ms']:.0f} ms")
+    return ', '.join(parts)
+
+def read_llama_stream(client, payload, timings=None, budget=None, read_timeout=None):
+    """อ่าน response จาก Ollama แบบ stream และหยุดทันทีเมื่อ JSON object ตัวแรกปิดครบ
+    (ไม่ต้องรอให้โมเดลพิมพ์ข้อความอื่นต่อท้าย JSON)
+    timings (dict) จะได้ first_token_seconds และเวลาจาก Ollama จาก chunk สุดท้าย
+    (หลัง JSON ปิดจะรอ chunk สุดท้ายอีกไม่เกิน OLLAMA_STREAM_DONE_GRACE_CHUNKS chunk เมื่อขอ timings)
+    ถ้า budget ถูกยกเลิกหรือเกิน deadline ระหว่างอ่าน จะปิด connection แล้ว raise LlamaCallAborted"""
+    scanner = JsonObjectScanner()
+    tokens = []
+    result = None
+    grace = OLLAMA_STREAM_DONE_GRACE_CHUNKS if timings is not None else 0
+    start = time.time()
+    chunks = client.generate_stream(payload, read_timeout=read_timeout)
+    try:
+        for chunk in chunks:
+            if budget:
+                budget.check()
+            if chunk.get('done'):
+                if timings is not None:
+                    timings.update(ollama_timings(chunk))
+            if result is not None:
+                # JSON ครบแล้ว อ่านต่อเพื่อรอเวลาจาก chunk สุดท้ายเท่านั้น (ไม่เก็บ token)
+                grace -= 1
+                if chunk.get('done') or grace <= 0:
+                    break
+                continue
+            token = chunk.get('response', '')
+            if token:
+                if not tokens and timings is not None:
+                    # เวลาถึง token แรก ≈ เวลาโหลดโมเดล + prompt eval
+                    timings['first_token_seconds'] = round(time.time() - start, 2)
+                tokens.append(token)
+                if scanner.feed(token):
+                    # JSON ครบแล้ว ไม่ต้องรอส่วนที่เหลือ
+                    result = ''.join(tokens)[:scanner.end_idx]
+                    if grace <= 0 or chunk.get('done'):
+                        break
+            if chunk.get('done'):
+                break
+    finally:
+        # ปิด connection (ถ้าปิดก่อนจบ Ollama จะหยุด generate ส่วนที่เกิน)
+        chunks.close()
+    return result if result is not None else ''.join(tokens)
+
+def is_retryable_llm_error(error):
+    """timeout, connection error และ HTTP 429/5xx ลองใหม่ได้
+    HTTP 4xx อื่นๆ (เช่นไม่มีโมเดล, payload ผิด) ลองใหม่ก็ได้ผลเหมือนเดิม"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code == 429 or response.status_code >= 500
+    return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+def llm_retry_delay(attempt):
+    """เวลารอก่อนลองใหม่ครั้งที่ attempt + 1: exponential backoff แบบ equal jitter
+    (ครึ่งหนึ่งคงที่ อีกครึ่งสุ่ม เพื่อไม่ให้ request ที่ล้มเหลวพร้อมกันกลับมาพร้อมกัน)"""
+    delay = min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def call_llama(prompt, model=None, max_retries=None, client=None, stream=None, output_format=None, label=None):
+    """เรียกใช้ Llama 3.2 ผ่าน Ollama API (มี retry mechanism)
+    
+    stream=True (default: OLLAMA_STREAM_EARLY_STOP) จะอ่าน response แบบ stream
+    และหยุดทันทีที่ JSON object ตัวแรกปิดครบ
+    output_format: ส่งเป็น "format" ของ Ollama ("json" หรือ JSON schema) เพื่อบังคับรูปแบบ output
+    label: ชื่อที่ใช้ใน log และ llm_call_metrics (เช่นชื่อตำแหน่ง)
+    
+    retry (สูงสุด max_retries ครั้ง, default: LLM_MAX_RETRIES) เฉพาะ error ที่ลองใหม่ได้ (is_retryable_llm_error)
+    และ response ว่าง โดยรอ llm_retry_delay ก่อนแต่ละครั้ง
+    ถ้ามี current_llm_budget: read timeout ไม่เกินเวลาที่เหลือ, ไม่ retry ถ้ารอแล้วจะเกิน deadline
+    และหยุดทันทีเมื่อ client ยกเลิก (คืนค่า None ให้ผู้เรียกใช้ fallback)
+    """
+    stream = OLLAMA_STREAM_EARLY_STOP if stream is None else stream
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    # ใช้ client ที่ส่งมา หรือใช้ shared client (connection pool เดียวกัน)
+    client = client or ollama_client
+    budget = current_llm_budget.get()
+    
+    ollama_model = resolve_ollama_model(model)
+    
     # Log model ที่ใช้
     print(f"🤖 ใช้โมเดล: {ollama_model}")
     
+    payload = {
+        "model": ollama_model,
+        "prompt": prompt,
+        "stream": False,
+        "options": OLLAMA_OPTIONS
+    }
+    if output_format:
+        payload["format"] = output_format
+    if OLLAMA_KEEP_ALIVE is not None:
+        payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    
     for attempt in range(max_retries + 1):
         try:
-            payload = {
-                "model": ollama_model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.2,  # ลดเพื่อให้ดึงข้อมูลแม่นกว่าเดิม
-                    "top_p": 0.9,
-                    "top_k": 40,  # จำกัดคำตอบให้เลือกจาก top 40 tokens
-                    "num_predict": 2048,  # maxTokens: 2048
-                    "repeat_penalty": 1.15,  # ลดการซ้ำคำ
-                    "num_ctx": 4096  # เพิ่ม context window
-                }
-            }
-            
-            response = requests.post(OLLAMA_API_URL, json=payload, timeout=300)
-            response.raise_for_status()
+            if budget:
+                budget.check()
+            read_timeout = budget.remaining() if budget else None
             
-            result = response.json()
-            llama_response = result.get("response", "").strip()
+            call_start = time.time()
+            timings = {}
+            if stream:
+                llama_response = read_llama_stream(client, payload, timings, budget=budget,
+                                                   read_timeout=read_timeout).strip()
+            else:
+                result = client.generate(payload, read_timeout=read_timeout)
+                timings.update(ollama_timings(result))
+                llama_response = result.get("response", "").strip()
+            entry = llm_call_metrics.record(ollama_model, label, time.time() - call_start, timings)
+            print(f"   ⏱️  {label or ollama_model}: {format_call_metrics(entry)}")
             
             if llama_response:
                 return llama_response
-            else:
-                if attempt < max_retries:
-                    print(f"⚠️  Llama API return empty response, retrying... ({attempt + 1}/{max_retries})")
-                    continue
-                else:
-                    print(f"⚠️  Llama API return empty response after {max_retries + 1} attempts")
-                    return None
-                    
-        except requests.exceptions.Timeout:
-            if attempt < max_retries:
-                print(f"⚠️  Timeout, retrying... ({attempt + 1}/{max_retries})")
-                continue
-            else:
-                print(f"❌ Error calling {ollama_model}: Timeout after {max_retries + 1} attempts")
-                return None
-        except requests.exceptions.ConnectionError as e:
-            if attempt < max_retries:
-                print(f"⚠️  Connection error, retrying... ({attempt + 1}/{max_retries})")
-                continue
-            else:
-                print(f"❌ Error calling {ollama_model}: Connection error - {e}")
-                print(f"   ตรวจสอบว่า Ollama service กำลังทำงานอยู่ที่ {OLLAMA_API_URL}")
-                return None
+            error_message = "Llama API return empty response"
+        except LlamaCallAborted as e:
+            print(f"⚠️  {label or ollama_model}: หยุดเรียก {ollama_model} ({e})")
+            return None
         except requests.exceptions.RequestException as e:
-            if attempt < max_retries:
-                print(f"⚠️  Request error, retrying... ({attempt + 1}/{max_retries})")
-                continue
+            if not is_retryable_llm_error(e):
+                print(f"❌ Error calling {ollama_model}: {e} (ไม่ลองใหม่)")
+                return None
+            if isinstance(e, requests.exceptions.Timeout):
+                error_message = "Timeout"
+            elif isinstance(e, requests.exceptions.ConnectionError):
+                error_message = f"Connection error - {e}"
             else:
-                print(f"❌ Error calling {ollama_model}: {e}")
+                error_message = f"Request error - {e}"
+        
+        if attempt >= max_retries:
+            print(f"❌ Error calling {ollama_model}: {error_message} after {max_retries + 1} attempts")
+            if error_message.startswith("Connection error"):
+                print(f"   ตรวจสอบว่า Ollama service กำลังทำงานอยู่ที่ {client.api_url}")
+            return None
+        
+        delay = llm_retry_delay(attempt)
+        remaining = budget.remaining() if budget else None
+        if remaining is not None and delay >= remaining:
+            print(f"❌ Error calling {ollama_model}: {error_message} (เหลือเวลาไม่พอให้ลองใหม่ก่อน deadline)")
+            return None
+        print(f"⚠️  {error_message}, retrying in {delay:.1f}s... ({attempt + 1}/{max_retries})")
+        if budget:
+            if not budget.sleep(delay):
+                print(f"⚠️  {label or ollama_model}: client ยกเลิกการวิเคราะห์ระหว่างรอ retry")
                 return None
+        else:
+            time.sleep(delay)
     
     return None
 
-def extract_text_from_pdf(pdf_file):
-    """อ่านข้อความจากไฟล์ PDF"""
+def join_text_limited(parts, max_chars=EXTRACT_MAX_CHARS, status=None):
+    """รวมข้อความทีละส่วน (หน้า/ย่อหน้า) ด้วย join และหยุดอ่านส่วนที่เหลือเมื่อครบ max_chars
+    (ถ้าส่ง status มาและหยุดเพราะครบ max_chars จะตั้ง status['complete'] = False)"""
+    collected = []
+    total = 0
+    for part in parts:
+        if not part or not part.strip():
+            continue
+        collected.append(part)
+        total += len(part) + 1
+        if max_chars and total >= max_chars:
+            if status is not None:
+                status['complete'] = False
+            break
+    text = "\n".join(collected).strip()
+    return text[:max_chars] if max_chars else text
+
+def _pdf_worker_main(conn):
+    """วนรับงาน ('extract', job_id, data, start, stop) แล้วส่งข้อความกลับทีละหน้า (รันใน worker process)
+    
+    ส่ง ('ready', 0) เมื่อพร้อม, ('page', job_id, text) ทีละหน้า และ ('done', job_id) เมื่อจบงานเสมอ
+    data เป็น None = อ่านช่วงหน้าถัดไปของไฟล์เดิม (ไม่ parse ไฟล์ใหม่)
+    ถ้าได้รับ ('stop',) ระหว่างงาน จะหยุดอ่านหน้าที่เหลือ
+    """
+    conn.send(('ready', 0))
+    reader = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] != 'extract':
+            continue
+        _, job_id, data, start, stop = message
+        try:
+            if data is not None:
+                reader = PdfReader(io.BytesIO(data))
+            for page_number in range(start, stop):
+                if conn.poll() and conn.recv()[0] == 'stop':
+                    break
+                conn.send(('page', job_id, reader.pages[page_number].extract_text() or ''))
+        except Exception as e:
+            conn.send(('error', job_id, str(e)))
+        conn.send(('done', job_id))
+
+class PdfWorker:
+    """worker process 1 ตัวที่อ่าน PDF ได้ทีละงาน (ผู้ใช้ยืมจาก PdfWorkerPool แบบเป็นเจ้าของคนเดียว)"""
+    
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_pdf_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job_id = 0
+        self.busy = False
+        self.ready = False
+    
+    def start(self, data, start, stop):
+        self.job_id += 1
+        self.busy = True
+        self.conn.send(('extract', self.job_id, data, start, stop))
+    
+    def receive(self, timeout):
+        """รอข้อความของงานปัจจุบัน คืนค่า None ถ้าเกิน timeout (worker ใหม่ได้เวลาเริ่มเพิ่มอีก PDF_WORKER_START_TIMEOUT)"""
+        while self.conn.poll(timeout if self.ready else timeout + PDF_WORKER_START_TIMEOUT):
+            message = self.conn.recv()
+            if message[0] == 'ready':
+                self.ready = True
+                continue
+            if message[1] != self.job_id:
+                continue
+            if message[0] == 'done':
+                self.busy = False
+            return message
+        return None
+    
+    def finish(self, timeout):
+        """หยุดงานที่ยังค้าง (ถ้ามี) แล้วรอให้พร้อมรับงานใหม่ คืนค่า False ถ้า worker ไม่ตอบ"""
+        if self.busy:
+            self.conn.send(('stop',))
+        while self.busy:
+            if self.receive(timeout) is None:
+                return False
+        return True
+    
+    def kill(self):
+        self.process.kill()
+        self.conn.close()
+
+class PdfWorkerPool:
+    """worker process สำหรับอ่าน PDF ที่แต่ละ request ยืมไปใช้เอง
+    
+    หน้าที่ค้างเกิน timeout จะ kill เฉพาะ worker ของ request นั้น (request อื่นไม่ได้รับผลกระทบ)
+    worker ที่ว่างถูกเก็บไว้ใช้ซ้ำไม่เกิน max_idle ตัว
+    """
+    
+    def __init__(self, max_idle=PDF_IDLE_WORKERS):
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context('spawn')
+    
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        return PdfWorker(self._context)
+    
+    def release(self, worker, timeout=PDF_PAGE_TIMEOUT):
+        """คืน worker (หยุดงานที่ค้างก่อน) ถ้า worker ไม่ตอบหรือ idle เต็มจะ kill ทิ้ง"""
+        if worker.process.is_alive() and worker.finish(timeout):
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(worker)
+                    return
+        worker.kill()
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.kill()
+
+pdf_workers = PdfWorkerPool()
+
+def extract_pdf_pages_in_pool(data, page_count, workers=PDF_PROCESS_WORKERS, page_timeout=PDF_PAGE_TIMEOUT,
+                              chunk_pages=PDF_PROCESS_CHUNK_PAGES, status=None):
+    """อ่าน PDF ใน worker process คืน generator ของข้อความแต่ละหน้าตามลำดับ
+    
+    หน้าถูกแบ่งเป็นช่วงละ chunk_pages หน้า ส่งให้ worker แบบวนรอบ และส่งช่วงถัดไปเมื่อผู้อ่านอ่านช่วงเดิมครบแล้ว
+    (worker แต่ละตัว parse ไฟล์ครั้งเดียว และอ่านล่วงหน้าไม่เกิน 1 ช่วง)
+    แต่ละหน้าต้องเสร็จภายใน page_timeout ไม่เช่นนั้นจะ kill worker ตัวนั้นแล้วไม่อ่านหน้าที่เหลือ
+    ถ้าผู้อ่านหยุดกลางคัน (ได้ข้อความครบแล้ว) worker จะหยุดอ่านหน้าที่เหลือแล้วถูกคืนให้ pool
+    หน้าที่เกินเวลาหรืออ่านไม่ได้จะตั้ง status['interrupted'] = True (ข้อความไม่ครบ)
+    """
+    chunks = [(start, min(start + chunk_pages, page_count)) for start in range(0, page_count, chunk_pages)]
+    acquired = []
+    try:
+        for start, stop in chunks[:workers]:
+            worker = pdf_workers.acquire()
+            acquired.append(worker)
+            worker.start(data, start, stop)
+    except Exception:
+        for worker in acquired:
+            pdf_workers.release(worker, page_timeout)
+        raise
+    return _read_pdf_worker_pages(acquired, chunks, page_timeout, status)
+
+def _mark_interrupted(status):
+    if status is not None:
+        status['complete'] = False
+        status['interrupted'] = True
+
+def _read_pdf_worker_pages(workers, chunks, page_timeout, status=None):
+    pending = list(workers)
+    try:
+        for number, (start, stop) in enumerate(chunks):
+            worker = workers[number % len(workers)]
+            for page_number in range(start, stop + 1):
+                message = worker.receive(page_timeout)
+                if message is None:
+                    print(f"⚠️  อ่าน PDF หน้า {page_number + 1} เกินเวลา หยุดอ่านหน้าที่เหลือ")
+                    _mark_interrupted(status)
+                    pending.remove(worker)
+                    worker.kill()
+                    return
+                if message[0] == 'page' and page_number < stop:
+                    yield message[2]
+                    continue
+                if message[0] == 'error':
+                    print(f"⚠️  อ่าน PDF หน้า {page_number + 1} ไม่ได้: {message[2]}")
+                if message[0] != 'done' or page_number < stop:
+                    _mark_interrupted(status)
+                    return
+            # worker อ่านช่วงนี้ครบแล้ว ส่งช่วงถัดไปของ worker ตัวนี้
+            next_number = number + len(workers)
+            if next_number < len(chunks):
+                worker.start(None, *chunks[next_number])
+    finally:
+        for worker in pending:
+            pdf_workers.release(worker, page_timeout)
+
+def iter_pdf_pages(reader, page_count, page_timeout=PDF_PAGE_TIMEOUT, status=None):
+    """yield ข้อความทีละหน้าใน process นี้ ถ้าหน้าใดใช้เวลาเกิน page_timeout จะไม่อ่านหน้าที่เหลือ
+    และตั้ง status['interrupted'] = True
+    (ตรวจได้หลังหน้านั้นอ่านเสร็จเท่านั้น หน้าที่ค้างจริงต้องใช้ extract_pdf_pages_in_pool)"""
+    for page_number in range(page_count):
+        page_start = time.time()
+        yield reader.pages[page_number].extract_text() or ''
+        if time.time() - page_start > page_timeout and page_number + 1 < page_count:
+            print(f"⚠️  อ่าน PDF หน้า {page_number + 1} ใช้เวลานานเกินไป หยุดอ่านหน้าที่เหลือ")
+            _mark_interrupted(status)
+            return
+
+def extract_text_from_pdf_with_pdfplumber(stream, max_pages=EXTRACT_MAX_PAGES, max_chars=EXTRACT_MAX_CHARS,
+                                          status=None):
+    """อ่าน PDF ด้วย pdfplumber (ใช้เมื่อ PyPDF2 อ่านข้อความไม่ได้)"""
+    stream.seek(0)
+    with pdfplumber.open(stream) as pdf:
+        return join_text_limited((page.extract_text() or '' for page in pdf.pages[:max_pages]), max_chars, status)
+
+def extract_text_from_pdf(pdf_file, max_pages=EXTRACT_MAX_PAGES, max_chars=EXTRACT_MAX_CHARS, status=None):
+    """อ่านข้อความจากไฟล์ PDF (ไม่เกิน max_pages หน้า และ max_chars ตัวอักษร)
+    
+    status (dict) จะได้ complete (อ่านครบทั้งไฟล์ ไม่ถูกตัดด้วย max_pages/max_chars)
+    และ interrupted (หยุดก่อนจบเพราะหน้าเกินเวลาหรืออ่านไม่ได้)
+    """
+    status = {} if status is None else status
     try:
-        text = ""
-        pdf_reader = PdfReader(io.BytesIO(pdf_file.read()))
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text.strip()
+        # อ่านจาก stream ของไฟล์โดยตรง ไม่ต้อง copy ทั้งไฟล์เข้า memory อีกรอบ
+        stream = getattr(pdf_file, 'stream', pdf_file)
+        stream.seek(0)
+        pdf_reader = PdfReader(stream)
+        page_count = min(len(pdf_reader.pages), max_pages)
+        status.update(complete=len(pdf_reader.pages) <= max_pages, interrupted=False)
+        
+        pages = None
+        if PDF_PROCESS_POOL_MIN_PAGES and page_count >= PDF_PROCESS_POOL_MIN_PAGES:
+            try:
+                # worker อยู่คนละ process จึงต้องส่งข้อมูลไฟล์ไปให้ (copy เฉพาะไฟล์ขนาดใหญ่ที่ใช้ pool)
+                stream.seek(0)
+                pages = extract_pdf_pages_in_pool(stream.read(), page_count, status=status)
+            except Exception as e:
+                print(f"⚠️  อ่าน PDF ใน process pool ไม่ได้ ({e}) อ่านใน process นี้แทน")
+        if pages is None:
+            pages = iter_pdf_pages(pdf_reader, page_count, status=status)
+        text = join_text_limited(pages, max_chars, status)
+        
+        if not text and pdfplumber is not None:
+            status.update(complete=len(pdf_reader.pages) <= max_pages, interrupted=False)
+            text = extract_text_from_pdf_with_pdfplumber(stream, max_pages, max_chars, status)
+        return text
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return None
 
-def extract_text_from_docx(docx_file):
-    """อ่านข้อความจากไฟล์ DOCX"""
+def extract_text_from_docx(docx_file, max_chars=EXTRACT_MAX_CHARS, status=None):
+    """อ่านข้อความจากไฟล์ DOCX (ไม่เกิน max_chars ตัวอักษร) status เหมือน extract_text_from_pdf"""
+    status = {} if status is None else status
+    status.update(complete=True, interrupted=False)
     try:
+        stream = getattr(docx_file, 'stream', docx_file)
         # Reset file pointer to beginning
-        docx_file.seek(0)
-        doc = Document(io.BytesIO(docx_file.read()))
-        text = ""
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text += paragraph.text + "\n"
-        return text.strip()
+        stream.seek(0)
+        doc = Document(stream)
+        # .text ของแต่ละย่อหน้าถูกสร้างเมื่ออ่านถึงเท่านั้น (หยุดเมื่อครบ max_chars)
+        return join_text_limited((paragraph.text for paragraph in doc.paragraphs), max_chars, status)
     except Exception as e:
         print(f"Error reading DOCX: {e}")
         return None
 
-def clean_resume_text(text):
-    """ทำความสะอาดและจัดรูปแบบ resume text เพื่อให้ Llama เข้าใจง่ายขึ้น"""
-    if not text:
-        return ""
+def extract_text_from_upload(file, max_chars=EXTRACT_MAX_CHARS):
+    """อ่านข้อความจากไฟล์ที่อัปโหลด คืนค่า (ข้อความ, ประเภทไฟล์) หรือ (None, None) ถ้าไม่รองรับ
     
-    # ลบ whitespace ที่มากเกินไป แต่เก็บ newlines ไว้
-    text = re.sub(r'[ \t]+', ' ', text)  # ลบ spaces/tabs ที่ซ้ำ
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)  # ลบบรรทัดว่างที่ซ้ำ
+    หน้า/ย่อหน้าถูกอ่านทีละส่วนและหยุดทันทีที่ได้ข้อความครบ max_chars
+    (ใช้ EXTRACT_ANALYSIS_MAX_CHARS เมื่อต้องการข้อความแค่พอสำหรับ prompt)
+    """
+    filename_lower = file.filename.lower()
     
-    # แยกส่วนสำคัญ (ถ้ามี) เพื่อให้ Llama เข้าใจโครงสร้าง
-    sections = {}
-    lines = text.split('\n')
+    stream = getattr(file, 'stream', file)
     
-    current_section = None
-    section_content = []
+    # ตรวจสอบประเภทไฟล์ (ไฟล์ที่เคยอ่านแล้วใช้ข้อความจาก document_store)
+    if filename_lower.endswith('.pdf'):
+        # อ่านข้อความจาก PDF
+        extract = lambda s, status: extract_text_from_pdf(s, max_chars=max_chars, status=status)
+        return read_document_text(stream, file.filename, extract, max_chars), 'PDF'
+    elif filename_lower.endswith('.docx'):
+        # อ่านข้อความจาก DOCX
+        extract = lambda s, status: extract_text_from_docx(s, max_chars=max_chars, status=status)
+        return read_document_text(stream, file.filename, extract, max_chars), 'DOCX'
+    return None, None
+
+def normalize_skill(text):
+    """แปลงชื่อทักษะให้อยู่ในรูปเดียวกัน (ตัวพิมพ์เล็ก, เว้นวรรคเดียว)"""
+    return ' '.join(text.lower().split())
+
+def build_trie_regex(phrases):
+    """สร้าง regex จาก trie ของคำ เพื่อให้ alternation ถูกแยกตาม prefix ร่วม
+    (regex engine ไม่ต้องลองทุกคำที่ทุกตำแหน่ง ใช้ได้กับพจนานุกรมหลายพันคำ)"""
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[''] = {}
     
-    # Keywords สำหรับแต่ละ section
-    section_keywords = {
-        'summary': ['summary', 'objective', 'profile', 'เกี่ยวกับ', 'ประวัติ', 'overview'],
-        'experience': ['experience', 'ประสบการณ์', 'work', 'employment', 'employment history', 'ประวัติการทำงาน'],
-        'education': ['education', 'การศึกษา', 'qualification', 'qualifications', 'academic', 'การศึกษา'],
-        'skills': ['skills', 'ทักษะ', 'technical skills', 'technical', 'ability', 'abilities', 'competencies', 'ความสามารถ']
-    }
+    def to_regex(node):
+        optional = '' in node
+        alternatives = []
+        for char in sorted(key for key in node if key):
+            char_regex = r'\s+' if char == ' ' else re.escape(char)
+            alternatives.append(char_regex + to_regex(node[char]))
+        if not alternatives:
+            return ''
+        regex = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        if optional:
+            regex = '(?:' + regex + ')?'
+        return regex
     
-    for line in lines:
-        line_stripped = line.strip()
-        if not line_stripped:
-            continue
-            
-        line_lower = line_stripped.lower()
-        
-        # ตรวจสอบว่าเป็น section header หรือไม่
-        is_section_header = False
-        for key, keywords in section_keywords.items():
-            # ตรวจสอบว่า line นี้เป็น header (สั้นและมี keyword)
-            if any(kw in line_lower for kw in keywords) and len(line_stripped) < 80:
-                # ตรวจสอบว่าไม่ใช่เนื้อหา (เช่น "3 years of experience")
-                if not any(char.isdigit() for char in line_stripped[:20]):
-                    if current_section:
-                        sections[current_section] = ' '.join(section_content)
-                    current_section = key
-                    section_content = []
-                    is_section_header = True
+    return to_regex(trie)
+
+# Keywords ของหัวข้อแต่ละ section ใน Resume (เรียงตามลำดับความสำคัญ ถ้าบรรทัดตรงหลาย section ใช้อันแรก)
+RESUME_SECTION_KEYWORDS = {
+    'summary': ['summary', 'objective', 'profile', 'เกี่ยวกับ', 'ประวัติ', 'overview'],
+    'experience': ['experience', 'ประสบการณ์', 'work', 'employment', 'employment history', 'ประวัติการทำงาน'],
+    'education': ['education', 'การศึกษา', 'qualification', 'qualifications', 'academic'],
+    'skills': ['skills', 'ทักษะ', 'technical skills', 'technical', 'ability', 'abilities', 'competencies', 'ความสามารถ']
+}
+
+class ResumeSectionParser:
+    """แบ่ง Resume เป็น section ในรอบเดียว ด้วย regex เดียวที่รวม keywords ของทุก section
+
+    - หัวข้อคือบรรทัดที่มี keyword (substring), ยาวไม่เกิน 80 ตัวอักษร และไม่มีตัวเลขใน 20 ตัวอักษรแรก
+    - regex เป็น lookahead จึงเจอ keyword ทุกตำแหน่ง (รวมที่ซ้อนกัน) และใช้ section ที่สำคัญที่สุดที่เจอ
+    """
+
+    def __init__(self, section_keywords=RESUME_SECTION_KEYWORDS):
+        self.names = list(section_keywords)
+        self.pattern = re.compile(
+            '(?=(?:' + '|'.join(f'({build_trie_regex(keywords)})' for keywords in section_keywords.values()) + '))'
+        )
+
+    def section_of(self, line_lower):
+        """คืนชื่อ section ที่ keyword ปรากฏในบรรทัด (ตามลำดับความสำคัญ) หรือ None"""
+        best = None
+        for match in self.pattern.finditer(line_lower):
+            rank = match.lastindex - 1
+            if best is None or rank < best:
+                best = rank
+                if best == 0:
                     break
-        
-        if not is_section_header:
-            section_content.append(line_stripped)
+        return self.names[best] if best is not None else None
+
+    def parse(self, text):
+        """แบ่งข้อความ (ที่ normalize whitespace แล้ว) เป็น section
+
+        คืนค่า (sections, unlabeled_lines)
+        - sections: list ของ dict {'name', 'header', 'start', 'end', 'lines'} ตามลำดับในเอกสาร
+          start/end เป็นตำแหน่งตัวอักษรใน text (ตั้งแต่บรรทัดหัวข้อถึงท้าย section)
+          ข้อความก่อนหัวข้อแรกอยู่ใน section ที่ name เป็น None
+        - unlabeled_lines: บรรทัดที่ไม่มี keyword ของ section ใดเลย
+        """
+        sections = []
+        unlabeled_lines = []
+        current = {'name': None, 'header': '', 'start': 0, 'end': 0, 'lines': []}
+        offset = 0
+        for line in text.split('\n'):
+            line_start = offset
+            offset += len(line) + 1
+            line_stripped = line.strip()
+            if not line_stripped:
+                continue
+            
+            section = self.section_of(line_stripped.lower())
+            if section is None:
+                unlabeled_lines.append(line_stripped)
+            elif len(line_stripped) < 80 and not any(char.isdigit() for char in line_stripped[:20]):
+                # เป็นหัวข้อ section ใหม่ (ไม่ใช่เนื้อหา เช่น "3 years of experience")
+                if current['name'] is not None or current['lines']:
+                    sections.append(current)
+                current = {'name': section, 'header': line_stripped, 'start': line_start,
+                           'end': line_start + len(line), 'lines': []}
+                continue
+            current['lines'].append(line_stripped)
+            current['end'] = line_start + len(line)
+        if current['name'] is not None or current['lines']:
+            sections.append(current)
+        return sections, unlabeled_lines
+
+# Parser ที่ใช้ร่วมกันทั้งแอป (compile ครั้งเดียว)
+resume_section_parser = ResumeSectionParser()
+
+def normalize_resume_whitespace(text):
+    """ลบ whitespace ที่มากเกินไป แต่เก็บ newlines ไว้"""
+    text = re.sub(r'[ \t]+', ' ', text)  # ลบ spaces/tabs ที่ซ้ำ
+    return re.sub(r'\n\s*\n\s*\n+', '\n\n', text)  # ลบบรรทัดว่างที่ซ้ำ
+
+def parse_resume_sections(text):
+    """แบ่ง Resume เป็น section (ดู ResumeSectionParser.parse) หลัง normalize whitespace
+    (start/end เป็นตำแหน่งใน normalize_resume_whitespace(text))"""
+    return resume_section_parser.parse(normalize_resume_whitespace(text or ''))
+
+def clean_resume_text(text, parsed=None):
+    """ทำความสะอาดและจัดรูปแบบ resume text เพื่อให้ Llama เข้าใจง่ายขึ้น
+    parsed: ผลจาก parse_resume_sections(text) ที่มีอยู่แล้ว (เช่น ResumeContext.sections) จะไม่แบ่ง section ซ้ำ"""
+    if not text:
+        return ""
+    
+    text = normalize_resume_whitespace(text)
     
-    # เก็บ section สุดท้าย
-    if current_section:
-        sections[current_section] = ' '.join(section_content)
+    # แยกส่วนสำคัญ (ถ้ามี) เพื่อให้ Llama เข้าใจโครงสร้าง (section ที่ซ้ำใช้อันหลังสุด)
+    parsed_sections, other_content = parsed or resume_section_parser.parse(text)
+    sections = {
+        section['name']: ' '.join(section['lines'])
+        for section in parsed_sections if section['name'] is not None
+    }
     
     # ถ้าแยก section ได้ ให้จัดรูปแบบใหม่
     if sections:
         formatted = []
         # เรียงลำดับตามความสำคัญ
-        for key in ['summary', 'experience', 'education', 'skills']:
-            if key in sections and sections[key]:
+        for key in RESUME_SECTION_KEYWORDS:
+            if sections.get(key):
                 formatted.append(f"=== {key.upper()} ===\n{sections[key]}")
         
         # เพิ่มส่วนอื่นๆ ที่ไม่ได้อยู่ใน categories หลัก
-        other_content = []
-        for line in lines:
-            line_stripped = line.strip()
-            if line_stripped and not any(
-                any(kw in line_stripped.lower() for kw in keywords) 
-                for keywords in section_keywords.values()
-            ):
-                other_content.append(line_stripped)
-        
         if other_content:
             formatted.append(f"=== OTHER ===\n{' '.join(other_content[:10])}")  # จำกัดความยาว
         
@@ -236,37 +1277,146 @@ def clean_resume_text(text):
     
     return text.strip()
 
-def calculate_match_percentage(resume_text, jd_text, llama_result=None):
-    """คำนวณ match_percentage จากข้อมูลจริง"""
-    resume_lower = resume_text.lower()
-    jd_lower = jd_text.lower()
-    
-    # หาทักษะพื้นฐาน
-    common_skills = ['python', 'java', 'javascript', 'sql', 'html', 'css', 'react', 'vue', 'angular', 
-                     'node.js', 'aws', 'docker', 'git', 'excel', 'power bi', 'tableau', 'machine learning',
-                     'typescript', 'mongodb', 'postgresql', 'mysql', 'redis', 'kubernetes', 'jenkins',
-                     'flask', 'django', 'express', 'spring', 'laravel', 'php', 'ruby', 'go', 'rust']
-    
-    # หา skills จาก resume
-    resume_skills = [s.lower() for s in common_skills if s.lower() in resume_lower]
-    
-    # หา skills ที่ต้องการจาก job description
-    jd_skills = [s.lower() for s in common_skills if s.lower() in jd_lower]
-    
-    # ใช้ skills จาก Llama ถ้ามี
-    if llama_result and 'skills_detected' in llama_result:
-        llama_skills = [s.lower() for s in llama_result['skills_detected'] if isinstance(s, str)]
-        # รวม skills จาก resume และ Llama
-        all_resume_skills = list(set(resume_skills + llama_skills))
-    else:
-        all_resume_skills = resume_skills
-    
-    # คำนวณ match
-    matched_skills = set(all_resume_skills).intersection(set(jd_skills))
-    missing_skills = set(jd_skills) - set(all_resume_skills)
-    
-    # คำนวณ percentage
-    if jd_skills:
+# พจนานุกรมทักษะ: ชื่อที่ใช้แสดง -> ชื่อเรียกอื่น (alias)
+# เพิ่ม/แก้ไขได้จากไฟล์ JSON ที่ SKILL_DICTIONARY_FILE โดยไม่ต้องแก้โค้ด
+DEFAULT_SKILL_DICTIONARY = {
+    'Python': [], 'Java': [], 'JavaScript': ['js', 'ecmascript'], 'TypeScript': ['ts'],
+    'SQL': [], 'HTML': ['html5'], 'CSS': ['css3'], 'React': ['reactjs', 'react.js'],
+    'Vue': ['vuejs', 'vue.js'], 'Angular': ['angularjs'], 'Node.js': ['nodejs', 'node js'],
+    'AWS': ['amazon web services'], 'Docker': [], 'Git': [], 'Excel': ['microsoft excel'],
+    'Power BI': ['powerbi'], 'Tableau': [], 'Machine Learning': [], 'MongoDB': ['mongo'],
+    'PostgreSQL': ['postgres'], 'MySQL': [], 'Redis': [], 'Kubernetes': ['k8s'], 'Jenkins': [],
+    'Flask': [], 'Django': [], 'Express': ['express.js', 'expressjs'], 'Spring': ['spring boot'],
+    'Laravel': [], 'PHP': [], 'Ruby': [], 'Go': ['golang'], 'Rust': []
+}
+
+class SkillMatcher:
+    """หาทักษะทั้งหมดในข้อความด้วย regex เดียวที่ compile ครั้งเดียว (สแกนข้อความรอบเดียว)
+
+    - จับคู่แบบทั้งคำ ("go" ไม่ตรงกับ "good", "java" ไม่ตรงกับ "javascript")
+    - รองรับ alias (เช่น "golang" -> Go, "k8s" -> Kubernetes)
+    - คืนค่าเป็นชื่อ canonical (ตัวพิมพ์เล็ก) ใช้ display_name() เพื่อแสดงผล
+    """
+
+    def __init__(self, dictionary):
+        self.alias_map = {}
+        self.display_names = {}
+        for name, aliases in dictionary.items():
+            canonical = normalize_skill(name)
+            self.display_names[canonical] = name
+            for alias in [name] + list(aliases or []):
+                self.alias_map[normalize_skill(alias)] = canonical
+        # ไม่ให้มีตัวอักษร/ตัวเลขภาษาอังกฤษติดอยู่ก่อนหรือหลังคำ (อนุญาตภาษาไทยติดกันได้)
+        self.pattern = re.compile(
+            r'(?<![a-z0-9])(' + build_trie_regex(self.alias_map) + r')(?![a-z0-9])',
+            re.IGNORECASE
+        )
+
+    def find(self, text):
+        """คืนค่า set ของทักษะ (canonical) ที่พบในข้อความ"""
+        if not text:
+            return set()
+        return {self.alias_map[normalize_skill(m.group(1))] for m in self.pattern.finditer(text)}
+
+    def canonical(self, skill):
+        """แปลงชื่อทักษะ (เช่นจาก Llama) เป็นชื่อ canonical ถ้าอยู่ในพจนานุกรม"""
+        normalized = normalize_skill(skill)
+        return self.alias_map.get(normalized, normalized)
+
+    def display_name(self, skill):
+        return self.display_names.get(skill, skill.title())
+
+def load_skill_dictionary(path=None):
+    """โหลดพจนานุกรมทักษะ (ค่าเริ่มต้น + ไฟล์ JSON ถ้ามี)"""
+    dictionary = dict(DEFAULT_SKILL_DICTIONARY)
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                dictionary.update(json.load(f))
+            print(f"📚 โหลดพจนานุกรมทักษะจาก {path}: {len(dictionary)} ทักษะ")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  ไม่สามารถโหลดพจนานุกรมทักษะจาก {path}: {e}")
+    return dictionary
+
+# Matcher ที่ใช้ร่วมกันทั้งแอป (compile ครั้งเดียวตอนเริ่มระบบ)
+skill_matcher = SkillMatcher(load_skill_dictionary(SKILL_DICTIONARY_FILE))
+
+# คำทั่วไปที่ไม่ใช้ในการเทียบคำระหว่าง Resume กับ Job Description
+PREFILTER_STOPWORDS = {
+    'and', 'the', 'for', 'with', 'you', 'our', 'are', 'will', 'who', 'your', 'from', 'have', 'has',
+    'this', 'that', 'able', 'ability', 'work', 'team', 'join', 'looking', 'experience', 'knowledge',
+    'skills', 'requirements', 'similar', 'environment', 'years', 'year', 'strong', 'good', 'etc'
+}
+
+def tokenize_for_prefilter(text):
+    """แยกคำภาษาอังกฤษ/ตัวเลข (ตัวพิมพ์เล็ก) สำหรับการเทียบคำแบบเร็ว"""
+    return {
+        token for token in re.findall(r'[a-z0-9][a-z0-9+#.]*[a-z0-9+#]|[a-z0-9]', text.lower())
+        if len(token) > 2 and token not in PREFILTER_STOPWORDS
+    }
+
+class JobFeatures:
+    """ข้อมูลของ Job Description ที่คำนวณครั้งเดียว แล้วใช้ซ้ำกับทุก Resume
+
+    - clean / lower: ข้อความที่ strip แล้ว / ตัวพิมพ์เล็ก
+    - tokens: คำสำหรับ lexical_match_score
+    - required_skills: ทักษะ (canonical) ที่พบใน JD
+    - prompt_fragment: JD ที่ตัดความยาวแล้วสำหรับใส่ใน prompt
+    - digest: SHA-256 ของ JD (ใช้เป็น key ของ embedding)
+    """
+
+    def __init__(self, jd_text):
+        self.text = jd_text
+        self.clean = jd_text.strip()
+        self.lower = jd_text.lower()
+        self.normalized = ' '.join(self.lower.split())
+        self.tokens = frozenset(tokenize_for_prefilter(jd_text))
+        self.required_skills = frozenset(skill_matcher.find(jd_text))
+        if len(self.clean) > JD_PROMPT_MAX_CHARS:
+            self.prompt_fragment = self.clean[:JD_PROMPT_MAX_CHARS] + "..."
+        else:
+            self.prompt_fragment = self.clean
+        self.digest = hashlib.sha256(self.clean.encode('utf-8')).hexdigest()
+
+@functools.lru_cache(maxsize=JOB_FEATURES_CACHE_SIZE)
+def get_job_features(jd_text):
+    """JobFeatures ของ JD ที่ส่งมาเอง (ไม่ได้อยู่ใน position_store) เก็บไว้แบบ LRU"""
+    return JobFeatures(jd_text)
+
+def job_features_for(jd_data):
+    """คืน JobFeatures ของตำแหน่ง ใช้ค่าที่ position_store คำนวณไว้แล้วถ้าเป็นตำแหน่งในฐานข้อมูล"""
+    jd_text = jd_data.get('description', '')
+    position_id = jd_data.get('id')
+    if position_id is not None:
+        features = position_store.features(position_id)
+        if features is not None and features.text == jd_text:
+            return features
+    return get_job_features(jd_text)
+
+def calculate_match_percentage(resume_text, jd_text, llama_result=None, jd_features=None, context=None):
+    """คำนวณ match_percentage จากข้อมูลจริง
+    
+    ส่ง jd_features (JobFeatures) และ context (ResumeContext) มาเพื่อใช้ทักษะที่หาไว้แล้ว
+    """
+    jd_features = jd_features or get_job_features(jd_text)
+    # หา skills จาก resume และ skills ที่ต้องการจาก job description
+    resume_skills = list(context.resume_skills if context else skill_matcher.find(resume_text))
+    jd_skills = list(jd_features.required_skills)
+    
+    # ใช้ skills จาก Llama ถ้ามี
+    if llama_result and 'skills_detected' in llama_result:
+        llama_skills = [skill_matcher.canonical(s) for s in llama_result['skills_detected'] if isinstance(s, str)]
+        # รวม skills จาก resume และ Llama
+        all_resume_skills = list(set(resume_skills + llama_skills))
+    else:
+        all_resume_skills = resume_skills
+    
+    # คำนวณ match
+    matched_skills = set(all_resume_skills).intersection(set(jd_skills))
+    missing_skills = set(jd_skills) - set(all_resume_skills)
+    
+    # คำนวณ percentage
+    if jd_skills:
         base_percentage = int((len(matched_skills) / len(jd_skills)) * 100)
     else:
         base_percentage = 0
@@ -302,13 +1452,13 @@ def calculate_match_percentage(resume_text, jd_text, llama_result=None):
     
     return f"{final_percentage}%"
 
-def enhance_llama_result(result, resume_text, jd_text):
+def enhance_llama_result(result, resume_text, jd_text, jd_features=None, context=None):
     """ปรับปรุงและตรวจสอบผลลัพธ์จาก Llama ด้วยการตรวจสอบกับข้อมูลจริง"""
     if not result:
         return result
     
-    resume_lower = resume_text.lower()
-    jd_lower = jd_text.lower()
+    resume_lower = context.resume_lower if context else resume_text.lower()
+    jd_lower = (jd_features or get_job_features(jd_text)).lower
     
     # ตรวจสอบและปรับปรุง skills_detected
     if 'skills_detected' in result:
@@ -352,14 +1502,186 @@ def enhance_llama_result(result, resume_text, jd_text):
     
     return result
 
-def extract_personal_info_from_resume(resume_text):
+# ==================== Personal Info Patterns ====================
+# regex ทั้งหมดที่ใช้ดึงข้อมูลส่วนตัว compile ครั้งเดียวตอนโหลดโมดูล
+# ใช้ร่วมกันระหว่าง extract_personal_info_from_resume, analyze_with_llama และ fallback_analysis
+# (และเรียกซ้ำได้กับ Resume จำนวนมากในงาน batch โดยไม่ต้อง compile ใหม่)
+PERSONAL_INFO_PATTERNS = {
+    # ชื่อที่ขึ้นต้นบรรทัด (ใช้กับ 15 บรรทัดแรกของ Resume)
+    'name_en': re.compile(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)?)', re.MULTILINE),  # ชื่อภาษาอังกฤษ (1-2 คำ)
+    'name_th': re.compile(r'^([ก-๙]{2,}(?:\s+[ก-๙]{2,})?)', re.MULTILINE),  # ชื่อภาษาไทย (1-2 คำ แต่ละคำอย่างน้อย 2 ตัวอักษร)
+    'name_th_single': re.compile(r'^([ก-๙]{3,})', re.MULTILINE),  # ชื่อภาษาไทย 1 คำ (อย่างน้อย 3 ตัวอักษร)
+    # ชื่อภาษาอังกฤษอย่างน้อย 2 คำ ที่ใดก็ได้ใน Resume (ใช้เติมผลจาก Llama / fallback)
+    'name_en_full': re.compile(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)', re.MULTILINE),
+    'name_title_prefix': re.compile(r'^(Mr|Mrs|Ms|Miss|Dr|Prof|Sir|Madam|นาย|นาง|นางสาว|ดร\.|อาจารย์)', re.IGNORECASE),
+    'name_invalid_chars': re.compile(r'[0-9@#$%^&*()_+=\[\]{}|;:,.<>?/\\]'),
+    'name_leading_symbol': re.compile(r'^[0-9\W]'),
+    # อีเมลและเบอร์โทร
+    'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'),
+    'phone_th_local': re.compile(r'0[689]\d{1}[-.\s]?\d{3}[-.\s]?\d{3,4}'),  # 08x-xxx-xxxx หรือ 08xxxxxxx (9-10 หลัก)
+    'phone_th_intl': re.compile(r'\+66[-.\s]?[689]\d{1}[-.\s]?\d{3}[-.\s]?\d{3,4}'),  # +66-8x-xxx-xxxx (11-12 หลัก)
+    'phone_th_intl_bare': re.compile(r'(?<![\d+])66[-.\s]?[689]\d{1}[-.\s]?\d{3}[-.\s]?\d{3,4}'),  # 668xxxxxxxx (ไม่มี +)
+    'phone_th_paren': re.compile(r'\(?0[689]\d{1}\)?[-.\s]?\d{3}[-.\s]?\d{3,4}'),  # (08x) xxx-xxxx
+    'phone_generic': re.compile(r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10}'),  # รูปแบบสากล
+    'phone_separators': re.compile(r'[-.\s()]'),
+}
+
+# ลำดับของ group ใน CONTACT_SCANNER (ถ้าหลายแบบ match ที่ตำแหน่งเดียวกันจะใช้แบบที่อยู่ก่อน)
+# พร้อมค่า confidence ของผู้สมัครแต่ละประเภท
+CONTACT_KINDS = (
+    ('email', 'email', 0.95),
+    ('phone_th_local', 'phone', 0.9),
+    ('phone_th_intl', 'phone', 0.9),
+    ('phone_th_intl_bare', 'phone', 0.8),
+    ('phone_th_paren', 'phone', 0.8),
+    ('phone_generic', 'phone', 0.4),
+)
+CONTACT_KIND_OF = {pattern: kind for pattern, kind, _ in CONTACT_KINDS}
+CONTACT_CONFIDENCE = {pattern: confidence for pattern, _, confidence in CONTACT_KINDS}
+
+# รวมอีเมลและเบอร์โทรทุกแบบเป็น regex เดียว ใช้ lookahead เพื่อไม่ให้ match ของแบบหนึ่ง
+# กินข้อความของอีกแบบ (เช่นเบอร์ไทยที่อยู่หลังตัวเลขอื่น) สแกนข้อความรอบเดียวได้ผู้สมัครครบทุกประเภท
+# เบอร์โทรทุกแบบขึ้นต้นด้วยตัวเลข + หรือ ( จึงลองเฉพาะตำแหน่งนั้น
+CONTACT_SCANNER = re.compile(
+    '(?=(?P<email>' + PERSONAL_INFO_PATTERNS['email'].pattern + '))'
+    r'|(?=[+(\d])(?=' + '|'.join(
+        f'(?P<{kind}>{PERSONAL_INFO_PATTERNS[kind].pattern})' for kind, group, _ in CONTACT_KINDS if group == 'phone'
+    ) + ')'
+)
+
+# รายชื่อสถานที่ที่พบบ่อย (ห้ามใช้แทนชื่อผู้สมัคร)
+NAME_COMMON_PLACES = (
+    'bangkok', 'phuket', 'chiang mai', 'pattaya', 'hat yai', 'udon thani',
+    'khon kaen', 'nakhon ratchasima', 'surat thani', 'rayong', 'chonburi',
+    'bang bo', 'bang na', 'bang sue', 'bang rak', 'bang kapi', 'bang khae',
+    'thailand', 'thai', 'asia', 'europe', 'america', 'province', 'จังหวัด',
+    'เขต', 'อำเภอ', 'ตำบล', 'district', 'amphoe', 'tambon'
+)
+
+# คำที่บ่งบอกว่าไม่ใช่ชื่อคน (บริษัท, หน่วยงาน, โรงเรียน, โครงการ, หมวดหมู่)
+NAME_NON_PERSON_KEYWORDS = (
+    'company', 'corporation', 'corp', 'ltd', 'limited', 'co.,', 'co.,ltd',
+    'บริษัท', 'จำกัด', 'มหาชน', 'องค์กร', 'หน่วยงาน', 'department', 'division',
+    'school', 'university', 'college', 'institute', 'มหาวิทยาลัย', 'โรงเรียน',
+    'project', 'program', 'โครงการ', 'โปรแกรม', 'section', 'หมวดหมู่',
+    'menu', 'category', 'topic', 'subject', 'หัวข้อ', 'เรื่อง', 'title',
+    'address', 'ที่อยู่', 'location', 'สถานที่', 'office', 'สำนักงาน'
+)
+
+def scan_contacts(text):
+    """สแกนหาอีเมลและเบอร์โทรทั้งหมดในข้อความด้วย CONTACT_SCANNER รอบเดียว
+
+    คืนค่า list ของ dict เรียงตามตำแหน่ง:
+    {'kind': 'email'|'phone', 'pattern': ชื่อ pattern ใน PERSONAL_INFO_PATTERNS,
+     'value': ข้อความที่พบ, 'normalized': ค่าที่ลบตัวคั่นแล้ว (เบอร์โทร),
+     'start': ..., 'end': ..., 'confidence': 0-1}
+    ผู้สมัครของ pattern เดียวกันจะไม่ทับกัน (เหมือน re.finditer ของแต่ละ pattern)
+    """
+    candidates = []
+    if not text:
+        return candidates
+    last_end = {}
+    for match in CONTACT_SCANNER.finditer(text):
+        pattern = match.lastgroup
+        start, end = match.span(pattern)
+        if start < last_end.get(pattern, 0):
+            continue
+        last_end[pattern] = end
+        value = match.group(pattern).strip()
+        kind = CONTACT_KIND_OF[pattern]
+        normalized = value if kind == 'email' else PERSONAL_INFO_PATTERNS['phone_separators'].sub('', value)
+        candidates.append({
+            'kind': kind,
+            'pattern': pattern,
+            'value': value,
+            'normalized': normalized,
+            'start': start,
+            'end': end,
+            'confidence': CONTACT_CONFIDENCE[pattern],
+        })
+    return candidates
+
+def first_contact(candidates, *patterns):
+    """คืนผู้สมัครตัวแรก (ตามตำแหน่ง) ของ pattern แรกใน patterns ที่พบ หรือ None"""
+    for pattern in patterns:
+        for candidate in candidates:
+            if candidate['pattern'] == pattern:
+                return candidate
+    return None
+
+def fallback_contact_info(resume_text, contacts=None):
+    """ดึงชื่อ อีเมล เบอร์โทรแบบหลวมๆ สำหรับเติมช่องที่ Llama ไม่ได้ตอบ และสำหรับ fallback_analysis
+
+    ค่าที่หาไม่เจอจะเป็น "" (ผู้เรียกแทนด้วย "Not specified" เอง)
+    """
+    if contacts is None:
+        contacts = scan_contacts(resume_text)
+    name_match = PERSONAL_INFO_PATTERNS['name_en_full'].search(resume_text or '')
+    email = next((c for c in contacts if c['kind'] == 'email'), None)
+    phone = next((c for c in contacts if c['kind'] == 'phone'), None)
+    return {
+        'full_name': name_match.group(1).strip() if name_match else '',
+        'email': email['value'] if email else '',
+        'phone': phone['value'] if phone else '',
+    }
+
+def is_plausible_person_name(candidate_name):
+    """ตรวจสอบว่าข้อความที่ได้จาก name pattern มีความเป็นไปได้ที่จะเป็นชื่อบุคคล"""
+    # ตรวจสอบความยาว (ชื่อควรมีความยาวสมเหตุสมผล)
+    if len(candidate_name) < 2 or len(candidate_name) > 100:
+        return False
+    
+    name_lower = candidate_name.lower()
+    
+    # ตรวจสอบว่าไม่ใช่ชื่อสถานที่
+    if any(place in name_lower for place in NAME_COMMON_PLACES):
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่บ่งบอกว่าไม่ใช่ชื่อคน
+    if any(keyword in name_lower for keyword in NAME_NON_PERSON_KEYWORDS):
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วย "Mr.", "Mrs.", "Ms.", "Dr." หรือคำอื่นๆ
+    if PERSONAL_INFO_PATTERNS['name_title_prefix'].match(candidate_name):
+        return False
+    
+    # ตรวจสอบว่ามีตัวเลขหรือสัญลักษณ์พิเศษหรือไม่ (ถ้ามีอาจไม่ใช่ชื่อ)
+    if PERSONAL_INFO_PATTERNS['name_invalid_chars'].search(candidate_name):
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวพิมพ์ใหญ่ทั้งหมด (อาจเป็นหัวข้อ)
+    if candidate_name.isupper() and len(candidate_name.split()) > 2:
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวพิมพ์เล็ก (อาจไม่ใช่ชื่อ)
+    if candidate_name[0].islower():
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่ยาวเกินไป (อาจเป็นประโยค)
+    words = candidate_name.split()
+    if len(words) > 4:
+        return False
+    
+    # ตรวจสอบว่าแต่ละคำมีความยาวสมเหตุสมผล (ไม่ยาวเกินไป)
+    if any(len(word) > 20 for word in words):
+        return False
+    
+    # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวเลขหรือสัญลักษณ์
+    if PERSONAL_INFO_PATTERNS['name_leading_symbol'].match(candidate_name):
+        return False
+    
+    return True
+
+def extract_personal_info_from_resume(resume_text, contacts=None):
     """ดึงข้อมูลส่วนตัวจาก Resume ด้วย regex (เข้มงวด - ดึงเฉพาะที่ปรากฏจริงเท่านั้น)
     
     กฎสำคัญ:
     1. ห้ามใช้ชื่อสถานที่, บริษัท, หน่วยงาน, โรงเรียน, โครงการ
     2. ต้องเป็นชื่อบุคคลที่มีความเป็นไปได้เท่านั้น
     3. ห้ามใช้หมวดหมู่, เมนู, หัวข้อ
-    4. เบอร์โทรต้องเริ่มด้วย 0 หรือ +66 และมีตัวเลข 9-10 หลัก
+    4. เบอร์โทรต้องเริ่มด้วย 0, +66 หรือ 66 และมีตัวเลข 9-10 หลัก
+    
+    contacts: ผลจาก scan_contacts(resume_text) ถ้าสแกนไว้แล้ว
     """
     personal_info = {
         'full_name': '',
@@ -370,147 +1692,39 @@ def extract_personal_info_from_resume(resume_text):
     if not resume_text:
         return personal_info
     
-    # รายชื่อสถานที่ที่พบบ่อย (ห้ามใช้แทนชื่อผู้สมัคร)
-    common_places = [
-        'bangkok', 'phuket', 'chiang mai', 'pattaya', 'hat yai', 'udon thani',
-        'khon kaen', 'nakhon ratchasima', 'surat thani', 'rayong', 'chonburi',
-        'bang bo', 'bang na', 'bang sue', 'bang rak', 'bang kapi', 'bang khae',
-        'thailand', 'thai', 'asia', 'europe', 'america', 'province', 'จังหวัด',
-        'เขต', 'อำเภอ', 'ตำบล', 'district', 'amphoe', 'tambon'
-    ]
-    
-    # คำที่บ่งบอกว่าไม่ใช่ชื่อคน (บริษัท, หน่วยงาน, โรงเรียน, โครงการ, หมวดหมู่)
-    non_person_keywords = [
-        'company', 'corporation', 'corp', 'ltd', 'limited', 'co.,', 'co.,ltd',
-        'บริษัท', 'จำกัด', 'มหาชน', 'องค์กร', 'หน่วยงาน', 'department', 'division',
-        'school', 'university', 'college', 'institute', 'มหาวิทยาลัย', 'โรงเรียน',
-        'project', 'program', 'โครงการ', 'โปรแกรม', 'section', 'section', 'หมวดหมู่',
-        'menu', 'category', 'topic', 'subject', 'หัวข้อ', 'เรื่อง', 'title',
-        'address', 'ที่อยู่', 'location', 'สถานที่', 'office', 'สำนักงาน'
-    ]
-    
     # หา name จาก resume (มักจะอยู่บรรทัดแรกๆ)
     # Pattern: ชื่อที่ขึ้นต้นด้วยตัวพิมพ์ใหญ่ ตามด้วยตัวพิมพ์เล็ก และมีอย่างน้อย 1-2 คำ
-    name_patterns = [
-        r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)?)',  # ชื่อภาษาอังกฤษ (1-2 คำ)
-        r'^([ก-๙]{2,}(?:\s+[ก-๙]{2,})?)',  # ชื่อภาษาไทย (1-2 คำ แต่ละคำอย่างน้อย 2 ตัวอักษร)
-        r'^([ก-๙]{3,})',  # ชื่อภาษาไทย 1 คำ (อย่างน้อย 3 ตัวอักษร)
-    ]
-    
     # ลองหาชื่อจากบรรทัดแรกๆ ก่อน (มักจะอยู่ 15 บรรทัดแรก)
     lines = resume_text.split('\n')[:15]
     resume_start = '\n'.join(lines)
     
-    for pattern in name_patterns:
-        name_match = re.search(pattern, resume_start, re.MULTILINE)
+    for pattern_name in ('name_en', 'name_th', 'name_th_single'):
+        name_match = PERSONAL_INFO_PATTERNS[pattern_name].search(resume_start)
         if name_match:
             candidate_name = name_match.group(1).strip()
-            
-            # ตรวจสอบความยาว (ชื่อควรมีความยาวสมเหตุสมผล)
-            if len(candidate_name) < 2 or len(candidate_name) > 100:
-                continue
-            
-            name_lower = candidate_name.lower()
-            
-            # ตรวจสอบว่าไม่ใช่ชื่อสถานที่
-            is_place = any(place in name_lower for place in common_places)
-            if is_place:
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่บ่งบอกว่าไม่ใช่ชื่อคน
-            is_non_person = any(keyword in name_lower for keyword in non_person_keywords)
-            if is_non_person:
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วย "Mr.", "Mrs.", "Ms.", "Dr." หรือคำอื่นๆ
-            if re.match(r'^(Mr|Mrs|Ms|Miss|Dr|Prof|Sir|Madam|นาย|นาง|นางสาว|ดร\.|อาจารย์)', candidate_name, re.IGNORECASE):
-                continue
-            
-            # ตรวจสอบว่ามีตัวเลขหรือสัญลักษณ์พิเศษหรือไม่ (ถ้ามีอาจไม่ใช่ชื่อ)
-            if re.search(r'[0-9@#$%^&*()_+=\[\]{}|;:,.<>?/\\]', candidate_name):
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวพิมพ์ใหญ่ทั้งหมด (อาจเป็นหัวข้อ)
-            if candidate_name.isupper() and len(candidate_name.split()) > 2:
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวพิมพ์เล็ก (อาจไม่ใช่ชื่อ)
-            if candidate_name[0].islower():
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่ยาวเกินไป (อาจเป็นประโยค)
-            words = candidate_name.split()
-            if len(words) > 4:
-                continue
-            
-            # ตรวจสอบว่าแต่ละคำมีความยาวสมเหตุสมผล (ไม่ยาวเกินไป)
-            if any(len(word) > 20 for word in words):
-                continue
-            
-            # ตรวจสอบว่าไม่ใช่คำที่ขึ้นต้นด้วยตัวเลขหรือสัญลักษณ์
-            if re.match(r'^[0-9\W]', candidate_name):
-                continue
-            
-            personal_info['full_name'] = candidate_name
-            break
+            if is_plausible_person_name(candidate_name):
+                personal_info['full_name'] = candidate_name
+                break
     
-    # หา email จาก resume (ต้องเป็นรูปแบบ name@example.com เท่านั้น)
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b'
-    email_matches = re.findall(email_pattern, resume_text)
-    if email_matches:
-        # ใช้ email แรกที่พบ
-        email = email_matches[0]
-        # ตรวจสอบว่าเป็นรูปแบบที่ถูกต้อง (มี @ และ .)
-        if '@' in email and '.' in email.split('@')[1]:
-            personal_info['email'] = email
-    
-    # หา phone จาก resume (ต้องเริ่มด้วย 0 หรือ +66 และมีตัวเลข 9-10 หลัก)
-    # รูปแบบที่รองรับ:
-    # - 0[689]x-xxx-xxxx (10 หลัก: 0 + 9 หลัก) หรือ 0[689]x-xxx-xxx (9 หลัก: 0 + 8 หลัก)
-    # - 0[689]xxxxxxxx (10 หลัก) หรือ 0[689]xxxxxxx (9 หลัก)
-    # - +66[689]x-xxx-xxxx (12 หลัก: +66 + 9 หลัก) หรือ +66[689]x-xxx-xxx (11 หลัก: +66 + 8 หลัก)
-    # - +66[689]xxxxxxxx (12 หลัก) หรือ +66[689]xxxxxxx (11 หลัก)
-    phone_patterns = [
-        r'0[689]\d{1}[-.\s]?\d{3}[-.\s]?\d{3,4}',  # 08x-xxx-xxxx หรือ 08x-xxx-xxx (9-10 หลัก)
-        r'0[689]\d{7,8}',  # 08xxxxxxxx หรือ 08xxxxxxx (9-10 หลัก)
-        r'\+66[-.\s]?[689]\d{1}[-.\s]?\d{3}[-.\s]?\d{3,4}',  # +66-8x-xxx-xxxx หรือ +66-8x-xxx-xxx (11-12 หลัก)
-        r'\+66[-.\s]?[689]\d{7,8}',  # +66[689]xxxxxxxx หรือ +66[689]xxxxxxx (11-12 หลัก)
-        r'\(?0[689]\d{1}\)?[-.\s]?\d{3}[-.\s]?\d{3,4}',  # (08x) xxx-xxxx หรือ (08x) xxx-xxx (9-10 หลัก)
-    ]
+    if contacts is None:
+        contacts = scan_contacts(resume_text)
     
-    for pattern in phone_patterns:
-        phone_matches = re.finditer(pattern, resume_text)
-        for phone_match in phone_matches:
-            phone = phone_match.group(0).strip()
-            # ลบ whitespace, dash, dot, parentheses
-            phone_clean = re.sub(r'[-.\s()]', '', phone)
-            
-            # ตรวจสอบว่าต้องเริ่มด้วย 0 หรือ +66
-            if phone_clean.startswith('0'):
-                # ต้องมี 9-10 หลัก (0 + 8-9 หลัก)
-                if len(phone_clean) >= 9 and len(phone_clean) <= 10:
-                    # ตรวจสอบว่าเป็นเบอร์โทรไทยที่ถูกต้อง (0 ตามด้วย 6, 8, หรือ 9)
-                    if phone_clean[1] in ['6', '8', '9']:
-                        personal_info['phone'] = phone
-                        break
-            elif phone_clean.startswith('+66'):
-                # ต้องมี 11-12 หลัก (+66 + 8-9 หลัก)
-                if len(phone_clean) >= 11 and len(phone_clean) <= 12:
-                    # ตรวจสอบว่าเป็นเบอร์โทรไทยที่ถูกต้อง (66 ตามด้วย 6, 8, หรือ 9)
-                    if phone_clean[3] in ['6', '8', '9']:
-                        personal_info['phone'] = phone_clean
-                        break
-            elif phone_clean.startswith('66'):
-                # ต้องมี 10-11 หลัก (66 + 8-9 หลัก)
-                if len(phone_clean) >= 10 and len(phone_clean) <= 11:
-                    # ตรวจสอบว่าเป็นเบอร์โทรไทยที่ถูกต้อง (66 ตามด้วย 6, 8, หรือ 9)
-                    if phone_clean[2] in ['6', '8', '9']:
-                        # แปลงเป็นรูปแบบ +66
-                        personal_info['phone'] = '+' + phone_clean
-                        break
-        
-        if personal_info['phone']:
-            break
+    # หา email จาก resume (ต้องเป็นรูปแบบ name@example.com เท่านั้น ใช้ email แรกที่พบ)
+    email = first_contact(contacts, 'email')
+    if email:
+        personal_info['email'] = email['value']
+    
+    # หา phone จาก resume (ต้องเริ่มด้วย 0, +66 หรือ 66 และมีตัวเลข 9-10 หลัก)
+    # ลำดับความสำคัญ: 0[689]x-xxx-xxxx > +66[689]x-xxx-xxxx > 66[689]x-xxx-xxxx > (0[689]x) xxx-xxxx
+    # เบอร์ +66 เก็บในรูปแบบที่ลบตัวคั่นแล้ว (66 ที่ไม่มี + แปลงเป็น +66) ส่วนเบอร์ที่ขึ้นต้นด้วย 0 เก็บตามที่ปรากฏใน Resume
+    phone = first_contact(contacts, 'phone_th_local', 'phone_th_intl', 'phone_th_intl_bare', 'phone_th_paren')
+    if phone:
+        if phone['pattern'] == 'phone_th_intl':
+            personal_info['phone'] = phone['normalized']
+        elif phone['pattern'] == 'phone_th_intl_bare':
+            personal_info['phone'] = '+' + phone['normalized']
+        else:
+            personal_info['phone'] = phone['value']
     
     return personal_info
 
@@ -532,7 +1746,7 @@ def extract_personal_info_with_llama(resume_text, model=None):
         }
     
     # จำกัดความยาวเพื่อไม่ให้ prompt ยาวเกินไป
-    resume_limited = resume_text[:2000] if len(resume_text) > 2000 else resume_text
+    resume_limited = resume_text[:RESUME_PROMPT_MAX_CHARS]
     
     # Prompt สำหรับ Llama 3.2 ตามที่ระบุ
     prompt = f"""Information to extract from resume:
@@ -571,42 +1785,8 @@ Resume text:
     
     # พยายามดึง JSON จาก response
     try:
-        # หา JSON object
-        start_idx = response.find('{')
-        if start_idx == -1:
-            raise json.JSONDecodeError("No JSON object found", response, 0)
-        
-        # นับ brackets เพื่อหา JSON object ที่สมบูรณ์
-        bracket_count = 0
-        in_string = False
-        escape_next = False
-        end_idx = start_idx
-        
-        for i in range(start_idx, len(response)):
-            char = response[i]
-            
-            if escape_next:
-                escape_next = False
-                continue
-            
-            if char == '\\':
-                escape_next = True
-                continue
-            
-            if char == '"' and not escape_next:
-                in_string = not in_string
-                continue
-            
-            if not in_string:
-                if char == '{':
-                    bracket_count += 1
-                elif char == '}':
-                    bracket_count -= 1
-                    if bracket_count == 0:
-                        end_idx = i + 1
-                        break
-        
-        json_str = response[start_idx:end_idx]
+        # หา JSON object ที่สมบูรณ์ตัวแรก
+        json_str = extract_json_object(response)
         result = json.loads(json_str)
         
         # แปลง key names ให้ตรงกับ format ที่ต้องการ
@@ -628,65 +1808,703 @@ Resume text:
             "education_level": None
         }
 
-def analyze_with_llama(resume_text, jd_text, job_title="", model=None):
-    """ใช้ Llama 3.2 วิเคราะห์ Resume และ Job Description"""
+class ResumeContext:
+    """ข้อมูลที่คำนวณครั้งเดียวต่อ Resume แล้วใช้ร่วมกันกับทุกตำแหน่งงาน
+
+    - sections: ผลจาก parse_resume_sections (section พร้อมตำแหน่งในข้อความ) แบ่งครั้งเดียวเมื่อถูกใช้ครั้งแรก
+    - resume_clean: ผลจาก clean_resume_text (จัดรูปแบบจาก sections)
+    - resume_lower, resume_skills, resume_tokens: ใช้ในการให้คะแนนเทียบกับ JobFeatures
+    - contacts: ผลจาก scan_contacts (อีเมล/เบอร์โทรทั้งหมดที่พบ)
+    - fallback_contact_info: ผลจาก fallback_contact_info ใช้เติมช่องที่ Llama ไม่ได้ตอบ
+    - regex_personal_info: ผลจาก extract_personal_info_from_resume
+    - personal_info: ข้อมูลส่วนตัวที่ใช้ใน prompt (ดึงด้วย Llama ครั้งแรกที่ถูกเรียกเท่านั้น)
+      ถ้า skip_llm_if_regex_complete=True และ regex หาเจอครบทั้งชื่อ อีเมล เบอร์โทร
+      จะไม่เรียก Llama เลย
+    ถ้า Resume มาจากไฟล์ที่อยู่ใน document_store จะใช้ resume_clean และข้อมูลส่วนตัวที่เก็บไว้แล้ว
+    """
+
+    def __init__(self, resume_text, model=None, skip_llm_if_regex_complete=SKIP_LLM_PERSONAL_INFO_IF_REGEX_COMPLETE):
+        self.resume_text = resume_text
+        self.model = model
+        self.skip_llm_if_regex_complete = skip_llm_if_regex_complete
+        self.text_digest = DocumentStore.text_digest(resume_text)
+        self.contacts = scan_contacts(resume_text)
+        self.fallback_contact_info = fallback_contact_info(resume_text, self.contacts)
+        self._sections = None
+        profile = document_store.get_profile(self.text_digest) if document_store else None
+        self._stored = profile is not None
+        if profile and profile['resume_clean'] is not None:
+            self.resume_clean = profile['resume_clean']
+            self.regex_personal_info = profile['regex_personal_info']
+        else:
+            self.resume_clean = clean_resume_text(resume_text, parsed=self.sections)
+            self.regex_personal_info = extract_personal_info_from_resume(resume_text, contacts=self.contacts)
+            if self._stored:
+                document_store.save_profile(self.text_digest, resume_clean=self.resume_clean,
+                                            regex_personal_info=self.regex_personal_info)
+        self.resume_lower = resume_text.lower()
+        self.resume_skills = frozenset(skill_matcher.find(resume_text))
+        self.resume_tokens = frozenset(tokenize_for_prefilter(resume_text))
+        self._personal_info = profile['personal_info'] if profile else None
+        self._lock = threading.Lock()
+
+    @property
+    def sections(self):
+        """(sections, unlabeled_lines) จาก parse_resume_sections (ไม่ต้องแบ่งใหม่ถ้า resume_clean มาจาก document_store)"""
+        if self._sections is None:
+            self._sections = parse_resume_sections(self.resume_text)
+        return self._sections
+
+    @property
+    def prompt_resume(self):
+        # จำกัดความยาวเพื่อไม่ให้ prompt ยาวเกินไป (Llama 3.2:1b มี context limit)
+        if len(self.resume_clean) > RESUME_PROMPT_MAX_CHARS:
+            return self.resume_clean[:RESUME_PROMPT_MAX_CHARS] + "..."
+        return self.resume_clean
+
+    @property
+    def personal_info(self):
+        # ใช้ lock เพื่อให้ thread ที่วิเคราะห์หลายตำแหน่งพร้อมกันเรียก Llama แค่ครั้งเดียว
+        with self._lock:
+            if self._personal_info is None:
+                self._personal_info = self._extract_personal_info()
+                if self._stored:
+                    document_store.save_profile(self.text_digest, personal_info=self._personal_info)
+            return dict(self._personal_info)
+
+    def known_personal_info(self):
+        """ข้อมูลส่วนตัวที่มีอยู่แล้วโดยไม่เรียก Llama (ผลเดิมถ้าเคยดึงแล้ว ไม่งั้นใช้ผลจาก regex)"""
+        with self._lock:
+            if self._personal_info is not None:
+                return dict(self._personal_info)
+        return dict(self.regex_personal_info, education_level='')
+
+    def learn_personal_info(self, result):
+        """เก็บข้อมูลส่วนตัวที่โมเดลตอบมาพร้อมผลวิเคราะห์ (ANALYSIS_OUTPUT_FORMAT)
+        ค่าจาก regex มาก่อนเสมอ ใช้ค่าจากโมเดลเฉพาะช่องที่ regex หาไม่เจอ
+        ตำแหน่งถัดไปของ Resume เดียวกันจะได้ข้อมูลนี้ใน prompt เลย"""
+        with self._lock:
+            if self._personal_info is not None:
+                return
+            personal_info = dict(self.regex_personal_info, education_level='')
+            for field in ('full_name', 'email', 'phone'):
+                value = result.get(field)
+                if not personal_info[field] and isinstance(value, str) and value.strip():
+                    personal_info[field] = value.strip()
+            self._personal_info = personal_info
+            if self._stored:
+                document_store.save_profile(self.text_digest, personal_info=personal_info)
+
+    def _extract_personal_info(self):
+        regex_info = self.regex_personal_info
+        if self.skip_llm_if_regex_complete and regex_info['full_name'] and regex_info['email'] and regex_info['phone']:
+            print("   ⚡ regex ดึงข้อมูลส่วนตัวได้ครบ ข้ามการเรียก Llama")
+            return {
+                'full_name': regex_info['full_name'],
+                'email': regex_info['email'],
+                'phone': regex_info['phone'],
+                'education_level': ''
+            }
+        
+        # ดึงข้อมูลส่วนตัวจาก Resume ด้วย Llama 3.2 ก่อน
+        llama_personal_info = extract_personal_info_with_llama(self.resume_text, model=self.model)
+        
+        # ใช้ข้อมูลจาก Llama ถ้ามี ถ้าไม่มีให้ใช้ regex fallback
+        personal_info = {
+            'full_name': llama_personal_info.get('name') or '',
+            'email': llama_personal_info.get('email') or '',
+            'phone': llama_personal_info.get('phone') or '',
+            'education_level': llama_personal_info.get('education_level') or ''
+        }
+        
+        # ถ้าข้อมูลจาก Llama ไม่ครบ ให้ใช้ regex fallback
+        if not personal_info['full_name']:
+            personal_info['full_name'] = regex_info.get('full_name', '')
+        if not personal_info['email']:
+            personal_info['email'] = regex_info.get('email', '')
+        if not personal_info['phone']:
+            personal_info['phone'] = regex_info.get('phone', '')
+        
+        return personal_info
+
+class DocumentStore:
+    """เก็บข้อความที่อ่านจากไฟล์ Resume ที่อัปโหลดใน SQLite (โฟลเดอร์ uploads)
+
+    - documents: key คือ SHA-256 ของไฟล์ เก็บข้อความที่อ่านได้ ไฟล์เดิมที่อัปโหลดซ้ำจะไม่ต้องอ่าน PDF/DOCX ใหม่
+    - profiles: key คือ SHA-256 ของข้อความ เก็บ resume_clean และข้อมูลส่วนตัว (regex และ Llama)
+      ResumeContext ใช้ค่าที่เก็บไว้แทนการคำนวณใหม่ ส่วนผลวิเคราะห์ใช้ analysis_cache ได้ทันทีเพราะข้อความเหมือนเดิม
+    - แต่ละแถวเก็บเวอร์ชัน (DOCUMENT_EXTRACT_VERSION / PROFILE_VERSION) แถวที่เป็นเวอร์ชันอื่นถือว่าไม่มี
+    - เก็บไม่เกิน max_entries รายการต่อตาราง (ลบที่ไม่ได้ใช้นานที่สุดก่อน)
+    """
+
+    def __init__(self, db_path=DOCUMENT_STORE_PATH, max_entries=DOCUMENT_STORE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(file_digest TEXT PRIMARY KEY, filename TEXT, file_type TEXT, text TEXT NOT NULL, "
+            "max_chars INTEGER, complete INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles "
+            "(text_digest TEXT PRIMARY KEY, resume_clean TEXT, regex_personal_info TEXT, "
+            "personal_info TEXT, last_used REAL NOT NULL)"
+        )
+        # ไฟล์ฐานข้อมูลที่สร้างก่อนมีคอลัมน์ version (แถวเดิมได้ NULL จึงถือว่าเป็นเวอร์ชันเก่า)
+        for table in ('documents', 'profiles'):
+            columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}
+            if 'version' not in columns:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN version TEXT")
+        self._db.commit()
+
+    @staticmethod
+    def file_digest(stream, chunk_size=1024 * 1024):
+        """SHA-256 ของไฟล์ (อ่านทีละ chunk แล้ว seek กลับไปที่ต้นไฟล์)"""
+        digest = hashlib.sha256()
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+        stream.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def text_digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_text(self, file_digest, max_chars):
+        """คืนข้อความของไฟล์ที่เคยอ่านแล้ว ถ้าที่เก็บไว้ยาวพอสำหรับ max_chars (ไม่งั้นคืน None)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, max_chars, complete FROM documents WHERE file_digest = ? AND version = ?",
+                (file_digest, DOCUMENT_EXTRACT_VERSION)
+            ).fetchone()
+            if row and (row[2] or (row[1] or 0) >= max_chars):
+                self._db.execute("UPDATE documents SET last_used = ? WHERE file_digest = ?",
+                                 (time.time(), file_digest))
+                self._db.commit()
+                self.hits += 1
+                return row[0][:max_chars]
+            self.misses += 1
+            return None
+
+    def put_text(self, file_digest, filename, file_type, text, max_chars, complete):
+        """เก็บข้อความของไฟล์ และสร้าง profile ของข้อความนั้นไว้รอ ResumeContext
+        complete: อ่านครบทั้งไฟล์แล้ว (ใช้ได้กับทุก max_chars) ไม่งั้นใช้ได้กับ max_chars ไม่เกินที่อ่านไว้"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents "
+                "(file_digest, filename, file_type, text, max_chars, complete, last_used, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_digest, filename, file_type, text, max_chars, int(bool(complete)), now,
+                 DOCUMENT_EXTRACT_VERSION)
+            )
+            self._db.execute(
+                "INSERT OR IGNORE INTO profiles (text_digest, last_used, version) VALUES (?, ?, ?)",
+                (self.text_digest(text), now, PROFILE_VERSION)
+            )
+            self._prune()
+            self._db.commit()
+
+    def get_profile(self, text_digest):
+        """คืน dict ของ resume_clean, regex_personal_info, personal_info หรือ None ถ้าไม่ได้มาจากไฟล์ที่เก็บไว้
+        profile ที่เป็นเวอร์ชันอื่นจะถูกล้างค่าเดิม (คืนค่าว่างให้ ResumeContext คำนวณและเก็บใหม่)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT resume_clean, regex_personal_info, personal_info, version FROM profiles WHERE text_digest = ?",
+                (text_digest,)
+            ).fetchone()
+            if not row:
+                return None
+            if row[3] != PROFILE_VERSION:
+                self._db.execute(
+                    "UPDATE profiles SET resume_clean = NULL, regex_personal_info = NULL, personal_info = NULL, "
+                    "version = ?, last_used = ? WHERE text_digest = ?",
+                    (PROFILE_VERSION, time.time(), text_digest)
+                )
+                self._db.commit()
+                return {'resume_clean': None, 'regex_personal_info': None, 'personal_info': None}
+            self._db.execute("UPDATE profiles SET last_used = ? WHERE text_digest = ?", (time.time(), text_digest))
+            self._db.commit()
+        return {
+            'resume_clean': row[0],
+            'regex_personal_info': json.loads(row[1]) if row[1] else None,
+            'personal_info': json.loads(row[2]) if row[2] else None
+        }
+
+    def save_profile(self, text_digest, resume_clean=None, regex_personal_info=None, personal_info=None):
+        """อัปเดตข้อมูลใน profile ที่มีอยู่แล้ว (ไม่สร้างใหม่สำหรับข้อความที่ไม่ได้มาจากไฟล์)"""
+        updates = {}
+        if resume_clean is not None:
+            updates['resume_clean'] = resume_clean
+        if regex_personal_info is not None:
+            updates['regex_personal_info'] = json.dumps(regex_personal_info, ensure_ascii=False)
+        if personal_info is not None:
+            updates['personal_info'] = json.dumps(personal_info, ensure_ascii=False)
+        if not updates:
+            return
+        with self._lock:
+            self._db.execute(
+                f"UPDATE profiles SET {', '.join(f'{column} = ?' for column in updates)} WHERE text_digest = ?",
+                (*updates.values(), text_digest)
+            )
+            self._db.commit()
+
+    def _prune(self):
+        for table in ('documents', 'profiles'):
+            self._db.execute(
+                f"DELETE FROM {table} WHERE rowid NOT IN "
+                f"(SELECT rowid FROM {table} ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        with self._lock:
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'documents': documents,
+                'max_entries': self.max_entries
+            }
+
+# ที่เก็บข้อความจากไฟล์ที่อัปโหลด (ใช้ร่วมกันทั้งแอป)
+document_store = DocumentStore() if DOCUMENT_STORE_PATH else None
+
+def read_document_text(stream, filename, extract, max_chars):
+    """อ่านข้อความจากไฟล์ผ่าน document_store: ไฟล์ที่เคยอ่านแล้วจะไม่ถูกอ่านซ้ำ
+    extract(stream, status) คือฟังก์ชันที่อ่านข้อความจริง (ใช้เมื่อยังไม่มีใน store)
+    ข้อความที่อ่านไม่ครบเพราะหน้าเกินเวลาหรืออ่านไม่ได้ (status['interrupted']) จะไม่ถูกเก็บ"""
+    status = {}
+    if document_store is None:
+        return extract(stream, status)
+    digest = DocumentStore.file_digest(stream)
+    text = document_store.get_text(digest, max_chars)
+    if text is not None:
+        print(f"⚡ {filename}: ใช้ข้อความที่เคยอ่านไว้แล้ว")
+        return text
+    text = extract(stream, status)
+    if text and not status.get('interrupted'):
+        file_type = 'PDF' if filename.lower().endswith('.pdf') else 'DOCX'
+        document_store.put_text(digest, filename, file_type, text, max_chars, status.get('complete', False))
+    return text
+
+class AnalysisCache:
+    """Cache ผลการวิเคราะห์จาก Llama แบบ content-addressed
+
+    - key คือ SHA-256 ของ (resume ที่ clean แล้ว, JD, job title, model, prompt version, sampling options)
+    - tier แรกเป็น LRU ใน memory (จำกัดจำนวนด้วย max_entries)
+    - tier ที่สองเป็น SQLite บน disk (เปิดใช้เมื่อระบุ db_path) จำกัดจำนวนด้วย max_disk_entries
+    - ทุก entry หมดอายุตาม ttl (วินาที)
+    """
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, ttl=ANALYSIS_CACHE_TTL,
+                 db_path=ANALYSIS_CACHE_DB_PATH, max_disk_entries=ANALYSIS_CACHE_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(resume_clean, jd_text, job_title='', model=None, prompt_mode='single'):
+        """สร้าง cache key จากข้อมูลทุกอย่างที่มีผลกับผลลัพธ์ของ Llama
+        prompt_mode: 'single' (1 ตำแหน่งต่อ prompt) หรือ 'multi' (analyze_positions_with_llama)"""
+        key_data = json.dumps({
+            'prompt_version': ANALYSIS_PROMPT_VERSION,
+            'prompt_mode': prompt_mode,
+            'output_format': ANALYSIS_OUTPUT_FORMAT,
+            'model': resolve_ollama_model(model),
+            'options': OLLAMA_OPTIONS,
+            'resume': resume_clean,
+            'jd': jd_text.strip(),
+            'job_title': job_title or ''
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """คืนค่า copy ของผลลัพธ์ที่ cache ไว้ หรือ None ถ้าไม่มี/หมดอายุ"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            if entry:
+                del self._memory[key]
+            
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM analysis_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] <= self.ttl:
+                    value = json.loads(row[0])
+                    self._store_memory(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(value)
+                if row:
+                    self._db.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                    self._db.commit()
+            
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """เก็บผลลัพธ์ลง cache (ไม่เก็บค่า None)"""
+        if value is None:
+            return
+        now = time.time()
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._store_memory(key, value, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analysis_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now)
+                )
+                # ลบ entry ที่หมดอายุ และ entry เก่าสุดถ้าเกินขนาดที่กำหนด
+                self._db.execute("DELETE FROM analysis_cache WHERE created_at < ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM analysis_cache WHERE key NOT IN "
+                    "(SELECT key FROM analysis_cache ORDER BY created_at DESC LIMIT ?)",
+                    (self.max_disk_entries,)
+                )
+                self._db.commit()
+
+    def _store_memory(self, key, value, created_at):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM analysis_cache")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'disk_enabled': self._db is not None
+            }
+
+# Cache ที่ใช้ร่วมกันทั้งแอป
+analysis_cache = AnalysisCache()
+
+class JsonPositionBackend:
+    """เก็บตำแหน่งงานเป็น JSON list ของ {"id", "title", "description"}"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get('positions', []) if isinstance(data, dict) else data
+
+    def write(self, positions, upserted=None, deleted_id=None):
+        # เขียนทั้งไฟล์ใหม่ผ่านไฟล์ชั่วคราว เพื่อไม่ให้ผู้อ่านเห็นไฟล์ที่เขียนไม่ครบ
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(positions, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def version(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+class SqlitePositionBackend:
+    """เก็บตำแหน่งงานใน SQLite (เขียนเฉพาะแถวที่เปลี่ยน)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._is_new = not os.path.exists(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS positions "
+            "(id INTEGER PRIMARY KEY, title TEXT NOT NULL, description TEXT NOT NULL DEFAULT '')"
+        )
+        self._db.commit()
+
+    def load(self):
+        rows = self._db.execute("SELECT id, title, description FROM positions ORDER BY id").fetchall()
+        if not rows and self._is_new:
+            return None
+        return [{'id': row[0], 'title': row[1], 'description': row[2]} for row in rows]
+
+    def write(self, positions, upserted=None, deleted_id=None):
+        self._is_new = False
+        if upserted is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO positions (id, title, description) VALUES (?, ?, ?)",
+                (upserted['id'], upserted['title'], upserted['description'])
+            )
+        elif deleted_id is not None:
+            self._db.execute("DELETE FROM positions WHERE id = ?", (deleted_id,))
+        else:
+            self._db.execute("DELETE FROM positions")
+            self._db.executemany(
+                "INSERT INTO positions (id, title, description) VALUES (?, ?, ?)",
+                [(pos['id'], pos['title'], pos['description']) for pos in positions]
+            )
+        self._db.commit()
+
+    def version(self):
+        # data_version เปลี่ยนเมื่อ connection อื่น (เช่น process อื่น) แก้ไขฐานข้อมูล
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+class PositionStore:
+    """ที่เก็บตำแหน่งงานพร้อม index สำหรับค้นหาด้วย ID และชื่อตำแหน่ง
+
+    - backend เป็น JSON หรือ SQLite (เลือกจากนามสกุลของ path) หรือ memory อย่างเดียวถ้า path เป็น None
+    - เตรียม JobFeatures ของแต่ละตำแหน่งไว้ครั้งเดียวตอนโหลด/แก้ไข
+    - ตรวจไฟล์ที่ถูกแก้จากภายนอกทุก reload_interval วินาที แล้วโหลดใหม่โดยไม่ต้อง restart
+    """
+
+    def __init__(self, path=POSITIONS_STORE_PATH, seed=None, reload_interval=POSITIONS_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._backend = self._make_backend(path)
+        self._lock = threading.RLock()
+        self._positions = OrderedDict()  # id -> position
+        self._features = {}  # id -> JobFeatures
+        self._title_index = {}  # ชื่อตำแหน่ง (ตัวพิมพ์เล็ก) -> id
+        self._snapshot = []
+        self._version = None
+        self._last_check = 0.0
+        self._seed = list(seed or [])
+        self.reload()
+
+    @staticmethod
+    def _make_backend(path):
+        if not path:
+            return None
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.json':
+            return JsonPositionBackend(path)
+        if extension in ('.db', '.sqlite', '.sqlite3'):
+            return SqlitePositionBackend(path)
+        raise ValueError(f'ไม่รองรับไฟล์ตำแหน่งงานชนิด {extension} (ใช้ .json หรือ .db)')
+
+    @staticmethod
+    def _validate(data):
+        if not isinstance(data, dict):
+            raise ValueError('ข้อมูลตำแหน่งงานต้องเป็น object')
+        title = data.get('title')
+        description = data.get('description', '')
+        if not isinstance(title, str) or not title.strip():
+            raise ValueError('กรุณาระบุ title')
+        if not isinstance(description, str):
+            raise ValueError('description ต้องเป็นข้อความ')
+        return title.strip(), description
+
+    def _rebuild(self, positions):
+        self._positions = OrderedDict()
+        self._features = {}
+        self._title_index = {}
+        next_id = max([pos['id'] for pos in positions if isinstance(pos.get('id'), int)] or [0]) + 1
+        for pos in positions:
+            title, description = self._validate(pos)
+            position_id = pos.get('id')
+            if not isinstance(position_id, int) or position_id in self._positions:
+                position_id = next_id
+                next_id += 1
+            self._index({'id': position_id, 'title': title, 'description': description})
+        self._snapshot = list(self._positions.values())
+
+    def _index(self, position):
+        self._positions[position['id']] = position
+        self._title_index.setdefault(position['title'].lower(), position['id'])
+        self._features[position['id']] = JobFeatures(position['description'])
+
+    def _unindex(self, position_id):
+        position = self._positions.pop(position_id)
+        self._features.pop(position_id, None)
+        if self._title_index.get(position['title'].lower()) == position_id:
+            del self._title_index[position['title'].lower()]
+
+    def _persist(self, upserted=None, deleted_id=None):
+        self._snapshot = list(self._positions.values())
+        if self._backend is not None:
+            self._backend.write(self._snapshot, upserted=upserted, deleted_id=deleted_id)
+            self._version = self._backend.version()
+
+    def reload(self):
+        """โหลดตำแหน่งงานใหม่จาก backend (ถ้ายังไม่มีข้อมูล จะสร้างจาก seed)"""
+        with self._lock:
+            positions = self._backend.load() if self._backend is not None else None
+            if positions is None:
+                self._rebuild(self._seed)
+                self._persist()
+            else:
+                self._rebuild(positions)
+                self._version = self._backend.version()
+            self._last_check = time.time()
+            return len(self._positions)
+
+    def maybe_reload(self):
+        """โหลดใหม่ถ้า backend ถูกแก้จากภายนอกตั้งแต่ครั้งล่าสุด (ตรวจไม่บ่อยกว่า reload_interval)"""
+        if self._backend is None or time.time() - self._last_check < self.reload_interval:
+            return False
+        with self._lock:
+            self._last_check = time.time()
+            if self._backend.version() == self._version:
+                return False
+            try:
+                count = self.reload()
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"⚠️  โหลดตำแหน่งงานใหม่ไม่สำเร็จ ใช้ข้อมูลเดิม: {e}")
+                return False
+            print(f"🔄 โหลดตำแหน่งงานใหม่จาก {self.path}: {count} ตำแหน่ง")
+            return True
+
+    def list(self):
+        """คืนรายการตำแหน่งงานทั้งหมด (เรียงตาม id)"""
+        self.maybe_reload()
+        return list(self._snapshot)
+
+    def get(self, position_id):
+        self.maybe_reload()
+        return self._positions.get(position_id)
+
+    def find_by_title(self, title):
+        """หาตำแหน่งจากชื่อ (ไม่สนตัวพิมพ์เล็ก/ใหญ่)"""
+        self.maybe_reload()
+        position_id = self._title_index.get((title or '').strip().lower())
+        return self._positions.get(position_id) if position_id is not None else None
+
+    def features(self, position_id):
+        """คืน JobFeatures ที่คำนวณไว้แล้วของตำแหน่ง (None ถ้าไม่พบ)"""
+        return self._features.get(position_id)
+
+    def create(self, data):
+        title, description = self._validate(data)
+        with self._lock:
+            if title.lower() in self._title_index:
+                raise ValueError(f'มีตำแหน่งงานชื่อ {title} อยู่แล้ว')
+            position = {'id': max(self._positions, default=0) + 1, 'title': title, 'description': description}
+            self._index(position)
+            self._persist(upserted=position)
+            return position
+
+    def update(self, position_id, data):
+        """แก้ไขตำแหน่ง คืนค่า None ถ้าไม่พบ"""
+        with self._lock:
+            current = self._positions.get(position_id)
+            if current is None:
+                return None
+            title, description = self._validate({**current, **data})
+            existing_id = self._title_index.get(title.lower())
+            if existing_id is not None and existing_id != position_id:
+                raise ValueError(f'มีตำแหน่งงานชื่อ {title} อยู่แล้ว')
+            self._unindex(position_id)
+            position = {'id': position_id, 'title': title, 'description': description}
+            self._index(position)
+            self._positions = OrderedDict(sorted(self._positions.items()))
+            self._persist(upserted=position)
+            return position
+
+    def delete(self, position_id):
+        """ลบตำแหน่ง คืนค่า False ถ้าไม่พบ"""
+        with self._lock:
+            if position_id not in self._positions:
+                return False
+            self._unindex(position_id)
+            self._persist(deleted_id=position_id)
+            return True
+
+# ที่เก็บตำแหน่งงานที่ใช้ร่วมกันทั้งแอป
+position_store = PositionStore(seed=JOB_POSITIONS_DATABASE)
+
+def analyze_with_llama(resume_text, jd_text, job_title="", model=None, use_cache=True, context=None,
+                       jd_features=None):
+    """ใช้ Llama 3.2 วิเคราะห์ Resume และ Job Description (ผ่าน analysis_cache)
     
-    # ทำความสะอาด resume text ก่อน
-    resume_clean = clean_resume_text(resume_text)
-    jd_clean = jd_text.strip()
+    ส่ง context (ResumeContext) มาด้วยเมื่อวิเคราะห์ Resume เดียวกับหลายตำแหน่ง
+    เพื่อไม่ต้อง clean text และดึงข้อมูลส่วนตัวซ้ำทุกตำแหน่ง
+    และส่ง jd_features (JobFeatures) เพื่อไม่ต้องประมวลผล JD ซ้ำทุก Resume
+    """
+    context = context or ResumeContext(resume_text, model=model)
+    jd_features = jd_features or get_job_features(jd_text)
+    if not use_cache:
+        return analyze_with_llama_uncached(resume_text, jd_text, job_title, model=model, context=context,
+                                           jd_features=jd_features)
     
-    # จำกัดความยาวเพื่อไม่ให้ prompt ยาวเกินไป (Llama 3.2:1b มี context limit)
-    if len(resume_clean) > 2000:
-        resume_clean = resume_clean[:2000] + "..."
-    if len(jd_clean) > 1000:
-        jd_clean = jd_clean[:1000] + "..."
+    cache_key = AnalysisCache.make_key(context.resume_clean, jd_features.clean, job_title, model)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        if job_title:
+            print(f"   ⚡ {job_title}: ใช้ผลลัพธ์จาก cache")
+        return cached
     
-    # ดึงข้อมูลส่วนตัวจาก Resume ด้วย Llama 3.2 ก่อน
-    llama_personal_info = extract_personal_info_with_llama(resume_text, model=model)
+    result = analyze_with_llama_uncached(resume_text, jd_text, job_title, model=model, context=context,
+                                         jd_features=jd_features)
+    analysis_cache.set(cache_key, result)
+    return result
+
+def analyze_with_llama_uncached(resume_text, jd_text, job_title="", model=None, context=None, jd_features=None):
+    """ใช้ Llama 3.2 วิเคราะห์ Resume และ Job Description (เรียก Llama ทุกครั้ง ไม่ผ่าน cache)"""
     
-    # ใช้ข้อมูลจาก Llama ถ้ามี ถ้าไม่มีให้ใช้ regex fallback
-    personal_info = {
-        'full_name': llama_personal_info.get('name') or '',
-        'email': llama_personal_info.get('email') or '',
-        'phone': llama_personal_info.get('phone') or '',
-        'education_level': llama_personal_info.get('education_level') or ''
-    }
+    # ใช้ข้อมูลต่อ Resume และต่อ JD ที่คำนวณไว้แล้ว (clean text, ข้อมูลส่วนตัว, JD ที่ตัดความยาวแล้ว)
+    context = context or ResumeContext(resume_text, model=model)
+    jd_features = jd_features or get_job_features(jd_text)
+    resume_clean = context.prompt_resume
+    jd_clean = jd_features.prompt_fragment
     
-    # ถ้าข้อมูลจาก Llama ไม่ครบ ให้ใช้ regex fallback
-    if not personal_info['full_name'] or not personal_info['email'] or not personal_info['phone']:
-        regex_personal_info = extract_personal_info_from_resume(resume_text)
-        if not personal_info['full_name']:
-            personal_info['full_name'] = regex_personal_info.get('full_name', '')
-        if not personal_info['email']:
-            personal_info['email'] = regex_personal_info.get('email', '')
-        if not personal_info['phone']:
-            personal_info['phone'] = regex_personal_info.get('phone', '')
+    # ข้อมูลส่วนตัวดึงครั้งเดียวต่อ Resume (Llama + regex fallback)
+    # ถ้าใช้ structured output จะไม่เรียก Llama แยก แต่ให้โมเดลเติมช่องที่ regex หาไม่เจอใน generation เดียวกัน
+    output_format = analysis_output_format()
+    personal_info = context.known_personal_info() if output_format else context.personal_info
     
     job_title_part = f"Job Title: {job_title}\n\n" if job_title else ""
+    response_template = ANALYSIS_RESPONSE_TEMPLATE if not isinstance(output_format, dict) else ''
     
     # Prompt ที่ปรับปรุงแล้ว - ใช้ prompt ใหม่ที่ชัดเจนและมีข้อมูลส่วนตัวที่ดึงมาแล้ว
+    # ส่วนที่เหมือนกันทุกตำแหน่ง (คำสั่ง, Resume) อยู่ต้น prompt ตามด้วยข้อมูลส่วนตัว และ JD อยู่ท้ายสุด
+    # เพื่อให้ Ollama ใช้ prompt cache ของส่วนต้นซ้ำได้ระหว่างตำแหน่งของ Resume เดียวกัน
+    # (ข้อมูลส่วนตัวอยู่หลัง Resume เพราะเปลี่ยนได้หลัง learn_personal_info ของตำแหน่งแรก)
     prompt = f"""คุณคือระบบวิเคราะห์ใบสมัครงาน (AI Recruitment Analyst)
 
 หน้าที่ของคุณคือวิเคราะห์ Resume เทียบกับ Job Description แล้วตอบกลับในรูปแบบ JSON เท่านั้น  
 
 ห้ามมีข้อความใด ๆ นอกเหนือจาก JSON ที่กำหนด
 
-=====================================================================
-🔐 ข้อมูลส่วนตัวจากระบบ (ดึงด้วย regex – ห้ามแก้ไขแม้แต่นิดเดียว)
-=====================================================================
-
-full_name: "{personal_info['full_name']}"
-
-email: "{personal_info['email']}"
-
-phone: "{personal_info['phone']}"
-
-คำสั่งสำคัญ:
-
-- ถ้าค่าเหล่านี้ "ไม่ว่าง" → ใช้ตามนี้ ห้ามแก้ไข ห้ามตีความใหม่
-
-- ถ้าค่าว่าง → ให้ค้นหาจาก Resume เท่านั้น ห้ามเดาเอง
-
 =====================================================================
 กฎสำคัญ:
 =====================================================================
@@ -725,359 +2543,1143 @@ phone: "{personal_info['phone']}"
   "why_suitable": "string",
   "recommendation": "string"
 }}
+{response_template}
 
-{job_title_part}=====================================================================
+=====================================================================
 📄 ข้อความ Resume
 =====================================================================
 
 {resume_clean}
 
 =====================================================================
-📄 ข้อความ Job Description
+🔐 ข้อมูลส่วนตัวจากระบบ (ดึงด้วย regex – ห้ามแก้ไขแม้แต่นิดเดียว)
 =====================================================================
 
-{jd_clean}
+full_name: "{personal_info['full_name']}"
 
-=====================================================================
-โปรดตอบกลับเป็น JSON ตามแบบด้านล่างเท่านั้น:
-=====================================================================
+email: "{personal_info['email']}"
 
-{{
-  "full_name": "",
-  "email": "",
-  "phone": "",
-  "summary": "",
-  "skills_detected": [],
+phone: "{personal_info['phone']}"
+
+คำสั่งสำคัญ:
+
+- ถ้าค่าเหล่านี้ "ไม่ว่าง" → ใช้ตามนี้ ห้ามแก้ไข ห้ามตีความใหม่
+
+- ถ้าค่าว่าง → ให้ค้นหาจาก Resume เท่านั้น ห้ามเดาเอง
+
+=====================================================================
+📄 ข้อความ Job Description
+=====================================================================
+
+{job_title_part}{jd_clean}"""
+
+    response = call_llama(prompt, model=model, output_format=output_format, label=job_title)
+    
+    if not response:
+        if job_title:
+            print(f"⚠️  {job_title}: Llama API ไม่ได้ response หรือ response เป็น empty")
+        return None
+    
+    # พยายามดึง JSON จาก response (strict parse ก่อน แล้วค่อยซ่อมด้วย regex ถ้าจำเป็น)
+    try:
+        result = parse_analysis_response(response, job_title)
+        if output_format:
+            context.learn_personal_info(result)
+        
+        return finalize_llama_result(result, response, resume_text, jd_text, job_title,
+                                     context=context, jd_features=jd_features)
+    except json.JSONDecodeError as e:
+        # ถ้า parse ไม่ได้ ให้ใช้ fallback
+        analysis_parse_stats.record('failed')
+        if job_title:
+            print(f"⚠️  {job_title}: ไม่สามารถ parse JSON ได้")
+            print(f"   Response preview: {response[:300]}...")
+            print(f"   Error: {str(e)[:100]}")
+        return None
+    except Exception as e:
+        # จัดการ error อื่นๆ
+        if job_title:
+            print(f"⚠️  {job_title}: เกิด error ในการ parse: {str(e)[:100]}")
+        return None
+
+# รูปแบบ JSON ที่ขอให้โมเดลตอบ (ใช้ใน prompt เมื่อไม่ได้ส่ง JSON schema ให้ Ollama)
+ANALYSIS_RESPONSE_TEMPLATE = """
+=====================================================================
+โปรดตอบกลับเป็น JSON ตามแบบด้านล่างเท่านั้น:
+=====================================================================
+
+{
+  "full_name": "",
+  "email": "",
+  "phone": "",
+  "summary": "",
+  "skills_detected": [],
   "strengths": [],
   "skill_gaps": [],
   "match_percentage": "",
   "why_suitable": "",
   "recommendation": ""
-}}"""
+}"""
 
-    response = call_llama(prompt, model=model)
+# JSON schema ของผลวิเคราะห์ (ส่งเป็น "format" ให้ Ollama เมื่อ ANALYSIS_OUTPUT_FORMAT = 'schema')
+ANALYSIS_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "full_name": {"type": "string"},
+        "email": {"type": "string"},
+        "phone": {"type": "string"},
+        "summary": {"type": "string"},
+        "skills_detected": {"type": "array", "items": {"type": "string"}},
+        "strengths": {"type": "array", "items": {"type": "string"}},
+        "skill_gaps": {"type": "array", "items": {"type": "string"}},
+        "match_percentage": {"type": "string"},
+        "why_suitable": {"type": "string"},
+        "recommendation": {"type": "string"}
+    },
+    "required": ["full_name", "email", "phone", "summary", "skills_detected", "strengths",
+                 "skill_gaps", "match_percentage", "why_suitable", "recommendation"]
+}
+
+def analysis_output_format():
+    """ค่า "format" ที่ส่งให้ Ollama ตาม ANALYSIS_OUTPUT_FORMAT (None = ไม่บังคับรูปแบบ)"""
+    if ANALYSIS_OUTPUT_FORMAT == 'schema':
+        return ANALYSIS_JSON_SCHEMA
+    if ANALYSIS_OUTPUT_FORMAT == 'json':
+        return 'json'
+    return None
+
+class AnalysisParseStats:
+    """นับว่า response ของการวิเคราะห์ถูก parse ด้วยวิธีไหน (ดูได้ที่ /api/cache-stats)
+
+    - strict: json.loads ทั้ง response ได้เลย (กรณีปกติเมื่อใช้ structured output)
+    - extracted: ต้องตัดข้อความนอก JSON object ออกก่อน
+    - repaired: ต้องแก้ nested JSON string ก่อน parse
+    - salvaged: parse ไม่ได้ ต้องดึงทีละ field ด้วย regex
+    - failed: ไม่พบ JSON เลย ใช้ fallback analysis
+    นับ 1 ครั้งต่อตำแหน่งต่อ response (prompt หลายตำแหน่งนับตามจำนวนตำแหน่งใน prompt)
+    """
+
+    KINDS = ('strict', 'extracted', 'repaired', 'salvaged', 'failed')
+
+    def __init__(self):
+        self._counts = dict.fromkeys(self.KINDS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, kind, count=1):
+        with self._lock:
+            self._counts[kind] += count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counts)
+        total = sum(stats.values())
+        fallback = stats['repaired'] + stats['salvaged'] + stats['failed']
+        stats['fallback_rate'] = round(fallback / total, 4) if total else 0.0
+        return stats
+
+analysis_parse_stats = AnalysisParseStats()
+
+def parse_analysis_response(response, job_title=""):
+    """แปลง response ของการวิเคราะห์เป็น dict
+
+    ลอง json.loads ทั้ง response ก่อน (fast path) ถ้าไม่ได้จึงหา JSON object ตัวแรก
+    และซ่อมด้วย regex ตามลำดับ (นับจำนวนแต่ละวิธีใน analysis_parse_stats)
+    raise json.JSONDecodeError ถ้าไม่พบ JSON object เลย
+    """
+    try:
+        result = json.loads(response)
+    except json.JSONDecodeError:
+        result = None
+    if isinstance(result, dict):
+        analysis_parse_stats.record('strict')
+        return normalize_analysis_fields(result)
     
-    if not response:
-        if job_title:
-            print(f"⚠️  {job_title}: Llama API ไม่ได้ response หรือ response เป็น empty")
-        return None
+    # หา JSON object ที่สมบูรณ์ตัวแรก (นับ brackets)
+    json_str = extract_json_object(response)
+    
+    # ลอง parse JSON
+    try:
+        result = json.loads(json_str)
+        analysis_parse_stats.record('extracted')
+    except json.JSONDecodeError:
+        result = repair_analysis_json(json_str, job_title)
+    return normalize_analysis_fields(result)
+
+def repair_analysis_json(json_str, job_title=""):
+    """ซ่อม JSON ที่ parse ไม่ได้ (nested JSON string) ถ้ายังไม่ได้จะดึงทีละ field ด้วย regex"""
+    # ถ้า parse ไม่ได้ ลองทำการ clean nested JSON strings
+    # หาและแก้ไข fields ที่มี nested JSON string เช่น "summary": "{\"key\": \"value\"}"
+    json_str_clean = json_str
+    
+    # แก้ไข nested JSON string ใน string fields
+    for field in ['summary', 'why_suitable', 'recommendation']:
+        # Pattern: "field": "{\"...\"}"
+        pattern = rf'"{field}"\s*:\s*"(\{{[^"]*)"([^"]*)"'
+        match = re.search(pattern, json_str_clean)
+        if match:
+            # เอาเฉพาะ value ที่อยู่หลัง nested JSON
+            value_part = match.group(2) if len(match.groups()) > 1 else ""
+            # แทนที่ด้วย plain text
+            json_str_clean = re.sub(
+                rf'"{field}"\s*:\s*"\{{[^"]*"[^"]*"',
+                f'"{field}": "{value_part}"',
+                json_str_clean,
+                count=1
+            )
     
-    # พยายามดึง JSON จาก response (อาจมีข้อความอื่นปนอยู่)
+    # ลอง parse อีกครั้ง
     try:
-        # หา JSON object โดยนับ brackets เพื่อหา JSON object ที่สมบูรณ์
-        start_idx = response.find('{')
-        if start_idx == -1:
-            raise json.JSONDecodeError("No JSON object found", response, 0)
-        
-        # นับ brackets เพื่อหา JSON object ที่สมบูรณ์
-        bracket_count = 0
-        in_string = False
-        escape_next = False
-        end_idx = start_idx
-        
-        for i in range(start_idx, len(response)):
-            char = response[i]
+        result = json.loads(json_str_clean)
+        analysis_parse_stats.record('repaired')
+        return result
+    except json.JSONDecodeError:
+        pass
+    
+    analysis_parse_stats.record('salvaged')
+    # ถ้ายัง parse ไม่ได้ ให้ extract fields แบบ manual
+    result = {}
+    # Extract string fields (รองรับ nested JSON string)
+    for field in ['full_name', 'email', 'phone', 'summary', 'why_suitable', 'recommendation', 'match_percentage']:
+        # ลองหาแบบปกติก่อน (รองรับ multiline และ nested JSON)
+        # Pattern ที่รองรับ: "field": "value" หรือ "field": "{\"key\": \"value\"}"
+        pattern = rf'"{field}"\s*:\s*"((?:[^"\\]|\\.|\\n)*)"'
+        match = re.search(pattern, json_str, re.DOTALL)
+        if match:
+            value = match.group(1)
+            # ถ้ามี nested JSON ลอง extract value จาก nested JSON
+            if value.startswith('{'):
+                # ลอง parse nested JSON
+                try:
+                    nested_json = json.loads(value)
+                    # ถ้า parse ได้ ให้หาค่าแรกที่เป็น string
+                    if isinstance(nested_json, dict):
+                        # หา value แรกที่เป็น string
+                        for v in nested_json.values():
+                            if isinstance(v, str) and v:
+                                value = v
+                                break
+                        # ถ้าไม่เจอ string value ให้ใช้ key แรก
+                        if value.startswith('{'):
+                            first_key = list(nested_json.keys())[0] if nested_json else ""
+                            value = first_key
+                    elif isinstance(nested_json, str):
+                        value = nested_json
+                except:
+                    # ถ้า parse ไม่ได้ ให้ลอง extract แบบ manual
+                    # รูปแบบ 1: {"key": "value"}
+                    nested_match = re.search(r'"([^"]+)"\s*:\s*"([^"]*)"', value)
+                    if nested_match:
+                        value = nested_match.group(2)
+                    else:
+                        # รูปแบบ 2: {"key": "value with spaces"}
+                        nested_match = re.search(r':\s*"([^"]*)"', value)
+                        if nested_match:
+                            value = nested_match.group(1)
+                        else:
+                            # ถ้ายังไม่เจอ ให้ลบ JSON structure ออก
+                            value = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
+                            value = re.sub(r'"\s*\}$', '', value)
             
-            if escape_next:
-                escape_next = False
-                continue
+            # Clean up value - แก้ไข escape sequences
+            value = value.replace('\\"', '"').replace('\\\\', '\\').replace('\\n', '\n').replace('\\r', '').strip()
             
-            if char == '\\':
-                escape_next = True
-                continue
+            # ถ้ายังมี JSON structure เหลืออยู่ ให้ลบออก
+            if value.startswith('{') and value.endswith('}'):
+                # ลอง extract text จาก JSON
+                text_match = re.search(r':\s*"([^"]*)"', value)
+                if text_match:
+                    value = text_match.group(1)
+                else:
+                    # ลบ JSON structure ทั้งหมด
+                    value = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
+                    value = re.sub(r'"\s*\}$', '', value)
             
-            if char == '"' and not escape_next:
-                in_string = not in_string
-                continue
+            # ลบ escape characters ที่เหลือ
+            value = value.replace('\\"', '"').replace('\\\\', '\\')
             
-            if not in_string:
-                if char == '{':
-                    bracket_count += 1
-                elif char == '}':
-                    bracket_count -= 1
-                    if bracket_count == 0:
-                        end_idx = i + 1
-                        break
-        
-        json_str = response[start_idx:end_idx]
-        
-        # ลอง parse JSON
-        try:
-            result = json.loads(json_str)
-        except json.JSONDecodeError:
-            # ถ้า parse ไม่ได้ ลองทำการ clean nested JSON strings
-            # หาและแก้ไข fields ที่มี nested JSON string เช่น "summary": "{\"key\": \"value\"}"
-            json_str_clean = json_str
-            
-            # แก้ไข nested JSON string ใน string fields
-            for field in ['summary', 'why_suitable', 'recommendation']:
-                # Pattern: "field": "{\"...\"}"
-                pattern = rf'"{field}"\s*:\s*"(\{{[^"]*)"([^"]*)"'
-                match = re.search(pattern, json_str_clean)
+            if value and value != '{"Job Description:':
+                result[field] = value
+        else:
+            # ลองหาแบบไม่ต้องมี quotes (สำหรับ match_percentage)
+            if field == 'match_percentage':
+                pattern = rf'"{field}"\s*:\s*"([^"]*)"|"{field}"\s*:\s*(\d+%)'
+                match = re.search(pattern, json_str)
                 if match:
-                    # เอาเฉพาะ value ที่อยู่หลัง nested JSON
-                    value_part = match.group(2) if len(match.groups()) > 1 else ""
-                    # แทนที่ด้วย plain text
-                    json_str_clean = re.sub(
-                        rf'"{field}"\s*:\s*"\{{[^"]*"[^"]*"',
-                        f'"{field}": "{value_part}"',
-                        json_str_clean,
-                        count=1
-                    )
+                    result[field] = match.group(1) or match.group(2) or "0%"
+    
+    # Extract array fields
+    for field in ['skills_detected', 'strengths', 'skill_gaps']:
+        pattern = rf'"{field}"\s*:\s*\[(.*?)\]'
+        match = re.search(pattern, json_str, re.DOTALL)
+        if match:
+            items_str = match.group(1)
+            # Extract items from array
+            items = re.findall(r'"((?:[^"\\]|\\.)*)"', items_str)
+            result[field] = [item.replace('\\"', '"').replace('\\\\', '\\') for item in items]
+        else:
+            result[field] = []
+    
+    # Log extracted fields for debugging
+    if job_title:
+        extracted_fields = list(result.keys())
+        print(f"   Extracted fields: {', '.join(extracted_fields)}")
+
+    return result
+
+def normalize_analysis_fields(result):
+    """แปลงชนิดของ fields และลบ JSON string ที่หลงเหลืออยู่ใน string fields"""
+    # แปลง why_suitable และ recommendation จาก array เป็น string ถ้าเป็น array
+    if 'why_suitable' in result and isinstance(result['why_suitable'], list):
+        result['why_suitable'] = ' '.join(result['why_suitable'])
+    if 'recommendation' in result and isinstance(result['recommendation'], list):
+        result['recommendation'] = ' '.join(result['recommendation'])
+    
+    # ทำความสะอาด string fields - ลบ JSON string ที่เหลืออยู่
+    for field in ['full_name', 'email', 'phone', 'why_suitable', 'recommendation', 'summary']:
+        if field in result and isinstance(result[field], str):
+            value = result[field]
+            # ถ้ายังมี JSON structure อยู่ ให้ลบออก
+            if value.startswith('{') or value.startswith('{"'):
+                # ลอง parse เป็น JSON
+                try:
+                    parsed = json.loads(value)
+                    if isinstance(parsed, dict):
+                        # หา value แรกที่เป็น string
+                        for v in parsed.values():
+                            if isinstance(v, str) and v:
+                                result[field] = v
+                                break
+                except:
+                    # ถ้า parse ไม่ได้ ให้ลบ JSON structure ออก
+                    # ลบ pattern: {"key": "value"}
+                    cleaned = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
+                    cleaned = re.sub(r'"\s*\}$', '', cleaned)
+                    # ลบ escape characters
+                    cleaned = cleaned.replace('\\"', '"').replace('\\\\', '\\').replace('\\n', ' ').strip()
+                    if cleaned and not cleaned.startswith('{'):
+                        result[field] = cleaned
             
-            # ลอง parse อีกครั้ง
-            try:
-                result = json.loads(json_str_clean)
-            except json.JSONDecodeError:
-                # ถ้ายัง parse ไม่ได้ ให้ extract fields แบบ manual
-                result = {}
-                # Extract string fields (รองรับ nested JSON string)
-                for field in ['full_name', 'email', 'phone', 'summary', 'why_suitable', 'recommendation', 'match_percentage']:
-                    # ลองหาแบบปกติก่อน (รองรับ multiline และ nested JSON)
-                    # Pattern ที่รองรับ: "field": "value" หรือ "field": "{\"key\": \"value\"}"
-                    pattern = rf'"{field}"\s*:\s*"((?:[^"\\]|\\.|\\n)*)"'
-                    match = re.search(pattern, json_str, re.DOTALL)
-                    if match:
-                        value = match.group(1)
-                        # ถ้ามี nested JSON ลอง extract value จาก nested JSON
-                        if value.startswith('{'):
-                            # ลอง parse nested JSON
-                            try:
-                                nested_json = json.loads(value)
-                                # ถ้า parse ได้ ให้หาค่าแรกที่เป็น string
-                                if isinstance(nested_json, dict):
-                                    # หา value แรกที่เป็น string
-                                    for v in nested_json.values():
-                                        if isinstance(v, str) and v:
-                                            value = v
-                                            break
-                                    # ถ้าไม่เจอ string value ให้ใช้ key แรก
-                                    if value.startswith('{'):
-                                        first_key = list(nested_json.keys())[0] if nested_json else ""
-                                        value = first_key
-                                elif isinstance(nested_json, str):
-                                    value = nested_json
-                            except:
-                                # ถ้า parse ไม่ได้ ให้ลอง extract แบบ manual
-                                # รูปแบบ 1: {"key": "value"}
-                                nested_match = re.search(r'"([^"]+)"\s*:\s*"([^"]*)"', value)
-                                if nested_match:
-                                    value = nested_match.group(2)
-                                else:
-                                    # รูปแบบ 2: {"key": "value with spaces"}
-                                    nested_match = re.search(r':\s*"([^"]*)"', value)
-                                    if nested_match:
-                                        value = nested_match.group(1)
-                                    else:
-                                        # ถ้ายังไม่เจอ ให้ลบ JSON structure ออก
-                                        value = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
-                                        value = re.sub(r'"\s*\}$', '', value)
-                        
-                        # Clean up value - แก้ไข escape sequences
-                        value = value.replace('\\"', '"').replace('\\\\', '\\').replace('\\n', '\n').replace('\\r', '').strip()
-                        
-                        # ถ้ายังมี JSON structure เหลืออยู่ ให้ลบออก
-                        if value.startswith('{') and value.endswith('}'):
-                            # ลอง extract text จาก JSON
-                            text_match = re.search(r':\s*"([^"]*)"', value)
-                            if text_match:
-                                value = text_match.group(1)
-                            else:
-                                # ลบ JSON structure ทั้งหมด
-                                value = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
-                                value = re.sub(r'"\s*\}$', '', value)
-                        
-                        # ลบ escape characters ที่เหลือ
-                        value = value.replace('\\"', '"').replace('\\\\', '\\')
-                        
-                        if value and value != '{"Job Description:':
-                            result[field] = value
-                    else:
-                        # ลองหาแบบไม่ต้องมี quotes (สำหรับ match_percentage)
-                        if field == 'match_percentage':
-                            pattern = rf'"{field}"\s*:\s*"([^"]*)"|"{field}"\s*:\s*(\d+%)'
-                            match = re.search(pattern, json_str)
-                            if match:
-                                result[field] = match.group(1) or match.group(2) or "0%"
-                
-                # Extract array fields
-                for field in ['skills_detected', 'strengths', 'skill_gaps']:
-                    pattern = rf'"{field}"\s*:\s*\[(.*?)\]'
-                    match = re.search(pattern, json_str, re.DOTALL)
-                    if match:
-                        items_str = match.group(1)
-                        # Extract items from array
-                        items = re.findall(r'"((?:[^"\\]|\\.)*)"', items_str)
-                        result[field] = [item.replace('\\"', '"').replace('\\\\', '\\') for item in items]
-                    else:
-                        result[field] = []
-                
-                # Log extracted fields for debugging
-                if job_title:
-                    extracted_fields = list(result.keys())
-                    print(f"   Extracted fields: {', '.join(extracted_fields)}")
-        
-        # แปลง why_suitable และ recommendation จาก array เป็น string ถ้าเป็น array
-        if 'why_suitable' in result and isinstance(result['why_suitable'], list):
-            result['why_suitable'] = ' '.join(result['why_suitable'])
-        if 'recommendation' in result and isinstance(result['recommendation'], list):
-            result['recommendation'] = ' '.join(result['recommendation'])
-        
-        # ทำความสะอาด string fields - ลบ JSON string ที่เหลืออยู่
-        for field in ['full_name', 'email', 'phone', 'why_suitable', 'recommendation', 'summary']:
-            if field in result and isinstance(result[field], str):
-                value = result[field]
-                # ถ้ายังมี JSON structure อยู่ ให้ลบออก
-                if value.startswith('{') or value.startswith('{"'):
-                    # ลอง parse เป็น JSON
-                    try:
-                        parsed = json.loads(value)
-                        if isinstance(parsed, dict):
-                            # หา value แรกที่เป็น string
-                            for v in parsed.values():
-                                if isinstance(v, str) and v:
-                                    result[field] = v
-                                    break
-                    except:
-                        # ถ้า parse ไม่ได้ ให้ลบ JSON structure ออก
-                        # ลบ pattern: {"key": "value"}
-                        cleaned = re.sub(r'^\{"[^"]*"\s*:\s*"', '', value)
-                        cleaned = re.sub(r'"\s*\}$', '', cleaned)
-                        # ลบ escape characters
-                        cleaned = cleaned.replace('\\"', '"').replace('\\\\', '\\').replace('\\n', ' ').strip()
-                        if cleaned and not cleaned.startswith('{'):
-                            result[field] = cleaned
-                
-                # ลบ escape sequences ที่เหลือ
-                result[field] = result[field].replace('\\n', ' ').replace('\\r', '').strip()
-
-        # ตรวจสอบว่ามี fields ที่จำเป็นครบหรือไม่
-        if not result or len(result) == 0:
-            if job_title:
-                print(f"⚠️  {job_title}: JSON ไม่ครบถ้วน (result is empty) ใช้ fallback analysis")
-            return None
-        
-        # ตรวจสอบว่ามี fields สำคัญอย่างน้อย 1 field หรือไม่
-        important_fields = ['summary', 'why_suitable', 'recommendation', 'match_percentage']
-        has_important_field = any(field in result for field in important_fields)
-        
-        if not has_important_field:
-            if job_title:
-                print(f"⚠️  {job_title}: ไม่มี fields สำคัญ ใช้ fallback analysis")
-            return None
+            # ลบ escape sequences ที่เหลือ
+            result[field] = result[field].replace('\\n', ' ').replace('\\r', '').strip()
+    
+    return result
 
-        # คำนวณ match_percentage จากข้อมูลจริงเสมอ (แทนการใช้ค่าจาก Llama)
-        # เพื่อให้แต่ละตำแหน่งได้คะแนนที่แตกต่างกันตามข้อมูลจริง
-        calculated_percentage = calculate_match_percentage(resume_text, jd_text, result)
-        result['match_percentage'] = calculated_percentage
-        
-        # Log ถ้าค่าที่คำนวณได้แตกต่างจากค่าจาก Llama (ถ้ามี)
+def finalize_llama_result(result, response, resume_text, jd_text, job_title="", context=None, jd_features=None):
+    """ตรวจสอบผลวิเคราะห์ที่ parse แล้ว คำนวณ match_percentage จากข้อมูลจริง และเติม fields ที่ขาด
+    คืนค่า None ถ้าไม่มี fields สำคัญ (ผู้เรียกจะใช้ fallback analysis)"""
+    # ตรวจสอบว่ามี fields ที่จำเป็นครบหรือไม่
+    if not result or len(result) == 0:
         if job_title:
-            # ลองหา match_percentage จาก response เพื่อเปรียบเทียบ
-            match_pattern = r'"match_percentage"\s*:\s*"([^"]*)"|"match_percentage"\s*:\s*(\d+%)|match_percentage["\s:]+([0-9]+%)'
-            match = re.search(match_pattern, response, re.IGNORECASE)
-            if match:
-                llama_percentage = (match.group(1) or match.group(2) or match.group(3) or "0%")
-                if llama_percentage != calculated_percentage:
-                    print(f"   💡 {job_title}: คำนวณ match_percentage จากข้อมูลจริง: {calculated_percentage} (Llama: {llama_percentage})")
-            else:
-                print(f"   💡 {job_title}: คำนวณ match_percentage จากข้อมูลจริง: {calculated_percentage}")
-        
-        # Extract personal info จาก resume ถ้ายังไม่มี
-        if 'full_name' not in result or not result.get('full_name'):
-            # ลองหา name จาก resume (มักจะอยู่บรรทัดแรกๆ)
-            name_match = re.search(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)', resume_text, re.MULTILINE)
-            if name_match:
-                result['full_name'] = name_match.group(1).strip()
+            print(f"⚠️  {job_title}: JSON ไม่ครบถ้วน (result is empty) ใช้ fallback analysis")
+        return None
+    
+    # ตรวจสอบว่ามี fields สำคัญอย่างน้อย 1 field หรือไม่
+    important_fields = ['summary', 'why_suitable', 'recommendation', 'match_percentage']
+    has_important_field = any(field in result for field in important_fields)
+    
+    if not has_important_field:
+        if job_title:
+            print(f"⚠️  {job_title}: ไม่มี fields สำคัญ ใช้ fallback analysis")
+        return None
+
+    # คำนวณ match_percentage จากข้อมูลจริงเสมอ (แทนการใช้ค่าจาก Llama)
+    # เพื่อให้แต่ละตำแหน่งได้คะแนนที่แตกต่างกันตามข้อมูลจริง
+    calculated_percentage = calculate_match_percentage(resume_text, jd_text, result,
+                                                       jd_features=jd_features, context=context)
+    result['match_percentage'] = calculated_percentage
+    
+    # Log ถ้าค่าที่คำนวณได้แตกต่างจากค่าจาก Llama (ถ้ามี)
+    if job_title:
+        # ลองหา match_percentage จาก response เพื่อเปรียบเทียบ
+        match_pattern = r'"match_percentage"\s*:\s*"([^"]*)"|"match_percentage"\s*:\s*(\d+%)|match_percentage["\s:]+([0-9]+%)'
+        match = re.search(match_pattern, response, re.IGNORECASE)
+        if match:
+            llama_percentage = (match.group(1) or match.group(2) or match.group(3) or "0%")
+            if llama_percentage != calculated_percentage:
+                print(f"   💡 {job_title}: คำนวณ match_percentage จากข้อมูลจริง: {calculated_percentage} (Llama: {llama_percentage})")
+        else:
+            print(f"   💡 {job_title}: คำนวณ match_percentage จากข้อมูลจริง: {calculated_percentage}")
+    
+    # Extract personal info จาก resume ถ้ายังไม่มี (สแกนครั้งเดียวต่อ Resume ผ่าน ResumeContext)
+    contact_info = context.fallback_contact_info if context else fallback_contact_info(resume_text)
+    for field in ('full_name', 'email', 'phone'):
+        if field not in result or not result.get(field):
+            result[field] = contact_info[field] or "Not specified"
+    
+    # ตรวจสอบ fields อื่นๆ ที่จำเป็น
+    required_fields = ['full_name', 'email', 'phone', 'summary', 'skills_detected', 'strengths', 'skill_gaps', 'why_suitable', 'recommendation']
+    missing_fields = [f for f in required_fields if f not in result]
+    if missing_fields:
+        # เติม default values สำหรับ fields ที่ขาด
+        if 'summary' not in result or not result.get('summary'):
+            result['summary'] = "ผู้สมัครมีประสบการณ์และทักษะที่เกี่ยวข้อง"
+        if 'skills_detected' not in result:
+            result['skills_detected'] = []
+        if 'strengths' not in result or len(result.get('strengths', [])) < 3:
+            # ต้องมีอย่างน้อย 3 strengths
+            if not result.get('strengths'):
+                result['strengths'] = []
+            # ถ้ามีน้อยกว่า 3 ให้เพิ่ม
+            while len(result.get('strengths', [])) < 3:
+                result['strengths'].append("มีทักษะและประสบการณ์ที่เกี่ยวข้อง")
+        if 'skill_gaps' not in result or len(result.get('skill_gaps', [])) < 2:
+            # ต้องมีอย่างน้อย 2 skill_gaps
+            if not result.get('skill_gaps'):
+                result['skill_gaps'] = []
+            # ถ้ามีน้อยกว่า 2 ให้เพิ่ม
+            while len(result.get('skill_gaps', [])) < 2:
+                result['skill_gaps'].append("ควรพัฒนาทักษะเพิ่มเติม")
+        if 'why_suitable' not in result or not result.get('why_suitable'):
+            # ลองสร้าง why_suitable จากข้อมูลที่มี
+            if result.get('strengths'):
+                strengths_str = ', '.join(result['strengths'][:3]) if isinstance(result['strengths'], list) else str(result['strengths'])
+                result['why_suitable'] = f"ผู้สมัครมีจุดแข็ง ได้แก่ {strengths_str}"
             else:
-                result['full_name'] = "Not specified"
-        
-        if 'email' not in result or not result.get('email'):
-            # ลองหา email จาก resume
-            email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', resume_text)
-            if email_match:
-                result['email'] = email_match.group(0)
+                result['why_suitable'] = "ผู้สมัครมีทักษะและประสบการณ์ที่เกี่ยวข้องกับตำแหน่งนี้"
+        if 'recommendation' not in result or not result.get('recommendation'):
+            # ลองสร้าง recommendation จากข้อมูลที่มี
+            if result.get('skill_gaps'):
+                gaps_str = ', '.join(result['skill_gaps'][:3]) if isinstance(result['skill_gaps'], list) else str(result['skill_gaps'])
+                result['recommendation'] = f"ผู้สมัครควรพัฒนาทักษะเพิ่มเติม ได้แก่ {gaps_str}"
             else:
-                result['email'] = "Not specified"
+                result['recommendation'] = "ผู้สมัครเหมาะกับตำแหน่งนี้"
         
-        if 'phone' not in result or not result.get('phone'):
-            # ลองหา phone จาก resume (รองรับหลายรูปแบบ)
-            phone_match = re.search(r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10}', resume_text)
-            if phone_match:
-                result['phone'] = phone_match.group(0).strip()
+        if job_title:
+            print(f"   เติม default values สำหรับ fields ที่ขาด: {', '.join(missing_fields)}")
+    
+    # ใช้ enhance_llama_result เพื่อตรวจสอบและปรับปรุงผลลัพธ์
+    result = enhance_llama_result(result, resume_text, jd_text, jd_features=jd_features, context=context)
+    
+    return result
+
+# fields ของผลวิเคราะห์ที่เป็นของแต่ละตำแหน่ง (ข้อมูลส่วนตัวตอบครั้งเดียวต่อ prompt)
+POSITION_RESULT_FIELDS = ['summary', 'skills_detected', 'strengths', 'skill_gaps', 'match_percentage',
+                          'why_suitable', 'recommendation']
+
+# JSON schema ของผลวิเคราะห์หลายตำแหน่งใน prompt เดียว (analyze_positions_with_llama)
+MULTI_POSITION_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "full_name": {"type": "string"},
+        "email": {"type": "string"},
+        "phone": {"type": "string"},
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": dict(
+                    {"job_title": {"type": "string"}},
+                    **{field: ANALYSIS_JSON_SCHEMA["properties"][field] for field in POSITION_RESULT_FIELDS}
+                ),
+                "required": ["job_title"] + POSITION_RESULT_FIELDS
+            }
+        }
+    },
+    "required": ["full_name", "email", "phone", "results"]
+}
+
+def estimate_prompt_tokens(text):
+    """ประมาณจำนวน token ของข้อความจากขนาด UTF-8 (ประมาณเกินไว้ก่อนเพื่อไม่ให้เกิน num_ctx)"""
+    return len(text.encode('utf-8')) // PROMPT_BYTES_PER_TOKEN + 1
+
+def multi_position_jd_block(number, job_title, jd_clean):
+    return f"""----- ตำแหน่งที่ {number}: {job_title} -----
+
+{jd_clean}
+
+"""
+
+def build_multi_position_prompt(personal_info, resume_clean, jd_blocks):
+    """สร้าง prompt วิเคราะห์ Resume เดียวกับหลายตำแหน่ง (jd_blocks จาก multi_position_jd_block)"""
+    return f"""คุณคือระบบวิเคราะห์ใบสมัครงาน (AI Recruitment Analyst)
+
+หน้าที่ของคุณคือวิเคราะห์ Resume เทียบกับ Job Description ของทุกตำแหน่งด้านล่าง แล้วตอบกลับในรูปแบบ JSON เท่านั้น
+
+ห้ามมีข้อความใด ๆ นอกเหนือจาก JSON ที่กำหนด
+
+=====================================================================
+กฎสำคัญ:
+=====================================================================
+
+1. ต้องตอบเป็น JSON **เท่านั้น** ห้ามใช้ markdown เช่น ``` หรือ ###
+
+2. results ต้องมี 1 รายการต่อ 1 ตำแหน่ง และ job_title ต้องตรงกับชื่อตำแหน่งที่ให้ไว้ทุกตัวอักษร
+
+3. ทุกฟิลด์ต้องมีข้อมูล (ห้ามปล่อยว่าง)
+
+4. skills_detected ต้องเป็นทักษะที่พบใน Resume จริง แต่สามารถปรับคำให้อ่านง่ายได้
+
+5. strengths ต้องอย่างน้อย 3 รายการ และ skill_gaps ต้องอย่างน้อย 2 รายการ ในแต่ละตำแหน่ง
+
+6. match_percentage ต้องมีรูปแบบ เช่น "85%"
+
+7. ห้ามเดาข้อมูลส่วนตัว นอกจากกรณีที่ระบบส่งมาเป็นค่าว่าง
+
+=====================================================================
+📌 รูปแบบ JSON ที่ต้องส่งกลับ (ห้ามเปลี่ยนโครงสร้าง)
+=====================================================================
+
+{{
+  "full_name": "string",
+  "email": "string",
+  "phone": "string",
+  "results": [
+    {{
+      "job_title": "string",
+      "summary": "string",
+      "skills_detected": ["string"],
+      "strengths": ["string"],
+      "skill_gaps": ["string"],
+      "match_percentage": "string",
+      "why_suitable": "string",
+      "recommendation": "string"
+    }}
+  ]
+}}
+
+=====================================================================
+📄 ข้อความ Resume
+=====================================================================
+
+{resume_clean}
+
+=====================================================================
+🔐 ข้อมูลส่วนตัวจากระบบ (ดึงด้วย regex – ห้ามแก้ไขแม้แต่นิดเดียว)
+=====================================================================
+
+full_name: "{personal_info['full_name']}"
+
+email: "{personal_info['email']}"
+
+phone: "{personal_info['phone']}"
+
+คำสั่งสำคัญ:
+
+- ถ้าค่าเหล่านี้ "ไม่ว่าง" → ใช้ตามนี้ ห้ามแก้ไข ห้ามตีความใหม่
+
+- ถ้าค่าว่าง → ให้ค้นหาจาก Resume เท่านั้น ห้ามเดาเอง
+
+=====================================================================
+📄 ตำแหน่งงาน ({len(jd_blocks)} ตำแหน่ง)
+=====================================================================
+
+{''.join(jd_blocks)}"""
+
+def pack_positions_for_prompt(positions, context, max_per_call=MULTI_POSITION_MAX_PER_CALL):
+    """แบ่งตำแหน่ง [(idx, jd_data), ...] เป็นกลุ่มให้ได้จำนวน prompt น้อยที่สุด
+    โดย prompt ของแต่ละกลุ่มรวมกับคำตอบต้องไม่เกิน num_ctx (first-fit decreasing)
+
+    แต่ละกลุ่มเรียงตามลำดับเดิม ตำแหน่งที่ใส่ร่วมกับตำแหน่งอื่นไม่ได้จะอยู่กลุ่มเดียว
+    """
+    num_ctx = OLLAMA_OPTIONS.get('num_ctx', 2048)
+    num_predict = OLLAMA_OPTIONS.get('num_predict', -1)
+    if num_predict and num_predict > 0:
+        max_per_call = min(max_per_call, max(1, num_predict // MULTI_POSITION_OUTPUT_TOKENS))
+    base_tokens = estimate_prompt_tokens(
+        build_multi_position_prompt(context.known_personal_info(), context.prompt_resume, [])
+    )
+    
+    costs = []
+    for order, (idx, jd_data) in enumerate(positions):
+        job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+        block = multi_position_jd_block(order + 1, job_title, job_features_for(jd_data).prompt_fragment)
+        costs.append((estimate_prompt_tokens(block) + MULTI_POSITION_OUTPUT_TOKENS, order))
+    
+    bins = []  # [token ที่เหลือ, [order, ...]]
+    for cost, order in sorted(costs, reverse=True):
+        for entry in bins:
+            if len(entry[1]) < max_per_call and entry[0] >= cost:
+                entry[0] -= cost
+                entry[1].append(order)
+                break
+        else:
+            bins.append([num_ctx - base_tokens - cost, [order]])
+    
+    groups = [sorted(orders) for _, orders in bins]
+    groups.sort()
+    return [[positions[order] for order in orders] for orders in groups]
+
+def analyze_positions_with_llama(resume_text, positions, model=None, context=None):
+    """ใช้ Llama วิเคราะห์ Resume กับหลายตำแหน่งใน prompt เดียว (ส่ง Resume ครั้งเดียว)
+
+    positions: [(idx, jd_data), ...] กลุ่มที่ได้จาก pack_positions_for_prompt
+    คืน dict {idx: result} เฉพาะตำแหน่งที่ได้ผลจาก Llama (ตำแหน่งที่ขาดให้ผู้เรียกวิเคราะห์แยก)
+    ผลของแต่ละตำแหน่งเก็บใน analysis_cache แยกกัน (prompt_mode='multi')
+    """
+    context = context or ResumeContext(resume_text, model=model)
+    results = {}
+    pending = []
+    for idx, jd_data in positions:
+        job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+        jd_features = job_features_for(jd_data)
+        cache_key = AnalysisCache.make_key(context.resume_clean, jd_features.clean, job_title, model,
+                                           prompt_mode='multi')
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            print(f"   ⚡ {job_title}: ใช้ผลลัพธ์จาก cache")
+            results[idx] = cached
+        else:
+            pending.append((idx, job_title, jd_data, jd_features, cache_key))
+    # เหลือตำแหน่งเดียวให้ผู้เรียกวิเคราะห์ด้วย prompt แบบเดิม (ใช้ cache ของ prompt เดี่ยวได้)
+    if len(pending) < 2:
+        return results
+    
+    output_format = analysis_output_format()
+    if isinstance(output_format, dict):
+        output_format = MULTI_POSITION_JSON_SCHEMA
+    personal_info = context.known_personal_info() if output_format else context.personal_info
+    jd_blocks = [
+        multi_position_jd_block(number, job_title, jd_features.prompt_fragment)
+        for number, (_, job_title, _, jd_features, _) in enumerate(pending, 1)
+    ]
+    prompt = build_multi_position_prompt(personal_info, context.prompt_resume, jd_blocks)
+    
+    titles = ', '.join(job_title for _, job_title, _, _, _ in pending)
+    response = call_llama(prompt, model=model, output_format=output_format, label=titles)
+    if not response:
+        print(f"⚠️  {titles}: Llama API ไม่ได้ response หรือ response เป็น empty")
+        return results
+    
+    try:
+        data = json.loads(response)
+        parse_kind = 'strict'
+    except json.JSONDecodeError:
+        try:
+            data = json.loads(extract_json_object(response))
+            parse_kind = 'extracted'
+        except json.JSONDecodeError:
+            data = None
+    items = data.get('results') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        analysis_parse_stats.record('failed', len(pending))
+        print(f"⚠️  {titles}: ไม่สามารถ parse JSON ของหลายตำแหน่งได้ วิเคราะห์แยกทีละตำแหน่ง")
+        return results
+    
+    # จับคู่ผลกับตำแหน่งด้วย job_title ถ้าชื่อไม่ตรงแต่จำนวนเท่ากันให้จับคู่ตามลำดับ
+    items = [item for item in items if isinstance(item, dict)]
+    by_title = {}
+    for item in items:
+        by_title.setdefault(str(item.get('job_title', '')).strip().lower(), []).append(item)
+    matched = []
+    unmatched = []
+    for entry in pending:
+        candidates = by_title.get(entry[1].strip().lower())
+        if candidates:
+            matched.append((entry, candidates.pop(0)))
+        else:
+            unmatched.append(entry)
+    if unmatched and len(items) == len(pending):
+        leftovers = [item for candidates in by_title.values() for item in candidates]
+        matched.extend(zip(unmatched, leftovers))
+    # นับต่อตำแหน่งเหมือน prompt เดี่ยว ตำแหน่งที่ไม่มีผลใน response นับเป็น failed
+    analysis_parse_stats.record(parse_kind, len(matched))
+    if len(pending) > len(matched):
+        analysis_parse_stats.record('failed', len(pending) - len(matched))
+    
+    for (idx, job_title, jd_data, jd_features, cache_key), item in matched:
+        try:
+            result = {field: item[field] for field in POSITION_RESULT_FIELDS if field in item}
+            for field in ('full_name', 'email', 'phone'):
+                if field in data:
+                    result[field] = data[field]
+            result = normalize_analysis_fields(result)
+            if output_format:
+                context.learn_personal_info(result)
+            result = finalize_llama_result(result, json.dumps(result, ensure_ascii=False), resume_text,
+                                           jd_data.get('description', ''), job_title,
+                                           context=context, jd_features=jd_features)
+        except Exception as e:
+            print(f"⚠️  {job_title}: เกิด error ในการ parse: {str(e)[:100]}")
+            result = None
+        if result:
+            analysis_cache.set(cache_key, result)
+            results[idx] = result
+    return results
+
+class ProgressStore:
+    """เก็บ progress ของการวิเคราะห์แยกตาม progress_id (job_id หรือ session id) แบบ thread-safe
+
+    - บันทึกเวลาที่ใช้ของแต่ละตำแหน่ง
+    - ประมาณเวลาที่เหลือ (ETA) จาก throughput จริงของงานนั้น
+      ถ้ายังไม่มีตำแหน่งไหนเสร็จ จะใช้ค่าเฉลี่ยเวลาต่อตำแหน่งจากงานก่อนๆ
+    - ตำแหน่งที่ข้ามการวิเคราะห์ (skipped เช่นไม่ผ่าน prefilter) นับใน progress
+      แต่ไม่นำไปคิดค่าเฉลี่ยเวลาและ throughput
+    - progress ที่เสร็จแล้วจะถูกลบหลังจากผ่านไป ttl วินาที
+    """
+
+    def __init__(self, ttl=PROGRESS_TTL, initial_position_time=INITIAL_POSITION_TIME_ESTIMATE):
+        self.ttl = ttl
+        # ค่าเฉลี่ยเวลาต่อตำแหน่ง (exponential moving average) จากงานที่ผ่านมา
+        self.avg_position_time = initial_position_time
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def start(self, progress_id, total, workers=1):
+        self.cleanup()
+        with self._lock:
+            self._entries[progress_id] = {
+                'status': 'analyzing',
+                'total': total,
+                'current': 0,
+                'skipped': 0,
+                'workers': workers,
+                'in_progress': [],
+                'current_job': '',
+                'position_times': [],
+                'started_at': time.time(),
+                'updated_at': time.time(),
+                'finished_at': None
+            }
+
+    def position_started(self, progress_id, job_title):
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            if entry:
+                entry['in_progress'].append(job_title)
+                entry['current_job'] = job_title
+                entry['updated_at'] = time.time()
+
+    def position_finished(self, progress_id, job_title, duration, skipped=False):
+        """บันทึกว่าตำแหน่งนี้เสร็จแล้ว คืนค่าจำนวนตำแหน่งที่เสร็จแล้วทั้งหมด
+        skipped=True: ตำแหน่งที่ไม่ได้วิเคราะห์จริง (ไม่มีผลกับค่าเฉลี่ยเวลาและ ETA)"""
+        with self._lock:
+            if not skipped:
+                self.avg_position_time = 0.7 * self.avg_position_time + 0.3 * duration
+            entry = self._entries.get(progress_id)
+            if not entry:
+                return 0
+            if job_title in entry['in_progress']:
+                entry['in_progress'].remove(job_title)
+            entry['current'] += 1
+            if skipped:
+                entry['skipped'] += 1
+            entry['position_times'].append({'job_title': job_title, 'seconds': round(duration, 2)})
+            entry['current_job'] = entry['in_progress'][-1] if entry['in_progress'] else ''
+            entry['updated_at'] = time.time()
+            return entry['current']
+
+    def finish(self, progress_id, status='completed'):
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            if entry:
+                entry['status'] = status
+                entry['in_progress'] = []
+                entry['current_job'] = ''
+                entry['finished_at'] = entry['updated_at'] = time.time()
+
+    def estimate_seconds(self, remaining, workers=1):
+        """ประมาณเวลาจากค่าเฉลี่ยเวลาต่อตำแหน่ง (ใช้ก่อนเริ่มงาน)"""
+        return int(-(-remaining // max(1, workers)) * self.avg_position_time)
+
+    def get(self, progress_id):
+        """คืน snapshot ของ progress หรือ None ถ้าไม่พบ"""
+        self.cleanup()
+        with self._lock:
+            entry = self._entries.get(progress_id)
+            if not entry:
+                return None
+            now = entry['finished_at'] or time.time()
+            elapsed = now - entry['started_at']
+            remaining = max(0, entry['total'] - entry['current'])
+            analyzed = entry['current'] - entry['skipped']
+            if entry['finished_at'] or remaining == 0:
+                eta = 0
+            elif analyzed > 0 and elapsed > 0:
+                # throughput จริง (ตำแหน่ง/วินาที) ของงานนี้ ไม่นับตำแหน่งที่ข้าม
+                eta = int(remaining / (analyzed / elapsed))
             else:
-                result['phone'] = "Not specified"
-        
-        # ตรวจสอบ fields อื่นๆ ที่จำเป็น
-        required_fields = ['full_name', 'email', 'phone', 'summary', 'skills_detected', 'strengths', 'skill_gaps', 'why_suitable', 'recommendation']
-        missing_fields = [f for f in required_fields if f not in result]
-        if missing_fields:
-            # เติม default values สำหรับ fields ที่ขาด
-            if 'summary' not in result or not result.get('summary'):
-                result['summary'] = "ผู้สมัครมีประสบการณ์และทักษะที่เกี่ยวข้อง"
-            if 'skills_detected' not in result:
-                result['skills_detected'] = []
-            if 'strengths' not in result or len(result.get('strengths', [])) < 3:
-                # ต้องมีอย่างน้อย 3 strengths
-                if not result.get('strengths'):
-                    result['strengths'] = []
-                # ถ้ามีน้อยกว่า 3 ให้เพิ่ม
-                while len(result.get('strengths', [])) < 3:
-                    result['strengths'].append("มีทักษะและประสบการณ์ที่เกี่ยวข้อง")
-            if 'skill_gaps' not in result or len(result.get('skill_gaps', [])) < 2:
-                # ต้องมีอย่างน้อย 2 skill_gaps
-                if not result.get('skill_gaps'):
-                    result['skill_gaps'] = []
-                # ถ้ามีน้อยกว่า 2 ให้เพิ่ม
-                while len(result.get('skill_gaps', [])) < 2:
-                    result['skill_gaps'].append("ควรพัฒนาทักษะเพิ่มเติม")
-            if 'why_suitable' not in result or not result.get('why_suitable'):
-                # ลองสร้าง why_suitable จากข้อมูลที่มี
-                if result.get('strengths'):
-                    strengths_str = ', '.join(result['strengths'][:3]) if isinstance(result['strengths'], list) else str(result['strengths'])
-                    result['why_suitable'] = f"ผู้สมัครมีจุดแข็ง ได้แก่ {strengths_str}"
-                else:
-                    result['why_suitable'] = "ผู้สมัครมีทักษะและประสบการณ์ที่เกี่ยวข้องกับตำแหน่งนี้"
-            if 'recommendation' not in result or not result.get('recommendation'):
-                # ลองสร้าง recommendation จากข้อมูลที่มี
-                if result.get('skill_gaps'):
-                    gaps_str = ', '.join(result['skill_gaps'][:3]) if isinstance(result['skill_gaps'], list) else str(result['skill_gaps'])
-                    result['recommendation'] = f"ผู้สมัครควรพัฒนาทักษะเพิ่มเติม ได้แก่ {gaps_str}"
-                else:
-                    result['recommendation'] = "ผู้สมัครเหมาะกับตำแหน่งนี้"
+                eta = max(0, int(-(-remaining // max(1, entry['workers'])) * self.avg_position_time - elapsed))
             
-            if job_title:
-                print(f"   เติม default values สำหรับ fields ที่ขาด: {', '.join(missing_fields)}")
+            return {
+                'progress_id': progress_id,
+                'progress': int(entry['current'] / entry['total'] * 100) if entry['total'] else 0,
+                'current': entry['current'],
+                'total': entry['total'],
+                'current_job': entry['current_job'],
+                'in_progress': list(entry['in_progress']),
+                'status': entry['status'],
+                'elapsed_seconds': int(elapsed),
+                'eta_seconds': eta,
+                'position_times': list(entry['position_times'])
+            }
+
+    def cleanup(self):
+        """ลบ progress ที่เสร็จแล้ว หรือไม่มีการอัปเดตนานเกิน ttl"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                progress_id for progress_id, entry in self._entries.items()
+                if now - entry['updated_at'] > self.ttl
+            ]
+            for progress_id in expired:
+                del self._entries[progress_id]
+
+# เก็บ progress ของทุกงานวิเคราะห์ (แยกตาม progress_id)
+progress_store = ProgressStore()
+
+def lexical_match_score(resume_text, jd_text, jd_features=None, context=None, skill_score=None):
+    """คะแนนความเหมาะสมแบบเร็ว (0-100) ไม่ใช้ LLM
+    70% จากทักษะที่ตรงกัน (calculate_match_percentage) + 30% จากคำใน JD ที่พบใน Resume
+    ส่ง skill_score มาถ้าคำนวณไว้แล้ว (เช่นจาก bulk_skill_scores)"""
+    jd_features = jd_features or get_job_features(jd_text)
+    resume_tokens = context.resume_tokens if context else tokenize_for_prefilter(resume_text)
+    if skill_score is None:
+        skill_score = int(calculate_match_percentage(resume_text, jd_text, jd_features=jd_features,
+                                                     context=context).rstrip('%'))
+    jd_tokens = jd_features.tokens
+    token_score = int(len(jd_tokens & resume_tokens) / len(jd_tokens) * 100) if jd_tokens else 0
+    return round(0.7 * skill_score + 0.3 * token_score)
+
+class SkillMatrix:
+    """matrix ของทักษะที่ต้องการ (ตำแหน่ง × ทักษะ) สำหรับให้คะแนน Resume กับทุกตำแหน่งในครั้งเดียว
+
+    แต่ละแถวคือ required_skills ของ JobFeatures หนึ่งตำแหน่ง (uint8, 1 = ต้องการทักษะนั้น)
+    Resume ถูกแปลงเป็น vector ของทักษะ แล้วคูณกับ matrix เพื่อได้จำนวนทักษะที่ตรงกันของทุกตำแหน่ง
+    """
+
+    def __init__(self, features_list):
+        skills = sorted(set(skill_matcher.display_names).union(*(f.required_skills for f in features_list)))
+        self.columns = {skill: col for col, skill in enumerate(skills)}
+        self.matrix = np.zeros((len(features_list), len(skills)), dtype=np.uint8)
+        for row, features in enumerate(features_list):
+            self.matrix[row, [self.columns[skill] for skill in features.required_skills]] = 1
+        self.required_counts = self.matrix.sum(axis=1, dtype=np.int64)
+
+    def score(self, resume_skills):
+        """คืนค่า (match_percentage, matched, missing) เป็น array ตามลำดับตำแหน่ง
+        ใช้สูตรเดียวกับ calculate_match_percentage (ส่วนที่ไม่ใช้ผลจาก LLM)"""
+        resume_vector = np.zeros(len(self.columns), dtype=np.int64)
+        resume_vector[[self.columns[skill] for skill in resume_skills if skill in self.columns]] = 1
+        matched = self.matrix @ resume_vector
+        missing = self.required_counts - matched
+        with np.errstate(divide='ignore', invalid='ignore'):
+            base = np.where(self.required_counts > 0,
+                            (matched / self.required_counts) * 100, 0).astype(np.int64)
+        base -= np.minimum(missing * 2, 15)
+        return np.clip(base, 0, 95), matched, missing
+
+# SkillMatrix ที่สร้างไว้ล่าสุด (key คือ digest ของ JD ทุกตำแหน่งตามลำดับ)
+_skill_matrix_cache = OrderedDict()
+_skill_matrix_lock = threading.Lock()
+
+def skill_matrix_for(features_list):
+    """คืน SkillMatrix ของรายการตำแหน่งนี้ (สร้างใหม่เฉพาะเมื่อรายการตำแหน่งเปลี่ยน)"""
+    key = tuple(features.digest for features in features_list)
+    with _skill_matrix_lock:
+        skill_matrix = _skill_matrix_cache.get(key)
+        if skill_matrix is not None:
+            _skill_matrix_cache.move_to_end(key)
+            return skill_matrix
+    skill_matrix = SkillMatrix(features_list)
+    with _skill_matrix_lock:
+        _skill_matrix_cache[key] = skill_matrix
+        while len(_skill_matrix_cache) > SKILL_MATRIX_CACHE_SIZE:
+            _skill_matrix_cache.popitem(last=False)
+    return skill_matrix
+
+def bulk_skill_scores(resume_skills, features_list):
+    """ให้คะแนนทักษะของ Resume กับทุกตำแหน่งในครั้งเดียว
+    
+    คืน dict ของ list ตามลำดับ features_list: match_percentage (int), matched, missing
+    ค่าเท่ากับ calculate_match_percentage ที่ไม่มี llama_result (ถ้าไม่มี numpy จะคำนวณทีละตำแหน่ง)
+    """
+    if not features_list:
+        return {'match_percentage': [], 'matched': [], 'missing': []}
+    if np is None:
+        resume_skills = set(resume_skills)
+        matched = [len(resume_skills & f.required_skills) for f in features_list]
+        missing = [len(f.required_skills) - m for f, m in zip(features_list, matched)]
+        percentages = []
+        for f, m, miss in zip(features_list, matched, missing):
+            base = int((m / len(f.required_skills)) * 100) if f.required_skills else 0
+            base -= min(miss * 2, 15)
+            percentages.append(max(0, min(base, 95)))
+        return {'match_percentage': percentages, 'matched': matched, 'missing': missing}
+    percentages, matched, missing = skill_matrix_for(features_list).score(resume_skills)
+    return {'match_percentage': percentages.tolist(), 'matched': matched.tolist(), 'missing': missing.tolist()}
+
+class EmbeddingIndex:
+    """Vector index ของ embedding ตำแหน่งงาน (NumPy matrix ใน memory)
+
+    - embed JD ผ่าน Ollama (/api/embed) ครั้งเดียวต่อ JD (key คือ JobFeatures.digest) แบบ batch
+      โดยไม่ถือ lock ระหว่างรอ Ollama (การค้นหาอื่นไม่ต้องรอ)
+    - vectors ถูก normalize แล้ว cosine similarity จึงเป็น dot product เดียวกับทั้ง matrix
+    - ตำแหน่งใน position_store (persistent) เก็บถาวร ถ้าระบุ path จะบันทึกเป็น .npy
+      และเปิดด้วย memory mapping ตอนเริ่มระบบ (บันทึกใหม่เมื่อมีตำแหน่งใหม่เท่านั้น)
+    - JD อื่นเก็บใน memory ไม่เกิน adhoc_max_entries (ลบที่ไม่ได้ใช้นานที่สุดก่อน)
+    """
+
+    def __init__(self, client=None, model=OLLAMA_EMBED_MODEL, path=EMBEDDING_INDEX_PATH,
+                 adhoc_max_entries=EMBEDDING_ADHOC_MAX_ENTRIES):
+        self.client = client or ollama_client
+        self.model = model
+        self.path = path
+        self.adhoc_max_entries = adhoc_max_entries
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._rows = {}  # digest -> แถวใน matrix
+        self._persistent = set()
+        self._adhoc = OrderedDict()  # digest ของ JD ที่ไม่ได้อยู่ใน position_store (LRU)
+        if path and np is not None:
+            self._load()
+
+    @property
+    def available(self):
+        return np is not None
+
+    def _keys_path(self):
+        return self.path + '.keys.json'
+
+    def _load(self):
+        if not (os.path.exists(self.path) and os.path.exists(self._keys_path())):
+            return
+        try:
+            with open(self._keys_path(), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('model') != self.model:
+                return
+            matrix = np.load(self.path, mmap_mode='r')
+            if matrix.shape[0] != len(meta['keys']):
+                return
+            self._matrix = matrix
+            self._rows = {key: row for row, key in enumerate(meta['keys'])}
+            self._persistent = set(meta['keys'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  ไม่สามารถโหลด embedding index จาก {self.path}: {e}")
+
+    def _save(self):
+        # บันทึกเฉพาะตำแหน่งใน position_store (JD อื่นอยู่ใน memory เท่านั้น)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        keys = sorted(self._persistent, key=self._rows.get)
+        tmp_path = self.path + '.tmp.npy'
+        np.save(tmp_path, np.ascontiguousarray(self._matrix[[self._rows[key] for key in keys]]))
+        os.replace(tmp_path, self.path)
+        with open(self._keys_path(), 'w', encoding='utf-8') as f:
+            json.dump({'model': self.model, 'keys': keys}, f)
+
+    def _embed(self, texts):
+        vectors = np.asarray(self.client.embed([text[:EMBEDDING_MAX_CHARS] for text in texts], model=self.model),
+                             dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _track(self, digests, persistent):
+        """บันทึกการใช้งาน digests (LRU ของ ad-hoc) คืนค่า True ถ้ามีตำแหน่ง persistent ใหม่"""
+        changed = False
+        for digest in digests:
+            if digest in persistent and digest not in self._persistent:
+                self._persistent.add(digest)
+                self._adhoc.pop(digest, None)
+                changed = True
+            elif digest not in self._persistent:
+                self._adhoc[digest] = True
+                self._adhoc.move_to_end(digest)
+        return changed
+
+    def _evict(self, keep):
+        """ลบ embedding ของ JD ad-hoc ที่เกิน adhoc_max_entries (ยกเว้น digest ใน keep)"""
+        excess = len(self._adhoc) - self.adhoc_max_entries
+        if excess <= 0:
+            return
+        victims = [digest for digest in self._adhoc if digest not in keep][:excess]
+        if not victims:
+            return
+        for digest in victims:
+            del self._adhoc[digest]
+            del self._rows[digest]
+        digests = sorted(self._rows, key=self._rows.get)
+        self._matrix = self._matrix[[self._rows[digest] for digest in digests]]
+        self._rows = {digest: row for row, digest in enumerate(digests)}
+
+    def add(self, features_list, persistent=()):
+        """embed JD ที่ยังไม่มีใน index แล้วคืน vectors ตามลำดับ features_list
+        persistent: digest ของตำแหน่งใน position_store (เก็บถาวร) JD อื่นถือเป็น ad-hoc"""
+        digests = [features.digest for features in features_list]
+        texts = {}
+        for features in features_list:
+            texts.setdefault(features.digest, features.clean)
         
-        # ใช้ enhance_llama_result เพื่อตรวจสอบและปรับปรุงผลลัพธ์
-        result = enhance_llama_result(result, resume_text, jd_text)
+        missing, new_rows = [], None
+        while True:
+            with self._lock:
+                # thread อื่นอาจ embed JD เดียวกันเสร็จก่อน
+                fresh = [i for i, digest in enumerate(missing) if digest not in self._rows]
+                if fresh:
+                    offset = 0 if self._matrix is None else self._matrix.shape[0]
+                    rows = new_rows[fresh]
+                    self._matrix = rows if self._matrix is None else np.vstack([self._matrix, rows])
+                    for row, i in enumerate(fresh):
+                        self._rows[missing[i]] = offset + row
+                # ระหว่าง embed (ไม่ถือ lock) thread อื่นอาจ _evict JD ad-hoc ที่เคยมีอยู่ไปแล้ว ต้อง embed ใหม่
+                missing = [digest for digest in texts if digest not in self._rows]
+                if not missing:
+                    changed = self._track(digests, set(persistent))
+                    self._evict(keep=set(digests))
+                    if self.path and changed:
+                        self._save()
+                    return self._matrix[[self._rows[digest] for digest in digests]]
+            
+            batch = [texts[digest] for digest in missing]
+            new_rows = np.vstack([
+                self._embed(batch[start:start + EMBEDDING_BATCH_SIZE])
+                for start in range(0, len(batch), EMBEDDING_BATCH_SIZE)
+            ])
+
+    def similarities(self, resume_text, features_list, persistent=()):
+        """cosine similarity (-1..1) ระหว่าง Resume กับแต่ละ JD ตามลำดับของ features_list"""
+        if not self.available:
+            raise RuntimeError('ต้องติดตั้ง numpy เพื่อใช้ embedding index')
+        if not features_list:
+            return np.zeros(0, dtype=np.float32)
+        vectors = self.add(features_list, persistent)
+        query = self._embed([resume_text])[0]
+        return vectors @ query
+
+    def top_k(self, resume_text, features_list, k=None, min_similarity=None, persistent=()):
+        """จัดอันดับ JD ด้วย argpartition (ไม่ต้อง sort ทั้งหมด)
         
-        return result
-    except json.JSONDecodeError as e:
-        # ถ้า parse ไม่ได้ ให้ใช้ fallback
-        if job_title:
-            print(f"⚠️  {job_title}: ไม่สามารถ parse JSON ได้")
-            print(f"   Response preview: {response[:300]}...")
-            print(f"   Error: {str(e)[:100]}")
-        return None
+        คืนค่า (list ของ (ลำดับใน features_list, similarity) ที่ใกล้ที่สุดไม่เกิน k อันดับ
+        และไม่ต่ำกว่า min_similarity, array ของ similarity ของทุก JD)
+        """
+        scores = self.similarities(resume_text, features_list, persistent)
+        best = np.arange(len(scores)) if min_similarity is None else np.flatnonzero(scores >= min_similarity)
+        if k and k < len(best):
+            best = best[np.argpartition(-scores[best], k - 1)[:k]]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(i), float(scores[i])) for i in best], scores
+
+# Embedding index ของตำแหน่งงานที่ใช้ร่วมกันทั้งแอป (embed เมื่อมีการใช้งานครั้งแรก)
+embedding_index = EmbeddingIndex()
+
+def embedding_prefilter(resume_text, positions, top_k=None, min_score=None, context=None):
+    """เลือกตำแหน่งด้วย semantic similarity ผ่าน EmbeddingIndex.top_k
+    คืนค่า (set ของ idx ที่ผ่าน, dict ของคะแนน 0-100 ต่อ idx) เหมือน prefilter_positions"""
+    resume_clean = context.resume_clean if context else clean_resume_text(resume_text)
+    features_list = [job_features_for(jd_data) for _, jd_data in positions]
+    persistent = {
+        features.digest for (_, jd_data), features in zip(positions, features_list)
+        if position_store.features(jd_data.get('id')) is features
+    }
+    # คะแนน = max(0, round(similarity * 100)) จึงผ่าน min_score เมื่อ similarity >= (min_score - 0.5) / 100
+    min_similarity = (min_score - 0.5) / 100 if min_score is not None and min_score > 0 else None
+    ranked, similarities = embedding_index.top_k(resume_clean, features_list, k=top_k,
+                                                 min_similarity=min_similarity, persistent=persistent)
+    scores = {
+        idx: max(0, round(float(similarity) * 100))
+        for (idx, _), similarity in zip(positions, similarities)
+    }
+    return {positions[i][0] for i, _ in ranked}, scores
+
+def prefilter_positions(resume_text, positions, top_k=None, min_score=None, context=None, method=None):
+    """จัดอันดับตำแหน่งแล้วเลือกเฉพาะตำแหน่งที่ควรส่งให้ LLM
+    
+    positions เป็น list ของ (idx, jd_data) คืนค่า (set ของ idx ที่ผ่าน, dict ของคะแนนต่อ idx)
+    ตำแหน่งที่ผ่านต้องได้คะแนน >= min_score และอยู่ใน top_k อันดับแรก (None = ไม่จำกัด)
+    method (default: PREFILTER_METHOD) คือ 'lexical' (lexical_match_score)
+    หรือ 'embedding' (embedding_prefilter ถ้าใช้ไม่ได้จะกลับไปใช้ lexical)
+    """
+    context = context or ResumeContext(resume_text)
+    method = method or PREFILTER_METHOD
+    if method == 'embedding':
+        try:
+            return embedding_prefilter(resume_text, positions, top_k=top_k, min_score=min_score, context=context)
+        except Exception as e:
+            print(f"⚠️  ใช้ embedding จัดอันดับไม่ได้ ({str(e)[:100]}) ใช้ lexical แทน")
+    # คะแนนทักษะของทุกตำแหน่งคำนวณครั้งเดียวด้วย bulk_skill_scores
+    features_list = [job_features_for(jd_data) for _, jd_data in positions]
+    skill_scores = bulk_skill_scores(context.resume_skills, features_list)['match_percentage']
+    scores = {
+        idx: lexical_match_score(resume_text, jd_data.get('description', ''), jd_features=features,
+                                 context=context, skill_score=skill_score)
+        for (idx, jd_data), features, skill_score in zip(positions, features_list, skill_scores)
+    }
+    ranked = sorted(positions, key=lambda p: scores[p[0]], reverse=True)
+    selected = [idx for idx, _ in ranked if min_score is None or scores[idx] >= min_score]
+    if top_k:
+        selected = selected[:top_k]
+    return set(selected), scores
+
+def prefiltered_position_result(resume_text, jd_data, idx, score, context=None):
+    """ผลลัพธ์ของตำแหน่งที่ไม่ผ่าน prefilter (ใช้ fallback_analysis โดยไม่เรียก LLM)"""
+    result = fallback_analysis(resume_text, jd_data.get('description', ''),
+                               jd_features=job_features_for(jd_data), context=context)
+    result['job_title'] = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+    result['job_index'] = idx
+    result['analysis_mode'] = 'prefiltered'
+    result['prefilter_score'] = score
+    try:
+        result['match_score'] = int(result.get('match_percentage', '0').replace('%', ''))
+    except:
+        result['match_score'] = 0
+    return result
+
+def analyze_single_position(resume_text, jd_data, idx, model=None, model_display=None, context=None):
+    """วิเคราะห์ Resume กับตำแหน่งงานเดียว (ถ้า Llama ไม่ได้หรือเกิด error ให้ใช้ fallback)"""
+    job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+    jd_text = jd_data.get('description', '')
+    jd_features = job_features_for(jd_data)
+    model_display = model_display or OLLAMA_MODEL
+    
+    print(f"\n🔄 [{idx + 1}] กำลังวิเคราะห์: {job_title}... (ใช้ {model_display})")
+    
+    try:
+        llama_result = analyze_with_llama(resume_text, jd_text, job_title, model=model, context=context,
+                                          jd_features=jd_features)
     except Exception as e:
-        # จัดการ error อื่นๆ
-        if job_title:
-            print(f"⚠️  {job_title}: เกิด error ในการ parse: {str(e)[:100]}")
-        return None
+        print(f"   ⚠️  {job_title}: เกิด error ระหว่างวิเคราะห์: {str(e)[:100]}")
+        llama_result = None
+    
+    return position_result(resume_text, jd_data, idx, llama_result, model_display=model_display, context=context)
 
-# Global variable สำหรับเก็บ progress
-analysis_progress = {
-    'current': 0,
-    'total': 0,
-    'current_job': '',
-    'status': 'idle'
-}
+def position_result(resume_text, jd_data, idx, llama_result, model_display=None, context=None):
+    """สร้างผลของตำแหน่งจากผลของ Llama (ถ้าเป็น None ให้ใช้ fallback) พร้อม job_title, job_index, match_score"""
+    job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+    jd_text = jd_data.get('description', '')
+    jd_features = job_features_for(jd_data)
+    model_display = model_display or OLLAMA_MODEL
+    
+    if llama_result:
+        result = llama_result
+        result['analysis_mode'] = 'llm'
+        print(f"   ✅ {job_title}: {result.get('match_percentage', '0%')} ({model_display})")
+    else:
+        print(f"   ⚠️  {job_title}: ไม่สามารถใช้ {model_display} ได้")
+        # ถ้า Llama ไม่ได้ ให้ใช้ fallback
+        result = fallback_analysis(resume_text, jd_text, jd_features=jd_features, context=context)
+        result['analysis_mode'] = 'fallback'
+    
+    result['job_title'] = job_title
+    result['job_index'] = idx
+    
+    # แปลง match_percentage เป็นตัวเลขเพื่อเรียงลำดับ
+    try:
+        match_num = int(result.get('match_percentage', '0').replace('%', ''))
+        result['match_score'] = match_num
+    except:
+        result['match_score'] = 0
+    
+    return result
 
-def analyze_multiple_positions(resume_text, job_descriptions, model=None):
-    """วิเคราะห์ Resume กับตำแหน่งงานหลายตำแหน่ง (ใช้ Llama ทั้งหมด)"""
-    import time
-    global analysis_progress
+def analyze_multiple_positions(resume_text, job_descriptions, model=None, max_workers=None, progress_id=None,
+                               on_result=None, use_prefilter=None, multi_position=None):
+    """วิเคราะห์ Resume กับตำแหน่งงานหลายตำแหน่ง (ใช้ Llama ทั้งหมด)
+    
+    วิเคราะห์หลายตำแหน่งพร้อมกันผ่าน thread pool โดยจำกัดจำนวนที่ทำงานพร้อมกัน
+    ไม่เกิน max_workers (default: ANALYSIS_MAX_WORKERS, ใส่ 1 เพื่อวิเคราะห์ทีละตำแหน่ง)
+    ผลลัพธ์เรียงตาม match_score และตำแหน่งที่คะแนนเท่ากันจะเรียงตามลำดับเดิมเสมอ
+    progress ของงานนี้ดูได้จาก progress_store.get(progress_id)
+    on_result(result) จะถูกเรียกทันทีที่แต่ละตำแหน่งวิเคราะห์เสร็จ (เรียกจาก worker thread)
+    
+    ถ้าเปิด prefilter (default: PREFILTER_ENABLED) จะจัดอันดับทุกตำแหน่งด้วย lexical_match_score ก่อน
+    และส่งให้ LLM เฉพาะ PREFILTER_TOP_K อันดับแรกที่ได้คะแนน >= PREFILTER_MIN_SCORE
+    ตำแหน่งที่เหลือใช้ fallback_analysis (analysis_mode = 'prefiltered')
+    
+    ถ้าเปิด multi_position (default: MULTI_POSITION_PROMPT) จะรวมหลายตำแหน่งไว้ใน prompt เดียว
+    ตามขนาด num_ctx (pack_positions_for_prompt) ตำแหน่งที่ไม่ได้ผลจาก prompt รวมจะวิเคราะห์แยก
+    """
+    progress_id = progress_id or uuid.uuid4().hex
+    use_prefilter = PREFILTER_ENABLED if use_prefilter is None else use_prefilter
+    multi_position = MULTI_POSITION_PROMPT if multi_position is None else multi_position
     
     # แสดงโมเดลที่ใช้
     if model == 'llama-3.2-1b' or model == 'llama3.2:1b':
@@ -1093,81 +3695,136 @@ def analyze_multiple_positions(resume_text, job_descriptions, model=None):
     else:
         model_display = OLLAMA_MODEL
     
-    results = []
-    total_positions = len(job_descriptions)
-    estimated_time_per_position = 45  # วินาที (ประมาณ 30-60 วินาทีต่อตำแหน่ง)
-    estimated_total_time = total_positions * estimated_time_per_position
-    initial_estimated_time = estimated_total_time  # เก็บเวลาเริ่มต้นไว้สำหรับ countdown
+    # เลือกเฉพาะตำแหน่งที่มี description (เก็บ index เดิมไว้เพื่อให้ลำดับคงที่)
+    positions = [
+        (idx, jd_data) for idx, jd_data in enumerate(job_descriptions)
+        if jd_data.get('description', '')
+    ]
+    
+    total_positions = len(positions)
+    
+    # clean text, ทักษะ และข้อมูลส่วนตัวของ Resume คำนวณครั้งเดียว ใช้ร่วมกันทุกตำแหน่ง
+    context = ResumeContext(resume_text, model=model)
+    
+    # คัดกรองตำแหน่งด้วยวิธีที่เร็วก่อน ส่งให้ LLM เฉพาะตำแหน่งที่มีแนวโน้มเหมาะสม
+    prefilter_scores = {}
+    llm_positions = positions
+    if use_prefilter and positions:
+        selected, prefilter_scores = prefilter_positions(
+            resume_text, positions, top_k=PREFILTER_TOP_K, min_score=PREFILTER_MIN_SCORE, context=context
+        )
+        llm_positions = [(idx, jd_data) for idx, jd_data in positions if idx in selected]
+    
+    # จัดกลุ่มตำแหน่งที่ส่งให้ LLM (1 กลุ่ม = 1 prompt)
+    if multi_position and len(llm_positions) > 1:
+        groups = pack_positions_for_prompt(llm_positions, context)
+    else:
+        groups = [[position] for position in llm_positions]
+    
+    workers = max(1, min(max_workers or ANALYSIS_MAX_WORKERS, len(groups) or 1))
+    # ประมาณเวลาจากค่าเฉลี่ยเวลาต่อตำแหน่งของงานก่อนๆ
+    estimated_total_time = progress_store.estimate_seconds(len(llm_positions), workers)
     
     # อัปเดต progress
-    analysis_progress['total'] = total_positions
-    analysis_progress['current'] = 0
-    analysis_progress['status'] = 'analyzing'
+    progress_store.start(progress_id, total_positions, workers)
     
     print("\n" + "="*60)
     print("🔍 เริ่มวิเคราะห์ Resume กับตำแหน่งงาน")
     print("="*60)
     print(f"📊 จำนวนตำแหน่งงานที่ต้องวิเคราะห์: {total_positions} ตำแหน่ง")
+    if use_prefilter:
+        print(f"🔎 ผ่าน prefilter (ส่งให้ LLM): {len(llm_positions)} ตำแหน่ง")
+    if len(groups) < len(llm_positions):
+        print(f"📦 รวมเป็น {len(groups)} prompt (หลายตำแหน่งต่อ prompt)")
     print(f"🤖 AI Model: {model_display} (ใช้ทั้งหมด)")
+    print(f"⚡ วิเคราะห์พร้อมกันสูงสุด: {workers} ตำแหน่ง")
     print(f"⏱️  เวลาที่คาดว่าจะใช้: ประมาณ {estimated_total_time // 60} นาที {estimated_total_time % 60} วินาที")
     print("-"*60)
     
     start_time = time.time()
+    results_by_index = {}
     
-    # ใช้ Llama วิเคราะห์ทุกตำแหน่ง
-    for idx, jd_data in enumerate(job_descriptions):
-        job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
-        jd_text = jd_data.get('description', '')
-        
-        if not jd_text:
-            continue
+    def finish_position(idx, job_title, result, duration):
+        if idx in prefilter_scores:
+            result['prefilter_score'] = prefilter_scores[idx]
         
-        # อัปเดต progress
-        analysis_progress['current'] = idx + 1
-        analysis_progress['current_job'] = job_title
-        
-        print(f"\n🔄 [{idx + 1}/{total_positions}] กำลังวิเคราะห์: {job_title}...")
-        print(f"   ใช้ {model_display} วิเคราะห์...")
+        done = progress_store.position_finished(progress_id, job_title, duration)
+        elapsed = int(time.time() - start_time)
+        print(f"   ⏱️  [{done}/{total_positions}] {job_title}: {duration:.1f} วินาที (รวม {elapsed} วินาที)")
+        if on_result:
+            on_result(result)
+        return result
+    
+    def run_position(idx, jd_data):
+        job_title = jd_data.get('title', f'ตำแหน่ง {idx + 1}')
+        progress_store.position_started(progress_id, job_title)
+        position_start = time.time()
         
-        # ใช้ Llama วิเคราะห์
-        llama_result = analyze_with_llama(resume_text, jd_text, job_title, model=model)
+        result = analyze_single_position(resume_text, jd_data, idx, model=model,
+                                         model_display=model_display, context=context)
+        return finish_position(idx, job_title, result, time.time() - position_start)
+    
+    def run_group(group):
+        # กลุ่มที่มีตำแหน่งเดียวใช้ prompt แบบเดิม
+        if len(group) == 1:
+            idx, jd_data = group[0]
+            return {idx: run_position(idx, jd_data)}
         
-        if llama_result:
-            result = llama_result
-            result['job_title'] = job_title
-            result['job_index'] = idx
-            
-            # แปลง match_percentage เป็นตัวเลขเพื่อเรียงลำดับ
-            try:
-                match_num = int(result.get('match_percentage', '0').replace('%', ''))
-                result['match_score'] = match_num
-            except:
-                result['match_score'] = 0
-            
-            results.append(result)
-            
-            elapsed = int(time.time() - start_time)
-            remaining = initial_estimated_time - elapsed
-            if remaining > 0:
-                print(f"   ✅ {job_title}: {result.get('match_percentage', '0%')} ({model_display})")
-                print(f"   ⏱️  ใช้เวลา: {elapsed} วินาที | เหลืออีกประมาณ {remaining // 60} นาที {remaining % 60} วินาที")
+        titles = {idx: jd_data.get('title', f'ตำแหน่ง {idx + 1}') for idx, jd_data in group}
+        for job_title in titles.values():
+            progress_store.position_started(progress_id, job_title)
+        print(f"\n🔄 กำลังวิเคราะห์ {len(group)} ตำแหน่งใน prompt เดียว: {', '.join(titles.values())}... (ใช้ {model_display})")
+        group_start = time.time()
+        try:
+            llama_results = analyze_positions_with_llama(resume_text, group, model=model, context=context)
+        except Exception as e:
+            print(f"   ⚠️  เกิด error ระหว่างวิเคราะห์หลายตำแหน่ง: {str(e)[:100]}")
+            llama_results = {}
+        # เวลาของ prompt รวมเฉลี่ยให้แต่ละตำแหน่งในกลุ่ม
+        duration = (time.time() - group_start) / len(group)
+        
+        group_results = {}
+        for idx, jd_data in group:
+            if idx in llama_results:
+                result = position_result(resume_text, jd_data, idx, llama_results[idx],
+                                         model_display=model_display, context=context)
+                group_results[idx] = finish_position(idx, titles[idx], result, duration)
             else:
-                print(f"   ✅ {job_title}: {result.get('match_percentage', '0%')} ({model_display})")
-                print(f"   ⏱️  ใช้เวลา: {elapsed} วินาที")
+                # ตำแหน่งที่ไม่ได้ผลจาก prompt รวม วิเคราะห์แยก (ใช้ fallback ถ้า Llama ไม่ได้)
+                position_start = time.time()
+                result = analyze_single_position(resume_text, jd_data, idx, model=model,
+                                                 model_display=model_display, context=context)
+                group_results[idx] = finish_position(idx, titles[idx], result,
+                                                     duration + time.time() - position_start)
+        return group_results
+    
+    # ตำแหน่งที่ไม่ผ่าน prefilter ใช้ fallback ทันที (ไม่เรียก LLM)
+    llm_indexes = {idx for idx, _ in llm_positions}
+    for idx, jd_data in positions:
+        if idx not in llm_indexes:
+            result = prefiltered_position_result(resume_text, jd_data, idx, prefilter_scores.get(idx, 0),
+                                                 context=context)
+            progress_store.position_finished(progress_id, result['job_title'], 0, skipped=True)
+            results_by_index[idx] = result
+            if on_result:
+                on_result(result)
+    
+    try:
+        if workers == 1:
+            for group in groups:
+                results_by_index.update(run_group(group))
         else:
-            print(f"   ⚠️  {job_title}: ไม่สามารถใช้ {model_display} ได้")
-            # ถ้า Llama ไม่ได้ ให้ใช้ fallback
-            result = fallback_analysis(resume_text, jd_text)
-            result['job_title'] = job_title
-            result['job_index'] = idx
-            try:
-                match_num = int(result.get('match_percentage', '0').replace('%', ''))
-                result['match_score'] = match_num
-            except:
-                result['match_score'] = 0
-            results.append(result)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [submit_with_context(executor, run_group, group) for group in groups]
+                # analyze_single_position ใช้ fallback เองเมื่อ Llama ล้มเหลว
+                for future in as_completed(futures):
+                    results_by_index.update(future.result())
+    except Exception:
+        progress_store.finish(progress_id, status='failed')
+        raise
     
-    # เรียงลำดับตามความเหมาะสม
+    # เรียงตามลำดับเดิมก่อน แล้วค่อยเรียงตามความเหมาะสม (sort แบบ stable ทำให้ลำดับคงที่)
+    results = [results_by_index[idx] for idx, _ in positions if idx in results_by_index]
     results.sort(key=lambda x: x.get('match_score', 0), reverse=True)
     
     total_time = int(time.time() - start_time)
@@ -1180,55 +3837,45 @@ def analyze_multiple_positions(resume_text, job_descriptions, model=None):
     print(f"✅ การวิเคราะห์เสร็จสมบูรณ์ (ใช้เวลา {total_time // 60} นาที {total_time % 60} วินาที)")
     print("="*60 + "\n")
     
-    # Reset progress
-    analysis_progress['status'] = 'completed'
+    progress_store.finish(progress_id)
     
     return results
 
-def fallback_analysis(resume_text, jd_text):
+def fallback_analysis(resume_text, jd_text, jd_features=None, context=None):
     """Fallback analysis เมื่อ Llama ไม่สามารถใช้งานได้"""
     # ใช้วิธีง่ายๆ ในการวิเคราะห์
-    resume_lower = resume_text.lower()
-    jd_lower = jd_text.lower()
-    
     # Extract personal info
-    name_match = re.search(r'^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)+)', resume_text, re.MULTILINE)
-    full_name = name_match.group(1).strip() if name_match else "Not specified"
+    contact_info = context.fallback_contact_info if context else fallback_contact_info(resume_text)
+    full_name = contact_info['full_name'] or "Not specified"
+    email = contact_info['email'] or "Not specified"
+    phone = contact_info['phone'] or "Not specified"
     
-    email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', resume_text)
-    email = email_match.group(0) if email_match else "Not specified"
+    # หาทักษะพื้นฐาน (ใช้พจนานุกรมทักษะร่วมกับ calculate_match_percentage)
+    resume_skills = context.resume_skills if context else skill_matcher.find(resume_text)
+    jd_skills = (jd_features or get_job_features(jd_text)).required_skills
+    skills_detected = [skill_matcher.display_name(s) for s in sorted(resume_skills)]
     
-    phone_match = re.search(r'(\+?\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}|\d{10}', resume_text)
-    phone = phone_match.group(0).strip() if phone_match else "Not specified"
-    
-    # หาทักษะพื้นฐาน
-    common_skills = ['python', 'java', 'javascript', 'sql', 'html', 'css', 'react', 'vue', 'angular', 
-                     'node.js', 'aws', 'docker', 'git', 'excel', 'power bi', 'tableau', 'machine learning']
-    
-    skills_detected = [s.title() for s in common_skills if s in resume_lower]
-    jd_skills = [s.title() for s in common_skills if s in jd_lower]
-    
-    matched = set([s.lower() for s in skills_detected]).intersection(set([s.lower() for s in jd_skills]))
-    gaps = set([s.lower() for s in jd_skills]) - set([s.lower() for s in skills_detected])
+    matched = sorted(resume_skills & jd_skills)
+    gaps = sorted(jd_skills - resume_skills)
     
     match_percentage = int((len(matched) / len(jd_skills)) * 100) if jd_skills else 0
     
     # สร้าง strengths (อย่างน้อย 3 ข้อ)
-    strengths = [f"มีทักษะด้าน {s.title()}" for s in list(matched)[:5]] if matched else ["มีประสบการณ์ที่เกี่ยวข้อง"]
+    strengths = [f"มีทักษะด้าน {skill_matcher.display_name(s)}" for s in matched[:5]] if matched else ["มีประสบการณ์ที่เกี่ยวข้อง"]
     while len(strengths) < 3:
         strengths.append("มีทักษะและประสบการณ์ที่เกี่ยวข้อง")
     
     # สร้าง skill_gaps (อย่างน้อย 2 ข้อ)
-    skill_gaps = [s.title() for s in list(gaps)[:10]] if gaps else ["ควรพัฒนาทักษะเพิ่มเติม"]
+    skill_gaps = [skill_matcher.display_name(s) for s in gaps[:10]] if gaps else ["ควรพัฒนาทักษะเพิ่มเติม"]
     while len(skill_gaps) < 2:
         skill_gaps.append("ควรพัฒนาทักษะเพิ่มเติม")
     
     why_suitable = ""
     if match_percentage >= 60:
-        matched_skills_str = ", ".join([s.title() for s in list(matched)[:5]])
+        matched_skills_str = ", ".join([skill_matcher.display_name(s) for s in matched[:5]])
         why_suitable = f"ผู้สมัครมีทักษะที่ตรงกับความต้องการ ได้แก่ {matched_skills_str} ซึ่งเป็นทักษะสำคัญสำหรับตำแหน่งนี้"
     elif match_percentage >= 40:
-        matched_skills_str = ", ".join([s.title() for s in list(matched)[:3]])
+        matched_skills_str = ", ".join([skill_matcher.display_name(s) for s in matched[:3]])
         why_suitable = f"ผู้สมัครมีทักษะพื้นฐานบางส่วนที่เกี่ยวข้อง ได้แก่ {matched_skills_str} แต่ยังขาดทักษะสำคัญบางอย่าง"
     else:
         why_suitable = "ผู้สมัครมีทักษะที่ตรงกับความต้องการน้อย ควรพัฒนาทักษะเพิ่มเติม"
@@ -1243,9 +3890,540 @@ def fallback_analysis(resume_text, jd_text):
         "skill_gaps": skill_gaps,
         "match_percentage": f"{match_percentage}%",
         "why_suitable": why_suitable,
-        "recommendation": f"ผู้สมัคร{'เหมาะ' if match_percentage >= 60 else 'อาจไม่เหมาะ'}กับตำแหน่งนี้" + (f" ควรพัฒนาด้าน {', '.join([s.title() for s in list(gaps)[:3]])}" if gaps else "")
+        "recommendation": f"ผู้สมัคร{'เหมาะ' if match_percentage >= 60 else 'อาจไม่เหมาะ'}กับตำแหน่งนี้" + (f" ควรพัฒนาด้าน {', '.join([skill_matcher.display_name(s) for s in gaps[:3]])}" if gaps else "")
+    }
+
+def clean_position_result(pos):
+    """ผลลัพธ์ของตำแหน่งเดียวแบบย่อ (ไม่รวม Job Description)"""
+    return {
+        'job_title': pos.get('job_title', ''),
+        'match_percentage': pos.get('match_percentage', '0%'),
+        'match_score': pos.get('match_score', 0),
+        'summary': pos.get('summary', ''),
+        'skills_detected': pos.get('skills_detected', []),
+        'strengths': pos.get('strengths', []),
+        'skill_gaps': pos.get('skill_gaps', []),
+        'why_suitable': pos.get('why_suitable', ''),
+        'recommendation': pos.get('recommendation', ''),
+        'analysis_mode': pos.get('analysis_mode', 'llm')
+    }
+
+def build_auto_analysis_response(results):
+    """สร้างผลลัพธ์แบบย่อจากผลวิเคราะห์ทุกตำแหน่ง (ไม่รวม Job Description)"""
+    # กรองเฉพาะตำแหน่งที่มีความเหมาะสม >= 40%
+    suitable_positions = [r for r in results if r.get('match_score', 0) >= 40]
+    
+    # หาตำแหน่งที่เหมาะสมที่สุด
+    best_match = suitable_positions[0] if suitable_positions else results[0] if results else None
+    
+    # ดึงข้อมูลส่วนตัวจากผลลัพธ์แรก (ทุกตำแหน่งควรมีข้อมูลเดียวกัน)
+    personal_info = {}
+    if results:
+        first_result = results[0]
+        personal_info = {
+            'full_name': first_result.get('full_name', ''),
+            'email': first_result.get('email', ''),
+            'phone': first_result.get('phone', '')
+        }
+    
+    # สร้างผลลัพธ์แบบย่อ (ไม่รวม Job Description)
+    suitable_positions_clean = [clean_position_result(pos) for pos in suitable_positions]
+    best_match_clean = clean_position_result(best_match) if best_match else None
+    
+    return {
+        'full_name': personal_info.get('full_name', ''),
+        'email': personal_info.get('email', ''),
+        'phone': personal_info.get('phone', ''),
+        'summary': best_match_clean.get('summary', '') if best_match_clean else '',
+        'skills_detected': best_match_clean.get('skills_detected', []) if best_match_clean else [],
+        'suitable_positions': suitable_positions_clean,
+        'best_match': best_match_clean,
+        'total_analyzed': len(results),
+        'total_suitable': len(suitable_positions_clean)
+    }
+
+def run_auto_analysis(resume_text, model=None, progress_id=None, on_result=None):
+    """วิเคราะห์ Resume กับทุกตำแหน่งในฐานข้อมูล แล้วคืนผลลัพธ์แบบย่อ"""
+    # ใช้ตำแหน่งงานจากฐานข้อมูล
+    results = analyze_multiple_positions(resume_text, position_store.list(), model=model,
+                                         progress_id=progress_id, on_result=on_result)
+    return build_auto_analysis_response(results)
+
+def run_upload_analysis(resume_text, filename, model=None, progress_id=None, on_result=None):
+    """วิเคราะห์ Resume ที่อ่านจากไฟล์ที่อัปโหลด แล้วคืนผลลัพธ์แบบย่อพร้อมข้อมูลไฟล์"""
+    response = run_auto_analysis(resume_text, model=model, progress_id=progress_id, on_result=on_result)
+    response.update({
+        'success': True,
+        'filename': filename,
+        'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text
+    })
+    return response
+
+def run_detail_analysis(resume_text, selected_job=None, progress_id=None):
+    """วิเคราะห์ Resume แบบละเอียด กับตำแหน่งที่เลือก หรือทุกตำแหน่งถ้าไม่ได้เลือก"""
+    if selected_job:
+        # วิเคราะห์เฉพาะตำแหน่งนี้
+        jd_features = job_features_for(selected_job)
+        result = analyze_with_llama(resume_text, selected_job.get('description', ''), selected_job.get('title', ''),
+                                    jd_features=jd_features)
+        
+        if not result:
+            result = fallback_analysis(resume_text, selected_job.get('description', ''), jd_features=jd_features)
+        
+        # เติมข้อมูลเพิ่มเติม
+        result['job_title'] = selected_job.get('title', '')
+        result['job_description'] = selected_job.get('description', '')
+        
+        return {
+            'success': True,
+            'full_name': result.get('full_name', ''),
+            'email': result.get('email', ''),
+            'phone': result.get('phone', ''),
+            'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text,
+            'analysis': result,
+            'job_info': {
+                'title': selected_job.get('title', ''),
+                'description': selected_job.get('description', '')
+            }
+        }
+    
+    # วิเคราะห์กับทุกตำแหน่ง
+    positions = position_store.list()
+    results = analyze_multiple_positions(resume_text, positions, progress_id=progress_id)
+    descriptions = {pos['title']: pos['description'] for pos in positions}
+    
+    # ดึงข้อมูลส่วนตัวจากผลลัพธ์แรก
+    personal_info = {}
+    if results:
+        first_result = results[0]
+        personal_info = {
+            'full_name': first_result.get('full_name', ''),
+            'email': first_result.get('email', ''),
+            'phone': first_result.get('phone', '')
+        }
+    
+    # สร้างผลลัพธ์แบบละเอียด
+    detailed_results = []
+    for r in results:
+        detailed_results.append({
+            'job_title': r.get('job_title', ''),
+            'match_percentage': r.get('match_percentage', '0%'),
+            'match_score': r.get('match_score', 0),
+            'summary': r.get('summary', ''),
+            'skills_detected': r.get('skills_detected', []),
+            'strengths': r.get('strengths', []),
+            'skill_gaps': r.get('skill_gaps', []),
+            'why_suitable': r.get('why_suitable', ''),
+            'recommendation': r.get('recommendation', ''),
+            'job_description': descriptions.get(r.get('job_title', ''), '')
+        })
+    
+    # เรียงลำดับตาม match_score
+    detailed_results.sort(key=lambda x: x.get('match_score', 0), reverse=True)
+    
+    # หาตำแหน่งที่ดีที่สุด
+    best_match = detailed_results[0] if detailed_results else None
+    
+    return {
+        'success': True,
+        'full_name': personal_info.get('full_name', ''),
+        'email': personal_info.get('email', ''),
+        'phone': personal_info.get('phone', ''),
+        'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text,
+        'total_positions': len(detailed_results),
+        'best_match': best_match,
+        'all_analyses': detailed_results,
+        'ranking': [
+            {
+                'rank': idx + 1,
+                'job_title': r.get('job_title', ''),
+                'match_percentage': r.get('match_percentage', '0%'),
+                'match_score': r.get('match_score', 0)
+            }
+            for idx, r in enumerate(detailed_results)
+        ]
+    }
+
+class AnalysisJobQueue:
+    """คิวงานวิเคราะห์แบบ async (submit → poll → fetch)
+
+    - submit() คืน job_id ทันที งานจะถูกประมวลผลโดย worker threads
+    - คิวมีขนาดจำกัด (max_queue_size) ถ้าเต็มจะ raise queue.Full
+    - งานที่เสร็จแล้วจะถูกลบหลังจากผ่านไป result_ttl วินาที
+    """
+
+    def __init__(self, max_queue_size=JOB_QUEUE_MAX_SIZE, num_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL):
+        self.max_queue_size = max_queue_size
+        self.num_workers = num_workers
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def _start_workers(self):
+        # เริ่ม worker threads ครั้งแรกที่มีงานเข้ามา
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f'analysis-worker-{i + 1}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, job_type, func, *args, job_id=None, **kwargs):
+        """เพิ่มงานเข้าคิวและคืน job_id (raise queue.Full ถ้าคิวเต็ม)"""
+        self._start_workers()
+        self.cleanup()
+        
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'type': job_type,
+            'status': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise
+        return job_id
+
+    def get(self, job_id):
+        """คืนสถานะของงาน (copy) หรือ None ถ้าไม่พบหรือหมดอายุแล้ว"""
+        self.cleanup()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def cleanup(self):
+        """ลบงานที่เสร็จแล้วและเก็บไว้นานเกิน result_ttl"""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['finished_at'] and now - job['finished_at'] > self.result_ttl
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            statuses = Counter(job['status'] for job in self._jobs.values())
+        return {
+            'queued': statuses.get('queued', 0),
+            'running': statuses.get('running', 0),
+            'completed': statuses.get('completed', 0),
+            'failed': statuses.get('failed', 0),
+            'max_queue_size': self.max_queue_size,
+            'workers': self.num_workers
+        }
+
+    def _worker_loop(self):
+        while True:
+            job_id, func, args, kwargs = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job:
+                    job['status'] = 'running'
+                    job['started_at'] = time.time()
+            try:
+                result = func(*args, **kwargs)
+                with self._lock:
+                    if job:
+                        job['result'] = result
+                        job['status'] = 'completed'
+            except Exception as e:
+                print(f"❌ Job {job_id} ล้มเหลว: {str(e)[:200]}")
+                with self._lock:
+                    if job:
+                        job['error'] = f'เกิดข้อผิดพลาด: {str(e)}'
+                        job['status'] = 'failed'
+            finally:
+                with self._lock:
+                    if job:
+                        job['finished_at'] = time.time()
+                self._queue.task_done()
+
+# คิวงานวิเคราะห์ที่ใช้ร่วมกันทั้งแอป
+analysis_jobs = AnalysisJobQueue()
+
+def request_flag(name, data=None):
+    """อ่านค่า true/false ของ field จาก body/form หรือ query string (เช่น ?async=1)"""
+    value = request.args.get(name)
+    if data is not None and data.get(name) is not None:
+        value = data.get(name)
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def is_async_request(data=None):
+    """ตรวจสอบว่า client ขอให้ทำงานแบบ async หรือไม่ (จาก body/form หรือ query string ?async=1)"""
+    return request_flag('async', data)
+
+def upload_extract_limit(data=None):
+    """จำนวนตัวอักษรที่อ่านจากไฟล์สำหรับวิเคราะห์ (deep=true = อ่านทั้งไฟล์)"""
+    return EXTRACT_MAX_CHARS if request_flag('deep', data) else EXTRACT_ANALYSIS_MAX_CHARS
+
+def request_deadline(data=None, default=LLM_REQUEST_DEADLINE):
+    """deadline (วินาที) ของการเรียก Llama ใน request นี้ จาก field "deadline" ใน body/form หรือ query string
+    ไม่เกิน LLM_REQUEST_DEADLINE (ถ้าตั้งไว้) ถ้าไม่ได้ส่งมาใช้ default"""
+    value = request.args.get('deadline')
+    if data is not None and data.get('deadline') is not None:
+        value = data.get('deadline')
+    try:
+        deadline = float(value) if value is not None else None
+    except (TypeError, ValueError):
+        deadline = None
+    if deadline is None or deadline <= 0:
+        return default
+    return min(deadline, LLM_REQUEST_DEADLINE) if LLM_REQUEST_DEADLINE else deadline
+
+def submit_analysis_job(job_type, func, *args, data=None):
+    """ส่งงานเข้าคิว แล้วคืน response 202 พร้อม job_id (หรือ 429 ถ้าคิวเต็ม)
+    
+    job_id ใช้เป็น progress_id ด้วย จึงดู progress ได้จาก GET /api/jobs/<job_id>
+    ถ้า client ส่ง "deadline" มาใน data จะใช้เป็น deadline ของงาน (เริ่มนับเมื่องานเริ่มรัน)
+    """
+    job_id = uuid.uuid4().hex
+    budget = LlamaCallBudget(request_deadline(data, default=None))
+    try:
+        analysis_jobs.submit(job_type, run_with_llm_budget, budget, func, *args, job_id=job_id, progress_id=job_id)
+    except queue.Full:
+        return jsonify({'error': 'คิวการวิเคราะห์เต็ม กรุณาลองใหม่ภายหลัง'}), 429, {'Retry-After': str(JOB_RETRY_AFTER)}
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}'
+    }), 202
+
+def read_batch_documents(files, archives):
+    """อ่านไฟล์ Resume จาก multipart (หลายไฟล์) และไฟล์ zip คืนค่า list ของ (ชื่อไฟล์, bytes)
+    ไฟล์ใน zip ใช้ path ภายใน zip เป็นชื่อ (ไฟล์ชื่อเดียวกันจากคนละโฟลเดอร์จึงแยกกันได้)
+    
+    raise ValueError ถ้าจำนวนไฟล์เกิน BATCH_MAX_FILES, ขนาดรวมเกิน BATCH_MAX_TOTAL_BYTES
+    หรือไฟล์ใน zip ใหญ่เกิน MAX_CONTENT_LENGTH
+    (ตรวจก่อนอ่านแต่ละไฟล์ใน zip จึงไม่แตก zip bomb ลงหน่วยความจำ)
+    """
+    documents = []
+    total_bytes = 0
+    
+    def reserve(size):
+        nonlocal total_bytes
+        if len(documents) >= BATCH_MAX_FILES:
+            raise ValueError(f'จำนวนไฟล์เกิน {BATCH_MAX_FILES} ไฟล์')
+        if total_bytes + size > BATCH_MAX_TOTAL_BYTES:
+            raise ValueError(f'ขนาดไฟล์รวมเกิน {BATCH_MAX_TOTAL_BYTES // (1024 * 1024)}MB')
+        total_bytes += size
+    
+    for file in files:
+        if file.filename and file.filename.lower().endswith(('.pdf', '.docx')):
+            data = file.read()
+            reserve(len(data))
+            documents.append((file.filename, data))
+    
+    for archive in archives:
+        with zipfile.ZipFile(io.BytesIO(archive.read())) as zf:
+            for member in zf.infolist():
+                name = member.filename
+                if member.is_dir() or name.startswith('__MACOSX/') or not name.lower().endswith(('.pdf', '.docx')):
+                    continue
+                # กัน zip bomb: ไม่อ่านไฟล์ที่ขยายแล้วใหญ่เกินขนาดไฟล์สูงสุด
+                if member.file_size > app.config['MAX_CONTENT_LENGTH']:
+                    raise ValueError(
+                        f'ไฟล์ {name} ใน zip มีขนาดเกิน {app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024)}MB')
+                # zipfile อ่านไม่เกิน file_size ที่ประกาศไว้ จึงจองขนาดก่อนอ่านได้
+                reserve(member.file_size)
+                documents.append((name, zf.read(member)))
+    
+    return documents
+
+def extract_text_from_document(filename, data, max_chars=EXTRACT_ANALYSIS_MAX_CHARS):
+    """อ่านข้อความจากไฟล์ PDF/DOCX ที่อยู่ในรูป bytes (หยุดเมื่อได้ข้อความพอสำหรับ prompt)"""
+    if filename.lower().endswith('.pdf'):
+        extract = lambda s, status: extract_text_from_pdf(s, max_chars=max_chars, status=status)
+    else:
+        extract = lambda s, status: extract_text_from_docx(s, max_chars=max_chars, status=status)
+    return read_document_text(io.BytesIO(data), filename, extract, max_chars)
+
+def run_batch_screening(documents, job_descriptions, model=None, progress_id=None):
+    """วิเคราะห์ Resume หลายไฟล์กับหลายตำแหน่ง (resume × position) แล้วจัดอันดับผู้สมัครของแต่ละตำแหน่ง
+    
+    ทุกคู่ถูกกระจายไปที่ thread pool เดียวกัน (จำกัดด้วย ANALYSIS_MAX_WORKERS)
+    และใช้ analysis_cache ร่วมกัน ไฟล์ที่ซ้ำหรือเคยวิเคราะห์แล้วจึงไม่ต้องเรียก Llama ซ้ำ
+    """
+    progress_id = progress_id or uuid.uuid4().hex
+    model_display = resolve_ollama_model(model)
+    positions = [
+        (idx, jd_data) for idx, jd_data in enumerate(job_descriptions)
+        if jd_data.get('description', '')
+    ]
+    
+    print(f"\n📦 Batch screening: {len(documents)} ไฟล์ × {len(positions)} ตำแหน่ง ({model_display})")
+    
+    # อ่านข้อความจากทุกไฟล์ก่อน แล้วสร้าง context ต่อ Resume (ใช้ร่วมกันทุกตำแหน่ง)
+    candidates = []
+    errors = []
+    for filename, data in documents:
+        resume_text = extract_text_from_document(filename, data)
+        if not resume_text:
+            errors.append({'filename': filename, 'error': 'ไม่สามารถอ่านไฟล์ได้'})
+            continue
+        candidates.append({
+            'filename': filename,
+            'resume_text': resume_text,
+            'context': ResumeContext(resume_text, model=model)
+        })
+    
+    # คัดกรองตำแหน่งของแต่ละ Resume ก่อน คู่ที่ไม่ผ่านใช้ fallback โดยไม่เรียก LLM
+    tasks = []
+    pair_results = {}
+    for candidate_idx, candidate in enumerate(candidates):
+        if PREFILTER_ENABLED and positions:
+            selected, scores = prefilter_positions(
+                candidate['resume_text'], positions, top_k=PREFILTER_TOP_K, min_score=PREFILTER_MIN_SCORE,
+                context=candidate['context']
+            )
+        else:
+            selected, scores = {idx for idx, _ in positions}, {}
+        for idx, jd_data in positions:
+            if idx in selected:
+                tasks.append((candidate_idx, idx, jd_data))
+            else:
+                pair_results[(candidate_idx, idx)] = prefiltered_position_result(
+                    candidate['resume_text'], jd_data, idx, scores.get(idx, 0), context=candidate['context']
+                )
+    
+    workers = max(1, min(ANALYSIS_MAX_WORKERS, len(tasks) or 1))
+    progress_store.start(progress_id, len(tasks), workers)
+    
+    def run_pair(candidate_idx, idx, jd_data):
+        candidate = candidates[candidate_idx]
+        label = f"{candidate['filename']} → {jd_data.get('title', f'ตำแหน่ง {idx + 1}')}"
+        progress_store.position_started(progress_id, label)
+        pair_start = time.time()
+        result = analyze_single_position(candidate['resume_text'], jd_data, idx, model=model,
+                                         model_display=model_display, context=candidate['context'])
+        progress_store.position_finished(progress_id, label, time.time() - pair_start)
+        return result
+    
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                submit_with_context(executor, run_pair, candidate_idx, idx, jd_data): (candidate_idx, idx)
+                for candidate_idx, idx, jd_data in tasks
+            }
+            for future in as_completed(futures):
+                pair_results[futures[future]] = future.result()
+    except Exception:
+        progress_store.finish(progress_id, status='failed')
+        raise
+    
+    # จัดอันดับผู้สมัครของแต่ละตำแหน่ง (คะแนนเท่ากันเรียงตามลำดับไฟล์)
+    ranked_positions = []
+    for idx, jd_data in positions:
+        rows = []
+        for candidate_idx, candidate in enumerate(candidates):
+            result = pair_results.get((candidate_idx, idx))
+            if not result:
+                continue
+            rows.append({
+                'filename': candidate['filename'],
+                'full_name': result.get('full_name', ''),
+                'email': result.get('email', ''),
+                'phone': result.get('phone', ''),
+                'match_percentage': result.get('match_percentage', '0%'),
+                'match_score': result.get('match_score', 0),
+                'skills_detected': result.get('skills_detected', []),
+                'skill_gaps': result.get('skill_gaps', []),
+                'recommendation': result.get('recommendation', ''),
+                'analysis_mode': result.get('analysis_mode', 'llm')
+            })
+        rows.sort(key=lambda r: r['match_score'], reverse=True)
+        for rank, row in enumerate(rows, 1):
+            row['rank'] = rank
+        ranked_positions.append({
+            'job_title': jd_data.get('title', f'ตำแหน่ง {idx + 1}'),
+            'total_candidates': len(rows),
+            'candidates': rows
+        })
+    
+    progress_store.finish(progress_id)
+    print(f"✅ Batch screening เสร็จสมบูรณ์: {len(candidates)} ไฟล์, อ่านไม่ได้ {len(errors)} ไฟล์")
+    
+    return {
+        'success': True,
+        'total_resumes': len(candidates),
+        'total_positions': len(positions),
+        'errors': errors,
+        'positions': ranked_positions
     }
 
+BATCH_EXPORT_FIELDS = ['job_title', 'rank', 'filename', 'full_name', 'email', 'phone',
+                       'match_percentage', 'match_score', 'skills_detected', 'skill_gaps', 'recommendation',
+                       'analysis_mode']
+
+def batch_result_rows(batch_result):
+    """แปลงผล batch screening เป็นแถว (หนึ่งแถวต่อผู้สมัครต่อตำแหน่ง) สำหรับ export"""
+    rows = []
+    for position in batch_result.get('positions', []):
+        for candidate in position['candidates']:
+            row = dict(candidate, job_title=position['job_title'])
+            rows.append({field: row.get(field, '') for field in BATCH_EXPORT_FIELDS})
+    return rows
+
+def export_batch_csv(batch_result):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=BATCH_EXPORT_FIELDS)
+    writer.writeheader()
+    for row in batch_result_rows(batch_result):
+        for field in ('skills_detected', 'skill_gaps'):
+            if isinstance(row[field], list):
+                row[field] = '; '.join(str(item) for item in row[field])
+        writer.writerow(row)
+    # ใส่ BOM เพื่อให้ Excel อ่านภาษาไทยได้ถูกต้อง
+    return '\ufeff' + output.getvalue()
+
+def export_batch_jsonl(batch_result):
+    return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in batch_result_rows(batch_result))
+
+def format_sse(event, data):
+    """จัดรูปแบบข้อมูลเป็น Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_analysis_events(job_id, events, budget=None):
+    """Generator ที่ส่ง event ของงานวิเคราะห์ (start / result / progress / done / error)
+    ถ้า client ปิด connection ก่อนงานเสร็จ จะยกเลิก budget ของงาน (หยุดเรียก Llama ตำแหน่งที่เหลือ)"""
+    finished = False
+    try:
+        yield format_sse('start', {'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'})
+        while True:
+            try:
+                event, data = events.get(timeout=STREAM_KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                # ส่ง comment เพื่อไม่ให้ proxy ตัด connection ระหว่างรอ
+                yield ": keep-alive\n\n"
+                continue
+            
+            yield format_sse(event, data)
+            if event in ('done', 'error'):
+                finished = True
+                break
+    finally:
+        if budget and not finished:
+            print(f"⚠️  Job {job_id}: client ปิด connection ยกเลิกการวิเคราะห์ที่เหลือ")
+            budget.cancel()
+
 # สร้างโฟลเดอร์ uploads ถ้ายังไม่มี
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -1265,18 +4443,8 @@ def upload_pdf():
         if file.filename == '':
             return jsonify({'error': 'ไม่ได้เลือกไฟล์'}), 400
         
-        filename_lower = file.filename.lower()
-        
-        # ตรวจสอบประเภทไฟล์
-        if filename_lower.endswith('.pdf'):
-            # อ่านข้อความจาก PDF
-            resume_text = extract_text_from_pdf(file)
-            file_type = 'PDF'
-        elif filename_lower.endswith('.docx'):
-            # อ่านข้อความจาก DOCX
-            resume_text = extract_text_from_docx(file)
-            file_type = 'DOCX'
-        else:
+        resume_text, file_type = extract_text_from_upload(file)
+        if not file_type:
             return jsonify({'error': 'ไฟล์ต้องเป็น PDF หรือ DOCX เท่านั้น'}), 400
         
         if not resume_text:
@@ -1308,7 +4476,8 @@ def analyze():
             return jsonify({'error': 'กรุณาระบุ Resume และ Job Description'}), 400
         
         # ใช้ Llama 3.2 วิเคราะห์
-        result = analyze_with_llama(resume_text, jd_text)
+        with llm_call_budget(LlamaCallBudget(request_deadline(data))):
+            result = analyze_with_llama(resume_text, jd_text)
         
         # ถ้า Llama ไม่สามารถใช้งานได้ ให้ใช้ fallback
         if not result:
@@ -1357,7 +4526,8 @@ def analyze_positions():
             return jsonify({'error': 'กรุณาระบุตำแหน่งงานอย่างน้อย 1 ตำแหน่ง'}), 400
         
         # วิเคราะห์ทุกตำแหน่ง
-        results = analyze_multiple_positions(resume_text, job_descriptions)
+        with llm_call_budget(LlamaCallBudget(request_deadline(data))):
+            results = analyze_multiple_positions(resume_text, job_descriptions)
         
         # หาตำแหน่งที่เหมาะสมที่สุด
         best_match = results[0] if results else None
@@ -1378,24 +4548,63 @@ def analyze_positions():
 
 @app.route('/api/progress', methods=['GET'])
 def get_progress():
-    """ดึง progress การวิเคราะห์"""
-    global analysis_progress
-    progress_percent = 0
-    if analysis_progress['total'] > 0:
-        progress_percent = int((analysis_progress['current'] / analysis_progress['total']) * 100)
+    """ดึง progress การวิเคราะห์ของงานที่ระบุ (?id=<job_id หรือ progress_id>)"""
+    progress_id = request.args.get('id', '')
+    if not progress_id:
+        return jsonify({'error': 'กรุณาระบุ id ของงาน'}), 400
     
-    return jsonify({
-        'progress': progress_percent,
-        'current': analysis_progress['current'],
-        'total': analysis_progress['total'],
-        'current_job': analysis_progress['current_job'],
-        'status': analysis_progress['status']
-    }), 200
+    progress = progress_store.get(progress_id)
+    if not progress:
+        return jsonify({
+            'progress_id': progress_id,
+            'progress': 0,
+            'current': 0,
+            'total': 0,
+            'current_job': '',
+            'status': 'idle'
+        }), 200
+    
+    return jsonify(progress), 200
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs_stats():
+    """ดูสถานะคิวงานวิเคราะห์แบบ async"""
+    return jsonify(analysis_jobs.stats()), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """ดูสถานะและผลลัพธ์ของงานวิเคราะห์แบบ async"""
+    job = analysis_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': f'ไม่พบงาน: {job_id} (อาจหมดอายุแล้ว)'}), 404
+    
+    job['progress'] = progress_store.get(job_id)
+    return jsonify(job), 200
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """ดูสถิติ cache ผลการวิเคราะห์ (hit/miss) และ document_store"""
+    stats = analysis_cache.stats()
+    stats['documents'] = document_store.stats() if document_store else None
+    stats['llm_parse'] = analysis_parse_stats.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/backends', methods=['GET'])
+def get_backends():
+    """ดูสถานะของ Ollama แต่ละเครื่อง (งานค้าง, circuit breaker, โมเดลที่มี)"""
+    return jsonify(ollama_client.stats()), 200
+
+@app.route('/api/llm-metrics', methods=['GET'])
+def get_llm_metrics():
+    """ดูเวลาของการเรียก Llama ล่าสุด (prompt_eval, token แรก, เวลารวม)"""
+    return jsonify(llm_call_metrics.stats()), 200
 
 @app.route('/api/analyze-auto', methods=['POST'])
 def analyze_auto():
-    """วิเคราะห์ Resume อัตโนมัติกับทุกตำแหน่งในฐานข้อมูล"""
-    global analysis_progress
+    """วิเคราะห์ Resume อัตโนมัติกับทุกตำแหน่งในฐานข้อมูล
+    
+    ส่ง "async": true เพื่อรับ job_id กลับทันที แล้วดูผลที่ GET /api/jobs/<job_id>
+    """
     try:
         data = request.get_json()
         
@@ -1408,89 +4617,177 @@ def analyze_auto():
         if not resume_text:
             return jsonify({'error': 'กรุณาระบุ Resume'}), 400
         
-        # Reset progress
-        analysis_progress = {
-            'current': 0,
-            'total': 0,
-            'current_job': '',
-            'status': 'idle'
-        }
+        if is_async_request(data):
+            return submit_analysis_job('analyze-auto', run_auto_analysis, resume_text, model, data=data)
         
-        # ใช้ตำแหน่งงานจากฐานข้อมูล
-        results = analyze_multiple_positions(resume_text, JOB_POSITIONS_DATABASE, model=model)
+        with llm_call_budget(LlamaCallBudget(request_deadline(data))):
+            response = run_auto_analysis(resume_text, model, progress_id=data.get('progress_id'))
+        return jsonify(response), 200
         
-        # กรองเฉพาะตำแหน่งที่มีความเหมาะสม >= 40%
-        suitable_positions = [r for r in results if r.get('match_score', 0) >= 40]
+    except Exception as e:
+        return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
+
+@app.route('/api/analyze-stream', methods=['POST'])
+def analyze_stream():
+    """วิเคราะห์ Resume กับทุกตำแหน่งในฐานข้อมูล แล้วส่งผลทีละตำแหน่งแบบ Server-Sent Events
+    
+    รับได้ทั้ง JSON {"resume": ..., "model": ...} หรือ multipart form ที่มี file และ model
+    events: start, result (ผลของแต่ละตำแหน่งทันทีที่เสร็จ), progress, done (ผลลัพธ์สรุป), error
+    """
+    try:
+        filename = None
+        if 'file' in request.files:
+            file = request.files['file']
+            
+            if file.filename == '':
+                return jsonify({'error': 'ไม่ได้เลือกไฟล์'}), 400
+            
+            resume_text, file_type = extract_text_from_upload(file, max_chars=upload_extract_limit(request.form))
+            if not file_type:
+                return jsonify({'error': 'ไฟล์ต้องเป็น PDF หรือ DOCX เท่านั้น'}), 400
+            if not resume_text:
+                return jsonify({'error': f'ไม่สามารถอ่านไฟล์ {file_type} ได้'}), 400
+            
+            filename = file.filename
+            model = request.form.get('model', 'llama-3.2-1b')
+            deadline = request_deadline(request.form)
+        else:
+            data = request.get_json(silent=True)
+            
+            if not data:
+                return jsonify({'error': 'ไม่มีข้อมูล'}), 400
+            
+            resume_text = data.get('resume', '')
+            model = data.get('model', 'llama-3.2-1b')
+            deadline = request_deadline(data)
+            
+            if not resume_text:
+                return jsonify({'error': 'กรุณาระบุ Resume'}), 400
         
-        # หาตำแหน่งที่เหมาะสมที่สุด
-        best_match = suitable_positions[0] if suitable_positions else results[0] if results else None
-        
-        # ดึงข้อมูลส่วนตัวจากผลลัพธ์แรก (ทุกตำแหน่งควรมีข้อมูลเดียวกัน)
-        personal_info = {}
-        if results:
-            first_result = results[0]
-            personal_info = {
-                'full_name': first_result.get('full_name', ''),
-                'email': first_result.get('email', ''),
-                'phone': first_result.get('phone', '')
-            }
+        job_id = uuid.uuid4().hex
+        events = queue.Queue()
+        # ยกเลิกการเรียก Llama ที่เหลือเมื่อ client ปิด connection (ดู stream_analysis_events)
+        budget = LlamaCallBudget(deadline)
         
-        # สร้างผลลัพธ์แบบย่อ (ไม่รวม Job Description)
-        suitable_positions_clean = []
-        for pos in suitable_positions:
-            suitable_positions_clean.append({
-                'job_title': pos.get('job_title', ''),
-                'match_percentage': pos.get('match_percentage', '0%'),
-                'match_score': pos.get('match_score', 0),
-                'summary': pos.get('summary', ''),
-                'skills_detected': pos.get('skills_detected', []),
-                'strengths': pos.get('strengths', []),
-                'skill_gaps': pos.get('skill_gaps', []),
-                'why_suitable': pos.get('why_suitable', ''),
-                'recommendation': pos.get('recommendation', '')
-            })
+        def on_result(result):
+            # ส่งข้อมูลส่วนตัวไปกับผลแต่ละตำแหน่ง เพื่อให้หน้าเว็บแสดงได้ก่อน event "done"
+            payload = clean_position_result(result)
+            payload.update({field: result.get(field, '') for field in ('full_name', 'email', 'phone')})
+            events.put(('result', payload))
+            events.put(('progress', progress_store.get(job_id)))
         
-        best_match_clean = None
-        if best_match:
-            best_match_clean = {
-                'job_title': best_match.get('job_title', ''),
-                'match_percentage': best_match.get('match_percentage', '0%'),
-                'match_score': best_match.get('match_score', 0),
-                'summary': best_match.get('summary', ''),
-                'skills_detected': best_match.get('skills_detected', []),
-                'strengths': best_match.get('strengths', []),
-                'skill_gaps': best_match.get('skill_gaps', []),
-                'why_suitable': best_match.get('why_suitable', ''),
-                'recommendation': best_match.get('recommendation', '')
-            }
+        def run_stream_job():
+            # งานนี้รันใน worker ของคิว เพื่อให้ใช้ backpressure เดียวกับงาน async อื่นๆ
+            try:
+                if filename:
+                    response = run_upload_analysis(resume_text, filename, model,
+                                                   progress_id=job_id, on_result=on_result)
+                else:
+                    response = run_auto_analysis(resume_text, model, progress_id=job_id, on_result=on_result)
+                events.put(('done', response))
+                return response
+            except Exception as e:
+                events.put(('error', {'error': f'เกิดข้อผิดพลาด: {str(e)}'}))
+                raise
         
-        return jsonify({
-            'full_name': personal_info.get('full_name', ''),
-            'email': personal_info.get('email', ''),
-            'phone': personal_info.get('phone', ''),
-            'summary': best_match_clean.get('summary', '') if best_match_clean else '',
-            'skills_detected': best_match_clean.get('skills_detected', []) if best_match_clean else [],
-            'suitable_positions': suitable_positions_clean,
-            'best_match': best_match_clean,
-            'total_analyzed': len(results),
-            'total_suitable': len(suitable_positions_clean)
-        }), 200
+        try:
+            analysis_jobs.submit('analyze-stream', run_with_llm_budget, budget, run_stream_job, job_id=job_id)
+        except queue.Full:
+            return jsonify({'error': 'คิวการวิเคราะห์เต็ม กรุณาลองใหม่ภายหลัง'}), 429, {'Retry-After': str(JOB_RETRY_AFTER)}
+        
+        return Response(
+            stream_analysis_events(job_id, events, budget),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
+
+@app.route('/api/batch-screen', methods=['POST'])
+def batch_screen():
+    """คัดกรอง Resume หลายไฟล์กับหลายตำแหน่งพร้อมกัน (ทำงานแบบ async เสมอ)
+    
+    multipart form:
+    - files: ไฟล์ PDF/DOCX หลายไฟล์ และ/หรือ archive: ไฟล์ zip ที่มี PDF/DOCX
+    - positions: (optional) JSON list ของชื่อตำแหน่งในฐานข้อมูล (default: ทุกตำแหน่ง)
+    - job_descriptions: (optional) JSON list ของ {"title", "description"} แทนฐานข้อมูล
+    - model: (optional) โมเดลที่ใช้
+    ดูผลที่ GET /api/jobs/<job_id> หรือ export ที่ GET /api/batch-screen/<job_id>/export?format=csv|jsonl
+    """
+    try:
+        files = request.files.getlist('files')
+        archives = request.files.getlist('archive')
+        if not files and not archives:
+            return jsonify({'error': 'ไม่มีไฟล์'}), 400
+        
+        try:
+            documents = read_batch_documents(files, archives)
+        except zipfile.BadZipFile:
+            return jsonify({'error': 'ไฟล์ zip ไม่ถูกต้อง'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not documents:
+            return jsonify({'error': 'ไม่พบไฟล์ PDF หรือ DOCX'}), 400
+        
+        try:
+            if request.form.get('job_descriptions'):
+                job_descriptions = json.loads(request.form['job_descriptions'])
+            elif request.form.get('positions'):
+                selected = (position_store.find_by_title(title) for title in json.loads(request.form['positions']))
+                job_descriptions = [pos for pos in selected if pos]
+            else:
+                job_descriptions = position_store.list()
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            return jsonify({'error': 'รูปแบบ positions หรือ job_descriptions ไม่ถูกต้อง'}), 400
+        
+        if not isinstance(job_descriptions, list) or not all(isinstance(jd, dict) for jd in job_descriptions):
+            return jsonify({'error': 'รูปแบบ job_descriptions ไม่ถูกต้อง'}), 400
+        if not job_descriptions:
+            return jsonify({'error': 'กรุณาระบุตำแหน่งงานอย่างน้อย 1 ตำแหน่ง'}), 400
+        
+        model = request.form.get('model', 'llama-3.2-1b')
+        return submit_analysis_job('batch-screen', run_batch_screening, documents, job_descriptions, model,
+                                   data=request.form)
         
     except Exception as e:
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
 
+@app.route('/api/batch-screen/<job_id>/export', methods=['GET'])
+def export_batch_screen(job_id):
+    """Export ผล batch screening เป็น CSV หรือ JSONL"""
+    job = analysis_jobs.get(job_id)
+    if not job or job['type'] != 'batch-screen':
+        return jsonify({'error': f'ไม่พบงาน: {job_id} (อาจหมดอายุแล้ว)'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': 'งานยังไม่เสร็จ', 'status': job['status']}), 409
+    
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format == 'csv':
+        return Response(export_batch_csv(job['result']), mimetype='text/csv',
+                        headers={'Content-Disposition': f'attachment; filename=batch-{job_id}.csv'})
+    if export_format == 'jsonl':
+        return Response(export_batch_jsonl(job['result']), mimetype='application/x-ndjson',
+                        headers={'Content-Disposition': f'attachment; filename=batch-{job_id}.jsonl'})
+    return jsonify({'error': 'format ต้องเป็น csv หรือ jsonl'}), 400
+
+def position_response(pos):
+    """แปลงตำแหน่งงานเป็นรูปแบบที่ส่งกลับทาง API"""
+    features = position_store.features(pos['id'])
+    return {
+        'id': pos['id'],
+        'title': pos['title'],
+        'description': pos['description'],
+        'requirements': pos['description'].split('\n') if pos['description'] else [],
+        'required_skills': [skill_matcher.display_name(s) for s in sorted(features.required_skills if features else ())]
+    }
+
 @app.route('/api/positions', methods=['GET'])
 def get_positions():
     """แสดงรายการตำแหน่งงานทั้งหมดในฐานข้อมูล"""
     try:
-        positions = []
-        for idx, pos in enumerate(JOB_POSITIONS_DATABASE):
-            positions.append({
-                'id': idx + 1,
-                'title': pos.get('title', ''),
-                'description': pos.get('description', ''),
-                'requirements': pos.get('description', '').split('\n') if pos.get('description') else []
-            })
+        positions = [position_response(pos) for pos in position_store.list()]
         
         return jsonify({
             'success': True,
@@ -1501,9 +4798,93 @@ def get_positions():
     except Exception as e:
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
 
+@app.route('/api/rank-positions', methods=['POST'])
+def rank_positions():
+    """จัดอันดับทุกตำแหน่งในฐานข้อมูลด้วยคะแนนทักษะ (ไม่เรียก LLM) เหมาะกับตำแหน่งจำนวนมาก
+    
+    JSON: {"resume": "...", "top_k": 20}
+    """
+    data = request.get_json(silent=True)
+    if not data or not data.get('resume'):
+        return jsonify({'error': 'กรุณาระบุ Resume'}), 400
+    try:
+        top_k = int(data.get('top_k', 20))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k ต้องเป็นตัวเลข'}), 400
+    
+    positions = position_store.list()
+    resume_skills = skill_matcher.find(data['resume'])
+    scores = bulk_skill_scores(resume_skills, [job_features_for(pos) for pos in positions])
+    ranked = sorted(range(len(positions)), key=lambda i: scores['match_percentage'][i], reverse=True)
+    return jsonify({
+        'success': True,
+        'total': len(positions),
+        'skills_detected': [skill_matcher.display_name(s) for s in sorted(resume_skills)],
+        'ranking': [
+            {
+                'rank': rank + 1,
+                'id': positions[i]['id'],
+                'job_title': positions[i]['title'],
+                'match_percentage': f"{scores['match_percentage'][i]}%",
+                'match_score': scores['match_percentage'][i],
+                'matched_skills': scores['matched'][i],
+                'missing_skills': scores['missing'][i]
+            }
+            for rank, i in enumerate(ranked[:max(top_k, 0)])
+        ]
+    }), 200
+
+@app.route('/api/positions', methods=['POST'])
+def create_position():
+    """เพิ่มตำแหน่งงาน (JSON: {"title", "description"})"""
+    try:
+        position = position_store.create(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'position': position_response(position)}), 201
+
+@app.route('/api/positions/<int:position_id>', methods=['GET'])
+def get_position(position_id):
+    position = position_store.get(position_id)
+    if not position:
+        return jsonify({'error': f'ไม่พบตำแหน่งงาน ID: {position_id}'}), 404
+    return jsonify({'success': True, 'position': position_response(position)}), 200
+
+@app.route('/api/positions/<int:position_id>', methods=['PUT'])
+def update_position(position_id):
+    """แก้ไขตำแหน่งงาน (ส่งเฉพาะ field ที่ต้องการเปลี่ยน)"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'ไม่มีข้อมูล'}), 400
+    try:
+        position = position_store.update(position_id, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not position:
+        return jsonify({'error': f'ไม่พบตำแหน่งงาน ID: {position_id}'}), 404
+    return jsonify({'success': True, 'position': position_response(position)}), 200
+
+@app.route('/api/positions/<int:position_id>', methods=['DELETE'])
+def delete_position(position_id):
+    if not position_store.delete(position_id):
+        return jsonify({'error': f'ไม่พบตำแหน่งงาน ID: {position_id}'}), 404
+    return jsonify({'success': True}), 200
+
+@app.route('/api/positions/reload', methods=['POST'])
+def reload_positions():
+    """โหลดตำแหน่งงานใหม่จากไฟล์/ฐานข้อมูลทันที"""
+    try:
+        total = position_store.reload()
+    except (OSError, ValueError, sqlite3.Error) as e:
+        return jsonify({'error': f'โหลดตำแหน่งงานไม่สำเร็จ: {str(e)}'}), 500
+    return jsonify({'success': True, 'total': total}), 200
+
 @app.route('/api/analyze-detail', methods=['POST'])
 def analyze_detail():
-    """วิเคราะห์ Resume กับตำแหน่งงานและแสดงผลแบบละเอียด (เหมาะสำหรับเทส)"""
+    """วิเคราะห์ Resume กับตำแหน่งงานและแสดงผลแบบละเอียด (เหมาะสำหรับเทส)
+    
+    ส่ง "async": true เพื่อรับ job_id กลับทันที แล้วดูผลที่ GET /api/jobs/<job_id>
+    """
     try:
         data = request.get_json()
         
@@ -1512,103 +4893,32 @@ def analyze_detail():
         
         resume_text = data.get('resume', '')
         job_title = data.get('job_title', '')  # Optional: ระบุตำแหน่งเฉพาะ
+        position_id = data.get('position_id')  # Optional: ระบุตำแหน่งด้วย ID
         
         if not resume_text:
             return jsonify({'error': 'กรุณาระบุ Resume'}), 400
         
         # ถ้าระบุตำแหน่งเฉพาะ ให้วิเคราะห์เฉพาะตำแหน่งนั้น
-        if job_title:
+        selected_job = None
+        if position_id is not None:
+            try:
+                selected_job = position_store.get(int(position_id))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'position_id ต้องเป็นตัวเลข'}), 400
+            if not selected_job:
+                return jsonify({'error': f'ไม่พบตำแหน่งงาน ID: {position_id}'}), 404
+        elif job_title:
             # หาตำแหน่งที่ตรงกับ job_title
-            selected_job = None
-            for pos in JOB_POSITIONS_DATABASE:
-                if pos.get('title', '').lower() == job_title.lower():
-                    selected_job = pos
-                    break
-            
+            selected_job = position_store.find_by_title(job_title)
             if not selected_job:
                 return jsonify({'error': f'ไม่พบตำแหน่งงาน: {job_title}'}), 404
-            
-            # วิเคราะห์เฉพาะตำแหน่งนี้
-            result = analyze_with_llama(resume_text, selected_job.get('description', ''), selected_job.get('title', ''))
-            
-            if not result:
-                result = fallback_analysis(resume_text, selected_job.get('description', ''))
-            
-            # เติมข้อมูลเพิ่มเติม
-            result['job_title'] = selected_job.get('title', '')
-            result['job_description'] = selected_job.get('description', '')
-            
-            return jsonify({
-                'success': True,
-                'full_name': result.get('full_name', ''),
-                'email': result.get('email', ''),
-                'phone': result.get('phone', ''),
-                'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text,
-                'analysis': result,
-                'job_info': {
-                    'title': selected_job.get('title', ''),
-                    'description': selected_job.get('description', '')
-                }
-            }), 200
-        else:
-            # วิเคราะห์กับทุกตำแหน่ง
-            results = analyze_multiple_positions(resume_text, JOB_POSITIONS_DATABASE)
-            
-            # ดึงข้อมูลส่วนตัวจากผลลัพธ์แรก
-            personal_info = {}
-            if results:
-                first_result = results[0]
-                personal_info = {
-                    'full_name': first_result.get('full_name', ''),
-                    'email': first_result.get('email', ''),
-                    'phone': first_result.get('phone', '')
-                }
-            
-            # สร้างผลลัพธ์แบบละเอียด
-            detailed_results = []
-            for r in results:
-                detailed_results.append({
-                    'job_title': r.get('job_title', ''),
-                    'match_percentage': r.get('match_percentage', '0%'),
-                    'match_score': r.get('match_score', 0),
-                    'summary': r.get('summary', ''),
-                    'skills_detected': r.get('skills_detected', []),
-                    'strengths': r.get('strengths', []),
-                    'skill_gaps': r.get('skill_gaps', []),
-                    'why_suitable': r.get('why_suitable', ''),
-                    'recommendation': r.get('recommendation', ''),
-                    'job_description': next(
-                        (pos.get('description', '') for pos in JOB_POSITIONS_DATABASE 
-                         if pos.get('title', '') == r.get('job_title', '')),
-                        ''
-                    )
-                })
-            
-            # เรียงลำดับตาม match_score
-            detailed_results.sort(key=lambda x: x.get('match_score', 0), reverse=True)
-            
-            # หาตำแหน่งที่ดีที่สุด
-            best_match = detailed_results[0] if detailed_results else None
-            
-            return jsonify({
-                'success': True,
-                'full_name': personal_info.get('full_name', ''),
-                'email': personal_info.get('email', ''),
-                'phone': personal_info.get('phone', ''),
-                'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text,
-                'total_positions': len(detailed_results),
-                'best_match': best_match,
-                'all_analyses': detailed_results,
-                'ranking': [
-                    {
-                        'rank': idx + 1,
-                        'job_title': r.get('job_title', ''),
-                        'match_percentage': r.get('match_percentage', '0%'),
-                        'match_score': r.get('match_score', 0)
-                    }
-                    for idx, r in enumerate(detailed_results)
-                ]
-            }), 200
+        
+        if is_async_request(data):
+            return submit_analysis_job('analyze-detail', run_detail_analysis, resume_text, selected_job, data=data)
+        
+        with llm_call_budget(LlamaCallBudget(request_deadline(data))):
+            response = run_detail_analysis(resume_text, selected_job, progress_id=data.get('progress_id'))
+        return jsonify(response), 200
             
     except Exception as e:
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
@@ -1642,8 +4952,11 @@ def extract_personal_info():
 
 @app.route('/api/upload-and-analyze', methods=['POST'])
 def upload_and_analyze():
-    """อัปโหลด PDF และวิเคราะห์อัตโนมัติกับทุกตำแหน่งในฐานข้อมูล (API เดียว)"""
-    global analysis_progress
+    """อัปโหลด PDF และวิเคราะห์อัตโนมัติกับทุกตำแหน่งในฐานข้อมูล (API เดียว)
+    
+    ส่ง form field async=true เพื่อรับ job_id กลับทันที แล้วดูผลที่ GET /api/jobs/<job_id>
+    (ไฟล์จะถูกอ่านเป็นข้อความก่อนเข้าคิว)
+    """
     try:
         # ตรวจสอบว่ามีไฟล์หรือไม่
         if 'file' not in request.files:
@@ -1654,18 +4967,8 @@ def upload_and_analyze():
         if file.filename == '':
             return jsonify({'error': 'ไม่ได้เลือกไฟล์'}), 400
         
-        filename_lower = file.filename.lower()
-        
-        # ตรวจสอบประเภทไฟล์
-        if filename_lower.endswith('.pdf'):
-            # อ่านข้อความจาก PDF
-            resume_text = extract_text_from_pdf(file)
-            file_type = 'PDF'
-        elif filename_lower.endswith('.docx'):
-            # อ่านข้อความจาก DOCX
-            resume_text = extract_text_from_docx(file)
-            file_type = 'DOCX'
-        else:
+        resume_text, file_type = extract_text_from_upload(file, max_chars=upload_extract_limit(request.form))
+        if not file_type:
             return jsonify({'error': 'ไฟล์ต้องเป็น PDF หรือ DOCX เท่านั้น'}), 400
         
         # อ่าน model จาก form data (ถ้ามี)
@@ -1674,76 +4977,14 @@ def upload_and_analyze():
         if not resume_text:
             return jsonify({'error': 'ไม่สามารถอ่านไฟล์ PDF ได้'}), 400
         
-        # Reset progress
-        analysis_progress = {
-            'current': 0,
-            'total': 0,
-            'current_job': '',
-            'status': 'idle'
-        }
-        
-        # ใช้ตำแหน่งงานจากฐานข้อมูล
-        results = analyze_multiple_positions(resume_text, JOB_POSITIONS_DATABASE, model=model)
-        
-        # กรองเฉพาะตำแหน่งที่มีความเหมาะสม >= 40%
-        suitable_positions = [r for r in results if r.get('match_score', 0) >= 40]
-        
-        # หาตำแหน่งที่เหมาะสมที่สุด
-        best_match = suitable_positions[0] if suitable_positions else results[0] if results else None
-        
-        # ดึงข้อมูลส่วนตัวจากผลลัพธ์แรก (ทุกตำแหน่งควรมีข้อมูลเดียวกัน)
-        personal_info = {}
-        if results:
-            first_result = results[0]
-            personal_info = {
-                'full_name': first_result.get('full_name', ''),
-                'email': first_result.get('email', ''),
-                'phone': first_result.get('phone', '')
-            }
-        
-        # สร้างผลลัพธ์แบบย่อ (ไม่รวม Job Description)
-        suitable_positions_clean = []
-        for pos in suitable_positions:
-            suitable_positions_clean.append({
-                'job_title': pos.get('job_title', ''),
-                'match_percentage': pos.get('match_percentage', '0%'),
-                'match_score': pos.get('match_score', 0),
-                'summary': pos.get('summary', ''),
-                'skills_detected': pos.get('skills_detected', []),
-                'strengths': pos.get('strengths', []),
-                'skill_gaps': pos.get('skill_gaps', []),
-                'why_suitable': pos.get('why_suitable', ''),
-                'recommendation': pos.get('recommendation', '')
-            })
-        
-        best_match_clean = None
-        if best_match:
-            best_match_clean = {
-                'job_title': best_match.get('job_title', ''),
-                'match_percentage': best_match.get('match_percentage', '0%'),
-                'match_score': best_match.get('match_score', 0),
-                'summary': best_match.get('summary', ''),
-                'skills_detected': best_match.get('skills_detected', []),
-                'strengths': best_match.get('strengths', []),
-                'skill_gaps': best_match.get('skill_gaps', []),
-                'why_suitable': best_match.get('why_suitable', ''),
-                'recommendation': best_match.get('recommendation', '')
-            }
+        if is_async_request(request.form):
+            return submit_analysis_job('upload-and-analyze', run_upload_analysis, resume_text, file.filename, model,
+                                       data=request.form)
         
-        return jsonify({
-            'success': True,
-            'filename': file.filename,
-            'full_name': personal_info.get('full_name', ''),
-            'email': personal_info.get('email', ''),
-            'phone': personal_info.get('phone', ''),
-            'resume_preview': resume_text[:200] + '...' if len(resume_text) > 200 else resume_text,
-            'summary': best_match_clean.get('summary', '') if best_match_clean else '',
-            'skills_detected': best_match_clean.get('skills_detected', []) if best_match_clean else [],
-            'suitable_positions': suitable_positions_clean,
-            'best_match': best_match_clean,
-            'total_analyzed': len(results),
-            'total_suitable': len(suitable_positions_clean)
-        }), 200
+        with llm_call_budget(LlamaCallBudget(request_deadline(request.form))):
+            response = run_upload_analysis(resume_text, file.filename, model,
+                                           progress_id=request.form.get('progress_id'))
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({'error': f'เกิดข้อผิดพลาด: {str(e)}'}), 500
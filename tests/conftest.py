@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app สร้าง uploads/documents.sqlite3 ตอน import (path แบบ relative) ให้ไปอยู่ในโฟลเดอร์ชั่วคราว
+os.chdir(tempfile.mkdtemp(prefix='resume-analyzer-tests-'))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def no_document_store(monkeypatch):
+    monkeypatch.setattr(app_module, 'document_store', None)
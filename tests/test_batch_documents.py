@@ -0,0 +1,38 @@
+import io
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return FileStorage(io.BytesIO(buffer.getvalue()), filename='resumes.zip')
+
+
+def test_zip_members_keep_archive_path(app):
+    archive = make_zip({
+        'team-a/resume.pdf': b'a',
+        'team-b/resume.pdf': b'b',
+        'notes.txt': b'skip',
+        '__MACOSX/team-a/resume.pdf': b'skip',
+    })
+    documents = app.read_batch_documents([], [archive])
+    assert documents == [('team-a/resume.pdf', b'a'), ('team-b/resume.pdf', b'b')]
+
+
+def test_oversized_zip_member_is_rejected(app, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 4)
+    archive = make_zip({'small.pdf': b'ok', 'big.docx': b'too large'})
+    with pytest.raises(ValueError, match='big.docx'):
+        app.read_batch_documents([], [archive])
+
+
+def test_batch_limits(app, monkeypatch):
+    monkeypatch.setattr(app, 'BATCH_MAX_FILES', 1)
+    files = [FileStorage(io.BytesIO(b'x'), filename=f'{i}.pdf') for i in range(2)]
+    with pytest.raises(ValueError):
+        app.read_batch_documents(files, [])
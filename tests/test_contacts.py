@@ -0,0 +1,49 @@
+import pytest
+
+# ผลจาก extract_personal_info_from_resume เวอร์ชันก่อนรวม pattern (email, phone)
+BASELINE_PERSONAL_INFO = [
+    ('John Smith\nEmail: john.smith@example.com\nTel: 081-234-5678', 'john.smith@example.com', '081-234-5678'),
+    ('สมชาย ใจดี\nโทร 0812345678 อีเมล somchai@mail.co.th', 'somchai@mail.co.th', '0812345678'),
+    ('Jane Doe\nPhone: +66 81 234 5678\njane@doe.io', 'jane@doe.io', '+66812345678'),
+    ('Contact (081) 234-5678 / a.b@c.com', 'a.b@c.com', '(081) 234-5678'),
+    ('ID 1234567890123 phone 0912345678', '', '0912345678'),
+    ('Call 02-123-4567 or 0612345678', '', '0612345678'),
+    ('first@a.com second@b.org 095 123 4567', 'first@a.com', '095 123 4567'),
+    ('no contact here', '', ''),
+]
+
+
+@pytest.mark.parametrize('text,email,phone', BASELINE_PERSONAL_INFO)
+def test_personal_info_matches_baseline(app, text, email, phone):
+    info = app.extract_personal_info_from_resume(text)
+    assert (info['email'], info['phone']) == (email, phone)
+
+
+@pytest.mark.parametrize('text', ['Mobile 66812345678', 'Mobile 66-81-234-5678', 'Mobile 66 81 234 567'])
+def test_bare_66_is_normalized_to_plus_66(app, text):
+    digits = ''.join(ch for ch in text if ch.isdigit())
+    assert app.extract_personal_info_from_resume(text)['phone'] == '+' + digits
+
+
+def test_local_number_has_priority_over_bare_66(app):
+    assert app.extract_personal_info_from_resume('66812345678 / 0812345678')['phone'] == '0812345678'
+
+
+def test_bare_66_not_taken_from_longer_numbers(app):
+    patterns = [c['pattern'] for c in app.scan_contacts('ref 1266812345678 +66812345678')]
+    assert 'phone_th_intl_bare' not in patterns
+
+
+def test_scan_contacts_finds_thai_number_after_other_digits(app):
+    contacts = app.scan_contacts('ID 12345 0812345678 me@example.com')
+    local = app.first_contact(contacts, 'phone_th_local')
+    assert local['value'] == '0812345678'
+    assert local['start'] == 9
+    email = app.first_contact(contacts, 'email')
+    assert email['value'] == 'me@example.com'
+    assert [c['start'] for c in contacts] == sorted(c['start'] for c in contacts)
+
+
+def test_fallback_contact_info_takes_first_phone(app):
+    info = app.fallback_contact_info('John Smith\n+66 81 234 5678 and 0812345678\nx@y.com')
+    assert info == {'full_name': 'John Smith', 'email': 'x@y.com', 'phone': '+66 81 234 5678'}
@@ -0,0 +1,116 @@
+import io
+import time
+
+import pytest
+from docx import Document
+
+
+@pytest.fixture
+def store(app, tmp_path, monkeypatch):
+    store = app.DocumentStore(db_path=str(tmp_path / 'documents.sqlite3'))
+    monkeypatch.setattr(app, 'document_store', store)
+    return store
+
+
+def make_docx(*paragraphs):
+    doc = Document()
+    for paragraph in paragraphs:
+        doc.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def read_docx(app, stream, max_chars):
+    extract = lambda s, status: app.extract_text_from_docx(s, max_chars=max_chars, status=status)
+    return app.read_document_text(stream, 'resume.docx', extract, max_chars)
+
+
+def test_incomplete_row_serves_only_shorter_requests(app, store):
+    store.put_text('digest', 'a.pdf', 'PDF', 'x' * 100, 100, complete=False)
+    assert store.get_text('digest', 50) == 'x' * 50
+    assert store.get_text('digest', 100) == 'x' * 100
+    assert store.get_text('digest', 200) is None
+
+
+def test_complete_row_serves_any_length(app, store):
+    store.put_text('digest', 'a.pdf', 'PDF', 'short', 100, complete=True)
+    assert store.get_text('digest', 10_000) == 'short'
+
+
+def test_row_from_other_extract_version_is_stale(app, store, monkeypatch):
+    store.put_text('digest', 'a.pdf', 'PDF', 'text', 100, complete=True)
+    monkeypatch.setattr(app, 'DOCUMENT_EXTRACT_VERSION', 'next')
+    assert store.get_text('digest', 100) is None
+
+
+def test_profile_from_other_version_is_reset(app, store, monkeypatch):
+    store.put_text('digest', 'a.pdf', 'PDF', 'text', 100, complete=True)
+    text_digest = store.text_digest('text')
+    store.save_profile(text_digest, resume_clean='clean')
+    assert store.get_profile(text_digest)['resume_clean'] == 'clean'
+    monkeypatch.setattr(app, 'PROFILE_VERSION', 'next')
+    assert store.get_profile(text_digest)['resume_clean'] is None
+
+
+def test_docx_truncated_by_max_chars_is_not_complete(app, store):
+    stream = make_docx('a' * 30, 'b' * 30)
+    assert read_docx(app, stream, 40) == ('a' * 30 + '\n' + 'b' * 30)[:40]
+    # ต้องอ่านไฟล์ใหม่เมื่อขอข้อความยาวกว่าที่เก็บไว้
+    assert read_docx(app, stream, 1000).endswith('b' * 30)
+    assert store.hits == 0
+
+
+def test_docx_read_to_end_is_complete(app, store):
+    stream = make_docx('short resume')
+    read_docx(app, stream, 1000)
+    assert read_docx(app, stream, 5000) == 'short resume'
+    assert store.hits == 1
+
+
+def test_interrupted_extraction_is_not_stored(app, store):
+    def extract(stream, status):
+        status.update(complete=False, interrupted=True)
+        return 'first page only'
+
+    stream = io.BytesIO(b'pdf bytes')
+    assert app.read_document_text(stream, 'a.pdf', extract, 100) == 'first page only'
+    assert store.stats()['documents'] == 0
+
+
+def test_slow_last_page_does_not_interrupt(app, monkeypatch):
+    class Page:
+        def __init__(self, delay):
+            self.delay = delay
+
+        def extract_text(self):
+            time.sleep(self.delay)
+            return 'page'
+
+    reader = type('Reader', (), {'pages': [Page(0), Page(0.02), Page(0.02)]})()
+    status = {}
+    assert list(app.iter_pdf_pages(reader, 3, page_timeout=0.01, status=status)) == ['page', 'page']
+    assert status['interrupted']
+    status = {}
+    assert list(app.iter_pdf_pages(reader, 2, page_timeout=0.01, status=status)) == ['page', 'page']
+    assert not status
+
+
+def test_analysis_cache_key_changes_with_prompt_and_model(app, monkeypatch):
+    key = app.AnalysisCache.make_key('resume', 'jd', 'Dev', model='llama3.2:1b')
+    assert key == app.AnalysisCache.make_key('resume', ' jd ', 'Dev', model='llama3.2:1b')
+    assert key != app.AnalysisCache.make_key('resume', 'jd', 'Dev', model='llama3:8b')
+    assert key != app.AnalysisCache.make_key('resume', 'jd', 'Dev', model='llama3.2:1b', prompt_mode='multi')
+    monkeypatch.setattr(app, 'ANALYSIS_PROMPT_VERSION', 'next')
+    assert key != app.AnalysisCache.make_key('resume', 'jd', 'Dev', model='llama3.2:1b')
+
+
+def test_analysis_cache_expires_on_disk(app, tmp_path):
+    cache = app.AnalysisCache(ttl=60, db_path=str(tmp_path / 'cache.sqlite3'))
+    cache.set('key', {'score': 1})
+    assert cache.get('key') == {'score': 1}
+    reopened = app.AnalysisCache(ttl=0, db_path=str(tmp_path / 'cache.sqlite3'))
+    time.sleep(0.01)
+    assert reopened.get('key') is None
+    assert reopened.stats()['misses'] == 1
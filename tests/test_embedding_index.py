@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+
+class FakeEmbedClient:
+    def __init__(self):
+        self.calls = []
+        self.during_embed = None
+
+    def embed(self, texts, model=None):
+        self.calls.append(list(texts))
+        hook, self.during_embed = self.during_embed, None
+        if hook:
+            hook()
+        return [[1.0, float(len(text))] for text in texts]
+
+
+def jd(name):
+    return SimpleNamespace(digest='digest-' + name, clean=name)
+
+
+def test_add_reembeds_rows_evicted_while_embedding(app):
+    client = FakeEmbedClient()
+    index = app.EmbeddingIndex(client=client, path=None, adhoc_max_entries=1)
+    first, second, other = jd('a'), jd('bb'), jd('ccc')
+    index.add([first])
+    # ระหว่าง embed "bb" (ไม่ถือ lock) thread อื่นเพิ่ม JD ใหม่จน "a" ถูก evict
+    client.during_embed = lambda: index.add([other])
+
+    vectors = index.add([first, second])
+
+    assert client.calls == [['a'], ['bb'], ['ccc'], ['a']]
+    expected = np.array([[1.0, 1.0], [1.0, 2.0]], dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(vectors, expected)
+
+
+def test_add_keeps_persistent_rows(app):
+    client = FakeEmbedClient()
+    index = app.EmbeddingIndex(client=client, path=None, adhoc_max_entries=1)
+    stored = jd('stored')
+    index.add([stored], persistent={stored.digest})
+    index.add([jd('x')])
+    index.add([jd('yy')])
+    index.add([stored])
+    assert client.calls == [['stored'], ['x'], ['yy']]
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+
+def test_finds_object_across_chunks(app):
+    scanner = app.JsonObjectScanner()
+    text = 'ผลลัพธ์: {"a": "}{", "b": {"c": "\\""}} ต่อท้าย'
+    assert not scanner.feed(text[:12])
+    assert scanner.feed(text[12:])
+    assert json.loads(text[scanner.start_idx:scanner.end_idx]) == {'a': '}{', 'b': {'c': '"'}}
+
+
+def test_feeding_after_complete_keeps_first_object(app):
+    scanner = app.JsonObjectScanner()
+    assert scanner.feed('{"a": 1}')
+    assert scanner.feed('{"b": 2}')
+    assert (scanner.start_idx, scanner.end_idx) == (0, 8)
+
+
+def test_incomplete_object(app):
+    scanner = app.JsonObjectScanner()
+    assert not scanner.feed('{"a": [1, 2')
+    assert not scanner.complete
+
+
+def test_chunk_boundary_inside_escape(app):
+    scanner = app.JsonObjectScanner()
+    chunks = ['{"q": "a\\', '"}', '"}']
+    assert [scanner.feed(chunk) for chunk in chunks] == [False, False, True]
+    assert json.loads(''.join(chunks)[scanner.start_idx:scanner.end_idx]) == {'q': 'a"}'}
+
+
+def test_extract_json_object(app):
+    assert app.extract_json_object('Sure! {"score": 1} done') == '{"score": 1}'
+    assert app.extract_json_object('{"score": ') == ''
+    with pytest.raises(json.JSONDecodeError):
+        app.extract_json_object('no json here')
@@ -0,0 +1,49 @@
+class FakeStreamClient:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.closed = False
+
+    def generate_stream(self, payload, read_timeout=None):
+        def gen():
+            try:
+                for chunk in self.chunks:
+                    self.read += 1
+                    yield chunk
+            finally:
+                self.closed = True
+        return gen()
+
+
+def tokens(*parts, done=None):
+    chunks = [{'response': part} for part in parts]
+    if done is not None:
+        chunks.append(dict(done, response='', done=True))
+    return chunks
+
+
+def test_stream_records_prompt_eval_after_json_closes(app):
+    done = {'prompt_eval_duration': 120_000_000, 'prompt_eval_count': 900, 'eval_count': 20}
+    client = FakeStreamClient(tokens('{"score"', ': 80}', '\n', done=done))
+    timings = {}
+    text = app.read_llama_stream(client, {}, timings=timings)
+    assert text == '{"score": 80}'
+    assert timings['prompt_eval_ms'] == 120.0
+    assert timings['prompt_eval_count'] == 900
+    assert 'first_token_seconds' in timings
+    assert client.closed
+
+
+def test_stream_without_timings_stops_at_json(app):
+    client = FakeStreamClient(tokens('{"score": 80}', ' more', done={}))
+    assert app.read_llama_stream(client, {}) == '{"score": 80}'
+    assert client.read == 1
+
+
+def test_stream_grace_is_bounded(app):
+    trailing = ['x'] * (app.OLLAMA_STREAM_DONE_GRACE_CHUNKS * 3)
+    client = FakeStreamClient(tokens('{"score": 1}', *trailing, done={'prompt_eval_count': 5}))
+    timings = {}
+    assert app.read_llama_stream(client, {}, timings=timings) == '{"score": 1}'
+    assert client.read == 1 + app.OLLAMA_STREAM_DONE_GRACE_CHUNKS
+    assert 'prompt_eval_count' not in timings
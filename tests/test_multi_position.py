@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+RESUME = 'John Smith\njohn@example.com\n0812345678\nSKILLS\nPython, SQL, Docker'
+
+
+@pytest.fixture
+def context(app, no_document_store):
+    return app.ResumeContext(RESUME)
+
+
+@pytest.fixture
+def fresh_stats(app, monkeypatch):
+    stats = app.AnalysisParseStats()
+    monkeypatch.setattr(app, 'analysis_parse_stats', stats)
+    monkeypatch.setattr(app, 'analysis_cache', app.AnalysisCache(db_path=None))
+    return stats
+
+
+def positions(*descriptions):
+    return [(idx, {'title': f'Job {idx}', 'description': description})
+            for idx, description in enumerate(descriptions)]
+
+
+def test_pack_keeps_every_position_once_in_order(app, context):
+    items = positions('Python developer', 'SQL analyst', 'Docker ops', 'Go backend')
+    groups = app.pack_positions_for_prompt(items, context, max_per_call=3)
+    assert sorted(item for group in groups for item in group) == items
+    assert all(len(group) <= 3 for group in groups)
+    assert all(group == sorted(group) for group in groups)
+    assert len(groups) == 2
+
+
+def position_cost(app, order, jd_data):
+    block = app.multi_position_jd_block(order + 1, jd_data['title'], app.job_features_for(jd_data).prompt_fragment)
+    return app.estimate_prompt_tokens(block) + app.MULTI_POSITION_OUTPUT_TOKENS
+
+
+def test_pack_splits_by_context_budget(app, context, monkeypatch):
+    long_jd = 'พัฒนาระบบหลังบ้านด้วยภาษาไพธอน ' * 60
+    items = positions(long_jd, 'SQL analyst', long_jd + ' ', 'Docker ops')
+    base = app.estimate_prompt_tokens(
+        app.build_multi_position_prompt(context.known_personal_info(), context.prompt_resume, []))
+    costs = [position_cost(app, order, jd_data) for order, (_, jd_data) in enumerate(items)]
+    # ใส่ JD ยาวได้ 1 ตำแหน่งพร้อมตำแหน่งสั้นทั้งสอง แต่ใส่ JD ยาวสองตำแหน่งพร้อมกันไม่ได้
+    assert costs[1] + costs[3] < costs[2]
+    monkeypatch.setitem(app.OLLAMA_OPTIONS, 'num_ctx', base + costs[0] + costs[2] - 1)
+    monkeypatch.setitem(app.OLLAMA_OPTIONS, 'num_predict', -1)
+    groups = app.pack_positions_for_prompt(items, context, max_per_call=5)
+    assert len(groups) == 2
+    assert all(len({0, 2} & {idx for idx, _ in group}) == 1 for group in groups)
+
+
+def test_position_larger_than_context_gets_own_prompt(app, context, monkeypatch):
+    monkeypatch.setitem(app.OLLAMA_OPTIONS, 'num_ctx', 1)
+    groups = app.pack_positions_for_prompt(positions('a', 'b', 'c'), context, max_per_call=5)
+    assert [[idx for idx, _ in group] for group in groups] == [[0], [1], [2]]
+
+
+def test_pack_limits_positions_by_num_predict(app, context, monkeypatch):
+    monkeypatch.setitem(app.OLLAMA_OPTIONS, 'num_predict', app.MULTI_POSITION_OUTPUT_TOKENS * 2)
+    groups = app.pack_positions_for_prompt(positions('a', 'b', 'c', 'd', 'e'), context, max_per_call=5)
+    assert sorted(len(group) for group in groups) == [1, 2, 2]
+
+
+def analysis_item(title):
+    return {'job_title': title, 'summary': 's', 'skills_detected': ['Python'], 'strengths': ['a', 'b', 'c'],
+            'skill_gaps': ['x', 'y'], 'match_percentage': '70%', 'why_suitable': 'w', 'recommendation': 'r'}
+
+
+def test_parse_stats_count_each_position(app, context, fresh_stats, monkeypatch):
+    response = {'full_name': 'John Smith', 'email': 'john@example.com', 'phone': '0812345678',
+                'results': [analysis_item('Job 0'), analysis_item('Job 2')]}
+    monkeypatch.setattr(app, 'call_llama', lambda *args, **kwargs: 'Here: ' + json.dumps(response))
+    results = app.analyze_positions_with_llama(RESUME, positions('Python', 'SQL', 'Docker'), context=context)
+    assert sorted(results) == [0, 2]
+    stats = fresh_stats.stats()
+    assert (stats['extracted'], stats['failed'], stats['strict']) == (2, 1, 0)
+
+
+def test_unparseable_response_counts_every_position(app, context, fresh_stats, monkeypatch):
+    monkeypatch.setattr(app, 'call_llama', lambda *args, **kwargs: 'not json')
+    assert app.analyze_positions_with_llama(RESUME, positions('Python', 'SQL'), context=context) == {}
+    assert fresh_stats.stats()['failed'] == 2
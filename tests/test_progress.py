@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def store(app):
+    return app.ProgressStore(initial_position_time=20)
+
+
+def test_eta_uses_average_before_any_position_finishes(store):
+    store.start('job', total=4, workers=2)
+    assert 30 <= store.get('job')['eta_seconds'] <= 40
+
+
+def test_eta_uses_throughput_of_finished_positions(store, monkeypatch, app):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    store.start('job', total=4)
+    now[0] += 10
+    store.position_finished('job', 'A', 10)
+    assert store.get('job')['eta_seconds'] == 30
+
+
+def test_skipped_positions_do_not_touch_average(store):
+    store.start('job', total=3)
+    store.position_finished('job', 'A', 0, skipped=True)
+    assert store.avg_position_time == 20
+    store.position_finished('job', 'B', 10)
+    assert store.avg_position_time == pytest.approx(17)
+
+
+def test_skipped_positions_do_not_inflate_throughput(store, monkeypatch, app):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    store.start('job', total=4)
+    store.position_finished('job', 'A', 0, skipped=True)
+    store.position_finished('job', 'B', 0, skipped=True)
+    now[0] += 1
+    snapshot = store.get('job')
+    assert snapshot['current'] == 2
+    assert snapshot['progress'] == 50
+    # ยังไม่มีตำแหน่งที่วิเคราะห์จริง ใช้ค่าเฉลี่ย (2 ตำแหน่ง x 20 วินาที) ไม่ใช่ throughput ของตำแหน่งที่ข้าม
+    assert snapshot['eta_seconds'] == 39
+    now[0] += 19
+    store.position_finished('job', 'C', 19)
+    assert store.get('job')['eta_seconds'] == 20
+
+
+def test_finished_progress_has_no_eta(store):
+    store.start('job', total=2)
+    store.position_finished('job', 'A', 1)
+    store.finish('job')
+    snapshot = store.get('job')
+    assert snapshot['status'] == 'completed'
+    assert snapshot['eta_seconds'] == 0
@@ -0,0 +1,60 @@
+import pytest
+
+ENGLISH_RESUME = (
+    "John Smith\nSUMMARY\nBackend developer\nEXPERIENCE\nAcme Corp 2019-2023\n"
+    "5 years of experience in Python\nEDUCATION\nBSc Computer Science\nSKILLS\nPython, SQL"
+)
+
+# ผลจาก clean_resume_text เวอร์ชันก่อนใช้ ResumeSectionParser
+BASELINE_CLEAN = [
+    (ENGLISH_RESUME,
+     '=== SUMMARY ===\nBackend developer\n\n=== EXPERIENCE ===\nAcme Corp 2019-2023 5 years of experience in Python'
+     '\n\n=== EDUCATION ===\nBSc Computer Science\n\n=== SKILLS ===\nPython, SQL\n\n=== OTHER ===\n'
+     'John Smith Backend developer Acme Corp 2019-2023 BSc Computer Science Python, SQL'),
+    ("ประวัติส่วนตัว\nสมชาย ใจดี\nประสบการณ์ทำงาน\nบริษัท ABC\nการศึกษา\nปริญญาตรี\nทักษะ\nExcel",
+     '=== SUMMARY ===\nสมชาย ใจดี\n\n=== EXPERIENCE ===\nบริษัท ABC\n\n=== EDUCATION ===\nปริญญาตรี'
+     '\n\n=== SKILLS ===\nExcel\n\n=== OTHER ===\nสมชาย ใจดี บริษัท ABC ปริญญาตรี Excel'),
+    ("Plain text with no headers\nJust lines", 'Plain text with no headers\nJust lines'),
+    ("Work Experience\nDev\nTechnical Skills\nGo\nWork\nmore work\n\n\n\nSkills   and    abilities\nRust",
+     '=== SKILLS ===\nRust\n\n=== OTHER ===\nDev Go Rust'),
+    ("", ''),
+]
+
+
+@pytest.mark.parametrize('text,expected', BASELINE_CLEAN)
+def test_clean_resume_text_matches_baseline(app, text, expected):
+    assert app.clean_resume_text(text) == expected
+
+
+def test_clean_resume_text_reuses_parsed_sections(app):
+    parsed = app.parse_resume_sections(ENGLISH_RESUME)
+    assert app.clean_resume_text(ENGLISH_RESUME, parsed) == app.clean_resume_text(ENGLISH_RESUME)
+
+
+def test_parse_keeps_document_order_and_offsets(app):
+    text = app.normalize_resume_whitespace(ENGLISH_RESUME)
+    sections, unlabeled = app.resume_section_parser.parse(text)
+    assert [s['name'] for s in sections] == [None, 'summary', 'experience', 'education', 'skills']
+    assert sections[0]['lines'] == ['John Smith']
+    experience = sections[2]
+    assert experience['header'] == 'EXPERIENCE'
+    assert experience['lines'] == ['Acme Corp 2019-2023', '5 years of experience in Python']
+    assert text[experience['start']:experience['end']] == (
+        'EXPERIENCE\nAcme Corp 2019-2023\n5 years of experience in Python')
+    assert unlabeled == ['John Smith', 'Backend developer', 'Acme Corp 2019-2023', 'BSc Computer Science',
+                         'Python, SQL']
+
+
+def test_section_of_uses_highest_priority_keyword(app):
+    parser = app.resume_section_parser
+    assert parser.section_of('technical skills and work experience') == 'experience'
+    assert parser.section_of('professional summary of experience') == 'summary'
+    assert parser.section_of('ทักษะ') == 'skills'
+    assert parser.section_of('hobbies') is None
+
+
+def test_custom_keywords(app):
+    parser = app.ResumeSectionParser({'projects': ['projects', 'โครงการ'], 'awards': ['awards']})
+    sections, _ = parser.parse('Projects\nResume parser\nAwards\nBest intern')
+    assert [(s['name'], s['lines']) for s in sections] == [
+        ('projects', ['Resume parser']), ('awards', ['Best intern'])]
@@ -0,0 +1,35 @@
+import json
+
+
+def parse_sse(body):
+    events = []
+    for frame in body.split('\n\n'):
+        lines = frame.split('\n')
+        event = next((line[7:] for line in lines if line.startswith('event: ')), None)
+        data = ''.join(line[6:] for line in lines if line.startswith('data: '))
+        if event and data:
+            events.append((event, json.loads(data)))
+    return events
+
+
+def test_result_events_carry_personal_info(app, monkeypatch):
+    def fake_auto_analysis(resume_text, model=None, progress_id=None, on_result=None):
+        result = {'job_title': 'Backend', 'match_score': 70, 'match_percentage': '70%',
+                  'full_name': 'Jane Doe', 'email': 'jane@example.com', 'phone': '0812345678',
+                  'job_description': 'ไม่ส่งไปกับ event'}
+        on_result(result)
+        return app.build_auto_analysis_response([result])
+
+    monkeypatch.setattr(app, 'run_auto_analysis', fake_auto_analysis)
+    client = app.app.test_client()
+    response = client.post('/api/analyze-stream', json={'resume': 'Jane Doe python'})
+    events = parse_sse(response.get_data(as_text=True))
+
+    names = [event for event, _ in events]
+    assert names[0] == 'start' and names[-1] == 'done'
+    result = dict(events)['result']
+    assert result['full_name'] == 'Jane Doe'
+    assert result['email'] == 'jane@example.com'
+    assert result['phone'] == '0812345678'
+    assert 'job_description' not in result
+    assert dict(events)['done']['full_name'] == 'Jane Doe'